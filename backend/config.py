@@ -3,12 +3,112 @@ from typing import List, Union
 
 class Settings(BaseSettings):
     DATABASE_URL: str = "sqlite:///./roof_quote_pro.db"
+    DATABASE_READ_URLS: str = ""
+    READ_YOUR_WRITES_SECONDS: int = 10
+    DB_POOL_SIZE: int = 10
+    DB_MAX_OVERFLOW: int = 30
+    DB_POOL_TIMEOUT: float = 30.0
+    DB_POOL_RECYCLE: int = 1800
+    DB_POOL_PRE_PING: bool = True
+    SQLITE_JOURNAL_MODE: str = "WAL"
+    SQLITE_SYNCHRONOUS: str = "NORMAL"
+    SQLITE_BUSY_TIMEOUT_MS: int = 5000
+    SQLITE_MMAP_SIZE: int = 268435456
+    SQLITE_CACHE_SIZE_KB: int = 65536
     ENVIRONMENT: str = "development"
     CORS_ORIGINS: Union[str, List[str]] = "http://localhost:5173,http://localhost:3000"
     SECRET_KEY: str = "dev-secret-key-change-in-production"
     GOOGLE_MAPS_API_KEY: str = "placeholder-api-key"
     UPLOAD_DIR: str = "uploads"
     MAX_UPLOAD_SIZE: int = 5242880
+    THREADPOOL_SIZE: int = 40
+    CACHE_BACKEND: str = "memory"
+    CACHE_URL: str = "redis://localhost:6379/0"
+    CACHE_PREFIX: str = "rqp"
+    CACHE_DEFAULT_TTL: float = 300.0
+    CACHE_MAX_ENTRIES: int = 10000
+    CACHE_LOCK_TTL: float = 10.0
+    CACHE_LOCK_POLL_INTERVAL: float = 0.05
+    CACHE_SOCKET_TIMEOUT: float = 0.5
+    WIDGET_DATA_CACHE_TTL: int = 300
+    WIDGET_DATA_MAX_AGE: int = 60
+    ANALYTICS_QUEUE_SIZE: int = 10000
+    ANALYTICS_BATCH_SIZE: int = 500
+    ANALYTICS_FLUSH_INTERVAL: float = 1.0
+    ANALYTICS_CONTRACTOR_CACHE_TTL: float = 60.0
+    ANALYTICS_WRITE_ATTEMPTS: int = 5
+    ANALYTICS_RETRY_BASE: float = 0.5
+    ANALYTICS_RETRY_MAX: float = 30.0
+    ANALYTICS_SPILL_DIR: str = "analytics_spill"
+    ANALYTICS_ROLLUP_INTERVAL: float = 300.0
+    ANALYTICS_CACHE_TTL: int = 30
+    ANALYTICS_ROLLUP_GRACE_SECONDS: int = 300
+    ANALYTICS_ROLLUP_LEASE_SECONDS: int = 900
+    ROOF_MEASUREMENT_PROVIDERS: str = "footprints,heuristic"
+    ROOF_MEASUREMENT_CACHE_TTL_DAYS: int = 180
+    ROOF_MEASUREMENT_FALLBACK_TTL_SECONDS: int = 3600
+    FOOTPRINT_SEARCH_RADIUS_M: float = 50.0
+    REPRICING_CHUNK_SIZE: int = 1000
+    QUOTE_BATCH_CONCURRENCY: int = 8
+    QUOTE_BATCH_MAX_ADDRESSES: int = 5000
+    LEAD_IMPORT_CHUNK_SIZE: int = 2000
+    LEAD_IMPORT_MAX_ERRORS: int = 1000
+    LEAD_IMPORT_MAX_BYTES: int = 524288000
+    REPRICING_POLL_INTERVAL: float = 5.0
+    REPRICING_LEASE_SECONDS: int = 300
+    CRM_API_URL: str = ""
+    CRM_API_KEY: str = ""
+    CRM_TIMEOUT: float = 10.0
+    CRM_CONCURRENCY: int = 8
+    CRM_BULK_SIZE: int = 50
+    CRM_SYNC_INTERVAL: float = 0.0
+    CRM_SYNC_CHUNK_SIZE: int = 500
+    CRM_SYNC_LAG_SECONDS: int = 5
+    CRM_SYNC_LEASE_SECONDS: int = 600
+    WEBHOOK_TIMEOUT: float = 10.0
+    WEBHOOK_HTTP2: bool = True
+    WEBHOOK_MAX_CONNECTIONS: int = 100
+    WEBHOOK_PER_HOST_CONCURRENCY: int = 4
+    WEBHOOK_BATCH_SIZE: int = 100
+    WEBHOOK_POLL_INTERVAL: float = 2.0
+    WEBHOOK_LEASE_SECONDS: int = 60
+    WEBHOOK_MAX_ATTEMPTS: int = 8
+    WEBHOOK_BACKOFF_BASE: float = 10.0
+    WEBHOOK_BACKOFF_MAX: float = 3600.0
+    
+    EMAIL_API_URL: str = "https://api.sendgrid.com"
+    EMAIL_TIMEOUT: float = 30.0
+    EMAIL_CONCURRENCY: int = 4
+    EMAIL_BATCH_SIZE: int = 50
+    EMAIL_MAX_PERSONALIZATIONS: int = 1000
+    EMAIL_POLL_INTERVAL: float = 2.0
+    EMAIL_LEASE_SECONDS: int = 120
+    EMAIL_MAX_ATTEMPTS: int = 5
+    EMAIL_BACKOFF_BASE: float = 30.0
+    EMAIL_BACKOFF_MAX: float = 1800.0
+    
+    PDF_DIR: str = "pdfs"
+    PDF_RENDER_WORKERS: int = 2
+    PDF_RENDER_TIMEOUT: float = 30.0
+    PDF_TEMPLATE_CACHE_TTL: int = 3600
+    TEMPLATE_PAGE_CACHE_SIZE: int = 512
+    
+    UPLOAD_MAX_AGE: int = 3600
+    UPLOAD_IMMUTABLE_MAX_AGE: int = 31536000
+    LOGO_VARIANT_WIDTHS: List[int] = [160, 320, 640]
+    LOGO_WIDGET_WIDTH: int = 320
+    LOGO_WEBP_QUALITY: int = 85
+    LOGO_MAX_PIXELS: int = 40_000_000
+    LOGO_WORKERS: int = 1
+    LOGO_RESIZE_TIMEOUT: float = 30.0
+    
+    WIDGET_BUNDLE_DIR: str = "widget_bundles"
+    WIDGET_BUNDLE_BASE_URL: str = "http://localhost:8000"
+    WIDGET_SCRIPT_URL: str = "http://localhost:5173/widget.js"
+    WIDGET_EMBED_URL: str = "http://localhost:5173/widget-embed"
+    WIDGET_LOADER_MAX_AGE: int = 300
+    WIDGET_BUNDLE_KEEP_VERSIONS: int = 5
+    WIDGET_BUNDLE_DEBOUNCE: float = 0.5
     
     class Config:
         env_file = ".env"
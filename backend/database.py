@@ -1,14 +1,189 @@
-from sqlalchemy import create_engine
+import itertools
+import threading
+import time
+from typing import List
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy.orm import Session, sessionmaker
+from sqlalchemy.pool import QueuePool
+from sqlalchemy.schema import CreateColumn
 from config import settings
 
 SQLALCHEMY_DATABASE_URL = settings.DATABASE_URL
 
-engine = create_engine(
-    SQLALCHEMY_DATABASE_URL,
-    connect_args={"check_same_thread": False} if SQLALCHEMY_DATABASE_URL.startswith("sqlite") else {}
-)
+class PoolMetrics:
+    """
+    Connection pool counters for sizing workers against the pool.
+    
+    Wait time is how long a checkout took to get a connection, including
+    opening a new one; hold time is how long it then stayed checked out.
+    Rising waits with the pool fully checked out mean more workers than
+    connections.
+    """
+    
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.checkouts = 0
+        self.timeouts = 0
+        self.waiting = 0
+        self.max_waiting = 0
+        self.wait_seconds = 0.0
+        self.max_wait_seconds = 0.0
+        self.hold_seconds = 0.0
+        self.max_hold_seconds = 0.0
+    
+    def wait_started(self) -> None:
+        with self._lock:
+            self.waiting += 1
+            self.max_waiting = max(self.max_waiting, self.waiting)
+    
+    def wait_finished(self, seconds: float, timed_out: bool) -> None:
+        with self._lock:
+            self.waiting -= 1
+            if timed_out:
+                self.timeouts += 1
+                return
+            self.checkouts += 1
+            self.wait_seconds += seconds
+            self.max_wait_seconds = max(self.max_wait_seconds, seconds)
+    
+    def checked_in(self, seconds: float) -> None:
+        with self._lock:
+            self.hold_seconds += seconds
+            self.max_hold_seconds = max(self.max_hold_seconds, seconds)
+    
+    def snapshot(self, pool) -> dict:
+        with self._lock:
+            checkouts = self.checkouts
+            stats = {
+                "checkouts": checkouts,
+                "timeouts": self.timeouts,
+                "waiting": self.waiting,
+                "max_waiting": self.max_waiting,
+                "avg_wait_ms": round(self.wait_seconds / checkouts * 1000, 3) if checkouts else 0.0,
+                "max_wait_ms": round(self.max_wait_seconds * 1000, 3),
+                "avg_hold_ms": round(self.hold_seconds / checkouts * 1000, 3) if checkouts else 0.0,
+                "max_hold_ms": round(self.max_hold_seconds * 1000, 3)
+            }
+        if isinstance(pool, QueuePool):
+            stats.update({
+                "pool_size": pool.size(),
+                "checked_out": pool.checkedout(),
+                "checked_in": pool.checkedin(),
+                "overflow": max(pool.overflow(), 0),
+                "max_overflow": pool._max_overflow
+            })
+        return stats
+
+class InstrumentedQueuePool(QueuePool):
+    """QueuePool that records how long checkouts wait for a free connection."""
+    
+    def __init__(self, *args, **kwargs):
+        self.metrics = PoolMetrics()
+        super().__init__(*args, **kwargs)
+    
+    def recreate(self):
+        pool = super().recreate()
+        pool.metrics = self.metrics
+        return pool
+    
+    def _do_get(self):
+        self.metrics.wait_started()
+        started = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            self.metrics.wait_finished(time.perf_counter() - started, timed_out=True)
+            raise
+        self.metrics.wait_finished(time.perf_counter() - started, timed_out=False)
+        return connection
+
+def apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute(f"PRAGMA journal_mode={settings.SQLITE_JOURNAL_MODE}")
+        cursor.execute(f"PRAGMA synchronous={settings.SQLITE_SYNCHRONOUS}")
+        cursor.execute(f"PRAGMA busy_timeout={int(settings.SQLITE_BUSY_TIMEOUT_MS)}")
+        cursor.execute(f"PRAGMA mmap_size={int(settings.SQLITE_MMAP_SIZE)}")
+        # A negative cache_size is in KiB rather than pages
+        cursor.execute(f"PRAGMA cache_size=-{int(settings.SQLITE_CACHE_SIZE_KB)}")
+    finally:
+        cursor.close()
+
+def apply_sqlite_query_only(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        cursor.execute("PRAGMA query_only=ON")
+    finally:
+        cursor.close()
+
+def create_db_engine(url: str, read_only: bool = False) -> Engine:
+    """
+    Engine with the pool and connection settings from config.
+    
+    File-backed SQLite gets WAL mode and the other pragmas on every new
+    connection; in-memory SQLite keeps SQLAlchemy's single-connection pool.
+    A ``read_only`` engine refuses writes, so a handler routed to a replica
+    by mistake fails loudly instead of writing somewhere it should not.
+    """
+    parsed = make_url(url)
+    is_sqlite = parsed.get_backend_name() == "sqlite"
+    in_memory = is_sqlite and parsed.database in (None, "", ":memory:")
+    
+    kwargs = {}
+    if is_sqlite:
+        kwargs["connect_args"] = {"check_same_thread": False}
+    elif read_only and parsed.get_backend_name() == "postgresql":
+        kwargs["connect_args"] = {"options": "-c default_transaction_read_only=on"}
+    if not in_memory:
+        kwargs.update(
+            poolclass=InstrumentedQueuePool,
+            pool_size=settings.DB_POOL_SIZE,
+            max_overflow=settings.DB_MAX_OVERFLOW,
+            pool_timeout=settings.DB_POOL_TIMEOUT,
+            pool_recycle=settings.DB_POOL_RECYCLE,
+            pool_pre_ping=settings.DB_POOL_PRE_PING
+        )
+    
+    db_engine = create_engine(url, **kwargs)
+    if is_sqlite and read_only:
+        event.listen(db_engine, "connect", apply_sqlite_query_only)
+    if in_memory:
+        return db_engine
+    
+    if is_sqlite:
+        event.listen(db_engine, "connect", apply_sqlite_pragmas)
+    
+    @event.listens_for(db_engine, "checkout")
+    def record_checkout(dbapi_connection, connection_record, connection_proxy):
+        connection_record.info["checked_out_at"] = time.perf_counter()
+    
+    @event.listens_for(db_engine, "checkin")
+    def record_checkin(dbapi_connection, connection_record):
+        checked_out_at = connection_record.info.pop("checked_out_at", None)
+        if checked_out_at is not None:
+            db_engine.pool.metrics.checked_in(time.perf_counter() - checked_out_at)
+    
+    return db_engine
+
+def pool_status(db_engine: Engine) -> dict:
+    metrics = getattr(db_engine.pool, "metrics", None)
+    if metrics is None:
+        return {"pool": type(db_engine.pool).__name__}
+    return metrics.snapshot(db_engine.pool)
+
+engine = create_db_engine(SQLALCHEMY_DATABASE_URL)
+
+read_engines: List[Engine] = [
+    create_db_engine(url.strip(), read_only=True)
+    for url in settings.DATABASE_READ_URLS.split(",")
+    if url.strip()
+]
+
+_read_engine_cycle = itertools.cycle(read_engines)
+_read_engine_lock = threading.Lock()
 
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
@@ -19,4 +194,64 @@ def get_db():
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+def next_read_engine() -> Engine:
+    """The next replica in round-robin order, or the primary when none are configured."""
+    if not read_engines:
+        return engine
+    with _read_engine_lock:
+        return next(_read_engine_cycle)
+
+def read_session(primary: bool = False) -> Session:
+    return SessionLocal(bind=engine if primary else next_read_engine())
+
+def begin_nested(db: Session):
+    """
+    ``db.begin_nested()`` that stays inside the session's transaction on SQLite.
+    
+    pysqlite only opens a transaction before INSERT/UPDATE/DELETE, so a
+    SAVEPOINT issued first starts a transaction of its own and releasing it
+    commits straight to disk, before the caller decides to.
+    """
+    if db.get_bind().dialect.name == "sqlite":
+        dbapi_connection = db.connection().connection.dbapi_connection
+        if not dbapi_connection.in_transaction:
+            dbapi_connection.execute("BEGIN")
+    return db.begin_nested()
+
+def ensure_schema():
+    """
+    Bring an existing database up to date with additive model changes.
+
+    create_all() only creates missing tables, so nullable columns and
+    indexes added to existing tables are created here. On SQLite, lead timestamps written by
+    CURRENT_TIMESTAMP are padded to the microsecond format SQLAlchemy uses,
+    so they compare correctly against bound datetimes. Leads from before
+    updated_at was set on insert get their creation time.
+    """
+    inspector = inspect(engine)
+    for table in Base.metadata.sorted_tables:
+        existing = {column["name"] for column in inspector.get_columns(table.name)}
+        for column in table.columns:
+            if column.name not in existing and column.nullable:
+                with engine.begin() as conn:
+                    conn.execute(text(
+                        f"ALTER TABLE {table.name} ADD COLUMN {CreateColumn(column).compile(dialect=engine.dialect)}"
+                    ))
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            conn.execute(text(
+                "UPDATE leads SET created_at = created_at || '.000000' "
+                "WHERE length(created_at) = 19"
+            ))
+            conn.execute(text(
+                "UPDATE leads SET updated_at = updated_at || '.000000' "
+                "WHERE length(updated_at) = 19"
+            ))
+    
+    with engine.begin() as conn:
+        conn.execute(text("UPDATE leads SET updated_at = created_at WHERE updated_at IS NULL"))
@@ -1,13 +1,26 @@
 from fastapi import FastAPI, Request
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
 from contextlib import asynccontextmanager
+import anyio
 import logging
 import os
+import time
 from config import settings
-from database import engine, Base
+from database import engine, read_engines, Base, ensure_schema, pool_status
+from sqlalchemy import text
 from seed_data import seed_database
+from services import building_footprints, lead_search
+from services.analytics_ingest import analytics_ingestor
+from services.analytics_rollup import rollup_compactor
+from services.crm import crm_sync_scheduler
+from services.email_service import email_dispatcher
+from services.logo_storage import CONTENT_ADDRESSED, logo_pool
+from services.quote_pdf import render_pool
+from services.quote_repricing import quote_repricer
+from services.static_files import CachedStaticFiles
+from services.webhooks import webhook_dispatcher
+from services.widget_bundles import BUNDLE_PATH, CONFIG_NAME, widget_bundle_publisher
 from routers import (
     contractor,
     pricing,
@@ -26,10 +39,31 @@ logger = logging.getLogger(__name__)
 
 @asynccontextmanager
 async def lifespan(app: FastAPI):
+    # Sync handlers and their DB calls run on this pool, so it bounds request concurrency
+    anyio.to_thread.current_default_thread_limiter().total_tokens = settings.THREADPOOL_SIZE
     Base.metadata.create_all(bind=engine)
+    ensure_schema()
+    lead_search.install(engine)
+    building_footprints.install(engine)
     seed_database()
+    await analytics_ingestor.start()
+    await rollup_compactor.start()
+    await quote_repricer.start()
+    await webhook_dispatcher.start()
+    await email_dispatcher.start()
+    await crm_sync_scheduler.start()
+    await widget_bundle_publisher.start()
     yield
     logger.info("Shutting down application")
+    await widget_bundle_publisher.stop()
+    await crm_sync_scheduler.stop()
+    await render_pool.stop()
+    await logo_pool.stop()
+    await email_dispatcher.stop()
+    await webhook_dispatcher.stop()
+    await quote_repricer.stop()
+    await rollup_compactor.stop()
+    await analytics_ingestor.stop()
 
 app = FastAPI(
     title="Roof Quote Pro API",
@@ -44,11 +78,27 @@ app.add_middleware(
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["ETag", "X-Next-Cursor", "X-Repricing-Job", "X-Read-Primary"],
 )
 
 # Mount static files for uploads
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
-app.mount(f"/{settings.UPLOAD_DIR}", StaticFiles(directory=settings.UPLOAD_DIR), name="uploads")
+app.mount(f"/{settings.UPLOAD_DIR}", CachedStaticFiles(
+    directory=settings.UPLOAD_DIR,
+    immutable=CONTENT_ADDRESSED,
+    max_age=settings.UPLOAD_MAX_AGE,
+    immutable_max_age=settings.UPLOAD_IMMUTABLE_MAX_AGE
+), name="uploads")
+
+# Published widget bundles, fetched by embed scripts on contractors' sites
+os.makedirs(settings.WIDGET_BUNDLE_DIR, exist_ok=True)
+app.mount(BUNDLE_PATH, CachedStaticFiles(
+    directory=settings.WIDGET_BUNDLE_DIR,
+    immutable=CONFIG_NAME,
+    max_age=settings.WIDGET_LOADER_MAX_AGE,
+    immutable_max_age=settings.UPLOAD_IMMUTABLE_MAX_AGE,
+    allow_any_origin=True
+), name="widget-bundles")
 
 @app.exception_handler(ValueError)
 async def value_error_handler(request: Request, exc: ValueError):
@@ -73,6 +123,22 @@ async def root():
 async def health_check():
     return {"status": "healthy"}
 
+@app.get("/health/db")
+def database_health():
+    started = time.perf_counter()
+    with engine.connect() as conn:
+        conn.execute(text("SELECT 1"))
+    return {
+        "status": "healthy",
+        "dialect": engine.dialect.name,
+        "ping_ms": round((time.perf_counter() - started) * 1000, 3),
+        "pool": pool_status(engine),
+        "replicas": [
+            {"url": read_engine.url.render_as_string(hide_password=True), "pool": pool_status(read_engine)}
+            for read_engine in read_engines
+        ]
+    }
+
 app.include_router(contractor.router, prefix="/api/contractors", tags=["contractors"])
 app.include_router(pricing.router, prefix="/api/pricing", tags=["pricing"])
 app.include_router(branding.router, prefix="/api/branding", tags=["branding"])
@@ -1,8 +1,12 @@
-from sqlalchemy import Column, Integer, String, Float, Boolean, DateTime, Text, JSON, ForeignKey
+from sqlalchemy import Column, Integer, String, Float, Boolean, Date, DateTime, Text, JSON, ForeignKey, Index, UniqueConstraint
 from sqlalchemy.orm import relationship
 from sqlalchemy.sql import func
+from datetime import datetime, timezone
 from database import Base
 
+def utcnow():
+    return datetime.now(timezone.utc)
+
 class Contractor(Base):
     __tablename__ = "contractors"
     
@@ -98,11 +102,19 @@ class Lead(Base):
     additional_notes = Column(Text)  # renamed from notes for clarity
     status = Column(String(50), default="new")
     source = Column(String(50), default="widget")
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
-    updated_at = Column(DateTime(timezone=True), onupdate=func.now())
+    # Python-side default keeps microsecond precision, which keyset pagination relies on
+    created_at = Column(DateTime(timezone=True), default=utcnow, server_default=func.now())
+    # Set on insert too, so "changed since" (CRM sync) is one indexed range on updated_at
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
     
     contractor = relationship("Contractor", back_populates="leads")
     quotes = relationship("Quote", back_populates="lead", cascade="all, delete-orphan")
+    
+    __table_args__ = (
+        Index("ix_leads_contractor_created", "contractor_id", "created_at", "id"),
+        Index("ix_leads_contractor_status_created", "contractor_id", "status", "created_at", "id"),
+        Index("ix_leads_contractor_updated", "contractor_id", "updated_at", "id"),
+    )
 
 class Quote(Base):
     __tablename__ = "quotes"
@@ -125,6 +137,10 @@ class Quote(Base):
     created_at = Column(DateTime(timezone=True), server_default=func.now())
     
     lead = relationship("Lead", back_populates="quotes")
+    
+    __table_args__ = (
+        Index("ix_quotes_lead_created", "lead_id", "created_at"),
+    )
 
 class Shingle(Base):
     __tablename__ = "shingles"
@@ -165,4 +181,216 @@ class WidgetAnalytics(Base):
     session_id = Column(String(100))
     ip_address = Column(String(45))
     user_agent = Column(String(500))
-    created_at = Column(DateTime(timezone=True), server_default=func.now())
\ No newline at end of file
+    created_at = Column(DateTime(timezone=True), server_default=func.now())
+    
+    __table_args__ = (
+        Index("ix_widget_analytics_contractor_event_created", "contractor_id", "event_type", "created_at"),
+    )
+
+class DailyEventRollup(Base):
+    __tablename__ = "daily_event_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    event_type = Column(String(50), nullable=False)
+    event_count = Column(Integer, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint("contractor_id", "day", "event_type", name="uq_daily_event_rollups"),
+    )
+
+class DailyLeadRollup(Base):
+    __tablename__ = "daily_lead_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), nullable=False)
+    day = Column(Date, nullable=False)  # day the leads were created
+    status = Column(String(50), nullable=False)
+    source = Column(String(50), nullable=False)
+    lead_count = Column(Integer, nullable=False, default=0)
+    quote_count = Column(Integer, nullable=False, default=0)  # all quotes of these leads
+    quote_value = Column(Float, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint("contractor_id", "day", "status", "source", name="uq_daily_lead_rollups"),
+    )
+
+class DailyQuoteRollup(Base):
+    __tablename__ = "daily_quote_rollups"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), nullable=False)
+    day = Column(Date, nullable=False)  # day the quotes were created
+    tier = Column(String(50), nullable=False)
+    size_bucket = Column(String(20), nullable=False)
+    lead_source = Column(String(50), nullable=False)
+    quote_count = Column(Integer, nullable=False, default=0)
+    total_value = Column(Float, nullable=False, default=0)
+    
+    __table_args__ = (
+        UniqueConstraint("contractor_id", "day", "tier", "size_bucket", "lead_source", name="uq_daily_quote_rollups"),
+    )
+
+class RollupState(Base):
+    __tablename__ = "rollup_state"
+    
+    id = Column(Integer, primary_key=True)
+    compacted_through = Column(Date)  # last day whose rollups are complete
+    locked_until = Column(DateTime(timezone=True))  # lease held by the worker compacting
+    claim_token = Column(String(32))
+    updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
+
+class RollupDirtyDay(Base):
+    __tablename__ = "rollup_dirty_days"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, nullable=False)
+    day = Column(Date, nullable=False)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("contractor_id", "day", name="uq_rollup_dirty_days"),
+    )
+
+class RoofMeasurementCache(Base):
+    __tablename__ = "roof_measurement_cache"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    normalized_address = Column(String(500), unique=True, nullable=False)
+    address = Column(String(500), nullable=False)  # address as first requested
+    provider = Column(String(50), nullable=False)
+    roof_size_sqft = Column(Float, nullable=False)
+    squares = Column(Float, nullable=False)
+    complexity = Column(String(20), nullable=False)
+    pitch = Column(String(10), nullable=False)
+    home_sqft = Column(Float)
+    measurement_data = Column(JSON)  # provider specific details
+    used_location = Column(Boolean)  # measured with the caller's coordinates, not the address alone
+    measured_at = Column(DateTime(timezone=True), default=utcnow)
+    expires_at = Column(DateTime(timezone=True), nullable=False)
+
+class BuildingFootprint(Base):
+    __tablename__ = "building_footprints"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    source_id = Column(String(100), unique=True, nullable=False)  # e.g. "way/123" for OSM
+    address = Column(String(500))
+    normalized_address = Column(String(500), index=True)
+    pitch = Column(String(10))
+    min_lat = Column(Float, nullable=False)
+    max_lat = Column(Float, nullable=False)
+    min_lng = Column(Float, nullable=False)
+    max_lng = Column(Float, nullable=False)
+    centroid_lat = Column(Float, nullable=False)
+    centroid_lng = Column(Float, nullable=False)
+    area_sqft = Column(Float, nullable=False)
+    roof_area_sqft = Column(Float, nullable=False)  # area adjusted for pitch
+    vertices = Column(Integer, nullable=False)
+    rings = Column(JSON, nullable=False)  # outer rings as [[lng, lat], ...]
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    
+    __table_args__ = (
+        Index("ix_building_footprints_bbox", "min_lat", "max_lat", "min_lng", "max_lng"),
+    )
+
+class RepricingJob(Base):
+    __tablename__ = "repricing_jobs"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), nullable=False, index=True)
+    status = Column(String(20), nullable=False, default="pending")  # pending, running, completed, failed
+    changed_fields = Column(JSON)
+    total_quotes = Column(Integer, default=0)
+    processed_quotes = Column(Integer, default=0)
+    updated_quotes = Column(Integer, default=0)
+    skipped_quotes = Column(Integer, default=0)  # quoted options unknown, left at the price the customer saw
+    last_quote_id = Column(Integer, default=0)  # keyset position, so an interrupted job resumes
+    error = Column(Text)
+    locked_until = Column(DateTime(timezone=True))  # lease held by the worker running the job
+    claim_token = Column(String(32))
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    started_at = Column(DateTime(timezone=True))
+    finished_at = Column(DateTime(timezone=True))
+
+class Webhook(Base):
+    __tablename__ = "webhooks"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), nullable=False)
+    event_type = Column(String(50), nullable=False)  # e.g. lead.created, quote.created
+    url = Column(String(1000), nullable=False)
+    active = Column(Boolean, nullable=False, default=True)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    updated_at = Column(DateTime(timezone=True), onupdate=utcnow)
+    
+    __table_args__ = (
+        UniqueConstraint("contractor_id", "event_type", name="uq_webhooks_contractor_event"),
+    )
+
+class WebhookDelivery(Base):
+    __tablename__ = "webhook_deliveries"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    webhook_id = Column(Integer, ForeignKey("webhooks.id"), nullable=False, index=True)
+    contractor_id = Column(Integer, nullable=False)
+    event_type = Column(String(50), nullable=False)
+    url = Column(String(1000), nullable=False)  # target when the event was emitted
+    payload = Column(JSON, nullable=False)
+    status = Column(String(20), nullable=False, default="pending")  # pending, delivered, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    locked_until = Column(DateTime(timezone=True))  # lease held by the worker delivering it
+    claim_token = Column(String(32))
+    last_status_code = Column(Integer)
+    last_error = Column(Text)
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    delivered_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        Index("ix_webhook_deliveries_status_next_attempt", "status", "next_attempt_at"),
+        Index("ix_webhook_deliveries_contractor_created", "contractor_id", "created_at"),
+    )
+
+class CRMSyncState(Base):
+    __tablename__ = "crm_sync_state"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), unique=True, nullable=False)
+    watermark_at = Column(DateTime(timezone=True))  # updated_at of the last lead synced
+    watermark_lead_id = Column(Integer, default=0)  # breaks updated_at ties
+    last_run_at = Column(DateTime(timezone=True))
+    last_synced = Column(Integer, default=0)
+    total_synced = Column(Integer, default=0)
+    last_error = Column(Text)
+    locked_until = Column(DateTime(timezone=True))  # lease held by the worker syncing this contractor
+    claim_token = Column(String(32))
+
+class EmailMessage(Base):
+    __tablename__ = "email_messages"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    message_id = Column(String(32), unique=True, nullable=False)  # public id returned to the caller
+    kind = Column(String(20), nullable=False)  # quote, test, bulk
+    from_email = Column(String(255), nullable=False)
+    from_name = Column(String(255))
+    reply_to = Column(String(255))
+    subject = Column(String(500), nullable=False)
+    text_content = Column(Text)
+    html_content = Column(Text)
+    personalizations = Column(JSON, nullable=False)  # one per recipient, as in the SendGrid v3 API
+    attachments = Column(JSON)
+    status = Column(String(20), nullable=False, default="queued")  # queued, sent, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime(timezone=True), nullable=False, default=utcnow)
+    locked_until = Column(DateTime(timezone=True))  # lease held by the worker sending it
+    claim_token = Column(String(32))
+    last_status_code = Column(Integer)
+    last_error = Column(Text)
+    provider_message_id = Column(String(100))
+    created_at = Column(DateTime(timezone=True), default=utcnow)
+    sent_at = Column(DateTime(timezone=True))
+    
+    __table_args__ = (
+        Index("ix_email_messages_status_next_attempt", "status", "next_attempt_at"),
+    )
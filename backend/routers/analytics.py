@@ -1,11 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.encoders import jsonable_encoder
 from sqlalchemy.orm import Session
-from sqlalchemy import func, and_
+from config import settings
 from database import get_db
-from models import Lead, Quote, WidgetAnalytics, Contractor
-from pydantic import BaseModel
-from datetime import datetime, timedelta
-from typing import Optional, List
+from models import Contractor, utcnow
+from routers.dependencies import get_read_db, pin_reads, reads_from_primary
+from services import analytics_rollup
+from services.analytics_ingest import analytics_ingestor, IngestQueueFull
+from services.cache import shared_cache
+from pydantic import BaseModel, Field
+from collections import defaultdict
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional, List
+import json
 
 router = APIRouter()
 
@@ -17,88 +24,129 @@ class AnalyticsEvent(BaseModel):
     ip_address: Optional[str] = None
     user_agent: Optional[str] = None
 
+class AnalyticsEventBatch(BaseModel):
+    events: List[AnalyticsEvent] = Field(..., min_length=1, max_length=100)
+
 class DateRange(BaseModel):
     start_date: datetime
     end_date: datetime
 
-@router.post("/track")
-async def track_event(event: AnalyticsEvent, db: Session = Depends(get_db)):
-    contractor = db.query(Contractor).filter(Contractor.id == event.contractor_id).first()
-    if not contractor:
+def to_event_row(event: AnalyticsEvent) -> dict:
+    # Stamp the event when it is received, not when the buffer is flushed
+    return {
+        "contractor_id": event.contractor_id,
+        "event_type": event.event_type,
+        "event_data": event.event_data,
+        "session_id": event.session_id,
+        "ip_address": event.ip_address,
+        "user_agent": event.user_agent,
+        "created_at": utcnow()
+    }
+
+async def enqueue_events(rows: List[dict]):
+    try:
+        await analytics_ingestor.submit(rows)
+    except IngestQueueFull:
+        raise HTTPException(
+            status_code=503,
+            detail="Analytics ingestion is busy, retry later",
+            headers={"Retry-After": "1"}
+        )
+
+@router.post("/track", status_code=202)
+async def track_event(event: AnalyticsEvent):
+    if not await analytics_ingestor.is_known_contractor(event.contractor_id):
         raise HTTPException(status_code=404, detail="Contractor not found")
     
-    analytics = WidgetAnalytics(
-        contractor_id=event.contractor_id,
-        event_type=event.event_type,
-        event_data=event.event_data,
-        session_id=event.session_id,
-        ip_address=event.ip_address,
-        user_agent=event.user_agent
-    )
-    
-    db.add(analytics)
-    db.commit()
+    await enqueue_events([to_event_row(event)])
     
     return {"success": True, "message": "Event tracked"}
 
-@router.get("/contractor/{contractor_id}/dashboard")
-async def get_dashboard_stats(
-    contractor_id: int,
-    days: int = 30,
-    db: Session = Depends(get_db)
-):
+@router.post("/track/batch", status_code=202)
+async def track_events_batch(batch: AnalyticsEventBatch):
+    rows = [
+        to_event_row(event)
+        for event in batch.events
+        if await analytics_ingestor.is_known_contractor(event.contractor_id)
+    ]
+    if rows:
+        await enqueue_events(rows)
+    
+    return {
+        "success": True,
+        "accepted": len(rows),
+        "rejected": len(batch.events) - len(rows),
+        "message": f"{len(rows)} events tracked"
+    }
+
+def get_contractor_or_404(db: Session, contractor_id: int) -> Contractor:
     contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
-    
-    cutoff_date = datetime.now() - timedelta(days=days)
-    
-    total_leads = db.query(func.count(Lead.id)).filter(
-        and_(Lead.contractor_id == contractor_id, Lead.created_at >= cutoff_date)
-    ).scalar()
-    
-    new_leads = db.query(func.count(Lead.id)).filter(
-        and_(
-            Lead.contractor_id == contractor_id,
-            Lead.status == "new",
-            Lead.created_at >= cutoff_date
+    return contractor
+
+def window_start(days: int) -> date:
+    # Rollups are per UTC day, so the window covers whole days
+    return analytics_rollup.utc_today() - timedelta(days=days)
+
+def count_by(rows, key: str, measure: str) -> dict:
+    totals = defaultdict(int)
+    for row in rows:
+        totals[getattr(row, key)] += getattr(row, measure)
+    return dict(totals)
+
+def cached_stats(request: Request, contractor_id: int, name: str, days: int, compute: Callable[[], dict]) -> Response:
+    """
+    Serve a stats payload from the shared cache, computing it once per TTL.
+    
+    Requests pinned to the primary just wrote something, so they recompute
+    and refresh the entry instead of reading it.
+    """
+    def load() -> bytes:
+        return json.dumps(jsonable_encoder(compute()), separators=(",", ":")).encode()
+    
+    if reads_from_primary(request):
+        body = load()
+        shared_cache.set(name, str(days), body, contractor_id=contractor_id, ttl=settings.ANALYTICS_CACHE_TTL)
+    else:
+        body = shared_cache.get_or_load(
+            name, str(days), load, contractor_id=contractor_id, ttl=settings.ANALYTICS_CACHE_TTL
         )
-    ).scalar()
+    return Response(content=body, media_type="application/json")
+
+@router.post("/rollups/compact", dependencies=[Depends(pin_reads)])
+def compact_rollups(db: Session = Depends(get_db)):
+    result = analytics_rollup.compact_leased(db)
+    if result is None:
+        raise HTTPException(status_code=409, detail="Rollup compaction is already running")
+    return result
+
+@router.get("/contractor/{contractor_id}/dashboard")
+def get_dashboard_stats(
+    contractor_id: int,
+    request: Request,
+    days: int = 30,
+    db: Session = Depends(get_read_db)
+):
+    return cached_stats(request, contractor_id, "dashboard_stats", days, lambda: dashboard_stats(db, contractor_id, days))
+
+def dashboard_stats(db: Session, contractor_id: int, days: int) -> dict:
+    get_contractor_or_404(db, contractor_id)
+    since = window_start(days)
+    compacted_through = analytics_rollup.get_compacted_through(db)
     
-    total_quotes = db.query(func.count(Quote.id)).join(Lead).filter(
-        and_(Lead.contractor_id == contractor_id, Quote.created_at >= cutoff_date)
-    ).scalar()
+    lead_rows = analytics_rollup.load_rows(db, "leads", contractor_id, since, compacted_through)
+    quote_rows = analytics_rollup.load_rows(db, "quotes", contractor_id, since, compacted_through)
+    event_rows = analytics_rollup.load_rows(db, "events", contractor_id, since, compacted_through)
     
-    total_value = db.query(func.sum(Quote.total_price)).join(Lead).filter(
-        and_(Lead.contractor_id == contractor_id, Quote.created_at >= cutoff_date)
-    ).scalar() or 0
+    lead_status_breakdown = count_by(lead_rows, "status", "lead_count")
+    total_leads = sum(lead_status_breakdown.values())
+    new_leads = lead_status_breakdown.get("new", 0)
     
+    total_quotes = sum(row.quote_count for row in quote_rows)
+    total_value = sum(row.total_value for row in quote_rows)
     avg_quote_value = total_value / total_quotes if total_quotes > 0 else 0
     
-    lead_status_breakdown = db.query(
-        Lead.status,
-        func.count(Lead.id)
-    ).filter(
-        and_(Lead.contractor_id == contractor_id, Lead.created_at >= cutoff_date)
-    ).group_by(Lead.status).all()
-    
-    tier_breakdown = db.query(
-        Quote.selected_tier,
-        func.count(Quote.id)
-    ).join(Lead).filter(
-        and_(Lead.contractor_id == contractor_id, Quote.created_at >= cutoff_date)
-    ).group_by(Quote.selected_tier).all()
-    
-    widget_events = db.query(
-        WidgetAnalytics.event_type,
-        func.count(WidgetAnalytics.id)
-    ).filter(
-        and_(
-            WidgetAnalytics.contractor_id == contractor_id,
-            WidgetAnalytics.created_at >= cutoff_date
-        )
-    ).group_by(WidgetAnalytics.event_type).all()
-    
     return {
         "period": f"Last {days} days",
         "summary": {
@@ -108,62 +156,32 @@ async def get_dashboard_stats(
             "total_value": round(total_value, 2),
             "average_quote_value": round(avg_quote_value, 2)
         },
-        "lead_status": {status: count for status, count in lead_status_breakdown},
-        "quote_tiers": {tier: count for tier, count in tier_breakdown},
-        "widget_events": {event: count for event, count in widget_events}
+        "lead_status": lead_status_breakdown,
+        "quote_tiers": count_by(quote_rows, "tier", "quote_count"),
+        "widget_events": count_by(event_rows, "event_type", "event_count")
     }
 
 @router.get("/contractor/{contractor_id}/conversion")
-async def get_conversion_metrics(
+def get_conversion_metrics(
     contractor_id: int,
+    request: Request,
     days: int = 30,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
-    if not contractor:
-        raise HTTPException(status_code=404, detail="Contractor not found")
-    
-    cutoff_date = datetime.now() - timedelta(days=days)
-    
-    widget_views = db.query(func.count(WidgetAnalytics.id)).filter(
-        and_(
-            WidgetAnalytics.contractor_id == contractor_id,
-            WidgetAnalytics.event_type == "widget_view",
-            WidgetAnalytics.created_at >= cutoff_date
-        )
-    ).scalar() or 0
-    
-    widget_opens = db.query(func.count(WidgetAnalytics.id)).filter(
-        and_(
-            WidgetAnalytics.contractor_id == contractor_id,
-            WidgetAnalytics.event_type == "widget_open",
-            WidgetAnalytics.created_at >= cutoff_date
-        )
-    ).scalar() or 0
-    
-    quote_requests = db.query(func.count(WidgetAnalytics.id)).filter(
-        and_(
-            WidgetAnalytics.contractor_id == contractor_id,
-            WidgetAnalytics.event_type == "quote_request",
-            WidgetAnalytics.created_at >= cutoff_date
-        )
-    ).scalar() or 0
-    
-    leads_created = db.query(func.count(Lead.id)).filter(
-        and_(
-            Lead.contractor_id == contractor_id,
-            Lead.source == "widget",
-            Lead.created_at >= cutoff_date
-        )
-    ).scalar() or 0
+    return cached_stats(request, contractor_id, "conversion_metrics", days, lambda: conversion_metrics(db, contractor_id, days))
+
+def conversion_metrics(db: Session, contractor_id: int, days: int) -> dict:
+    get_contractor_or_404(db, contractor_id)
+    since = window_start(days)
     
-    quotes_generated = db.query(func.count(Quote.id)).join(Lead).filter(
-        and_(
-            Lead.contractor_id == contractor_id,
-            Lead.source == "widget",
-            Quote.created_at >= cutoff_date
-        )
-    ).scalar() or 0
+    funnel = analytics_rollup.funnel_counts(
+        db, contractor_id, since, analytics_rollup.get_compacted_through(db), source="widget"
+    )
+    widget_views = funnel["widget_view"]
+    widget_opens = funnel["widget_open"]
+    quote_requests = funnel["quote_request"]
+    leads_created = funnel["lead"]
+    quotes_generated = funnel["quote"]
     
     view_to_open_rate = (widget_opens / widget_views * 100) if widget_views > 0 else 0
     open_to_quote_rate = (quote_requests / widget_opens * 100) if widget_opens > 0 else 0
@@ -186,129 +204,97 @@ async def get_conversion_metrics(
     }
 
 @router.get("/contractor/{contractor_id}/quotes/summary")
-async def get_quote_summary(
+def get_quote_summary(
     contractor_id: int,
+    request: Request,
     days: int = 30,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
-    if not contractor:
-        raise HTTPException(status_code=404, detail="Contractor not found")
-    
-    cutoff_date = datetime.now() - timedelta(days=days)
+    return cached_stats(request, contractor_id, "quote_summary", days, lambda: quote_summary(db, contractor_id, days))
+
+def quote_summary(db: Session, contractor_id: int, days: int) -> dict:
+    get_contractor_or_404(db, contractor_id)
+    since = window_start(days)
     
-    daily_quotes = db.query(
-        func.date(Quote.created_at).label('date'),
-        func.count(Quote.id).label('count'),
-        func.sum(Quote.total_price).label('total_value')
-    ).join(Lead).filter(
-        and_(
-            Lead.contractor_id == contractor_id,
-            Quote.created_at >= cutoff_date
-        )
-    ).group_by(func.date(Quote.created_at)).all()
+    quote_rows = analytics_rollup.load_rows(
+        db, "quotes", contractor_id, since, analytics_rollup.get_compacted_through(db)
+    )
     
-    tier_summary = db.query(
-        Quote.selected_tier,
-        func.count(Quote.id).label('count'),
-        func.avg(Quote.total_price).label('avg_price'),
-        func.sum(Quote.total_price).label('total_value')
-    ).join(Lead).filter(
-        and_(
-            Lead.contractor_id == contractor_id,
-            Quote.created_at >= cutoff_date
-        )
-    ).group_by(Quote.selected_tier).all()
+    daily_quotes = defaultdict(lambda: [0, 0.0])
+    tier_summary = defaultdict(lambda: [0, 0.0])
+    for row in quote_rows:
+        daily_quotes[row.day][0] += row.quote_count
+        daily_quotes[row.day][1] += row.total_value
+        tier_summary[row.tier][0] += row.quote_count
+        tier_summary[row.tier][1] += row.total_value
     
-    size_ranges = [
-        (0, 1500, "Small (< 1500 sqft)"),
-        (1500, 2500, "Medium (1500-2500 sqft)"),
-        (2500, 3500, "Large (2500-3500 sqft)"),
-        (3500, 999999, "Extra Large (> 3500 sqft)")
-    ]
-    
-    size_distribution = []
-    for min_size, max_size, label in size_ranges:
-        count = db.query(func.count(Quote.id)).join(Lead).filter(
-            and_(
-                Lead.contractor_id == contractor_id,
-                Quote.created_at >= cutoff_date,
-                Quote.roof_size_sqft >= min_size,
-                Quote.roof_size_sqft < max_size
-            )
-        ).scalar()
-        size_distribution.append({"range": label, "count": count})
+    size_counts = count_by(quote_rows, "size_bucket", "quote_count")
     
     return {
         "period": f"Last {days} days",
         "daily_activity": [
             {
-                "date": str(date),
+                "date": str(day),
                 "quotes": count,
-                "total_value": round(float(total_value or 0), 2)
+                "total_value": round(float(total_value), 2)
             }
-            for date, count, total_value in daily_quotes
+            for day, (count, total_value) in sorted(daily_quotes.items())
         ],
         "tier_performance": [
             {
                 "tier": tier,
                 "count": count,
-                "average_price": round(float(avg_price or 0), 2),
-                "total_value": round(float(total_value or 0), 2)
+                "average_price": round(total_value / count, 2) if count else 0,
+                "total_value": round(float(total_value), 2)
             }
-            for tier, count, avg_price, total_value in tier_summary
+            for tier, (count, total_value) in tier_summary.items()
         ],
-        "size_distribution": size_distribution
+        "size_distribution": [
+            {"range": label, "count": size_counts.get(key, 0)}
+            for key, _, label in analytics_rollup.SIZE_BUCKETS
+        ]
     }
 
 @router.get("/contractor/{contractor_id}/leads/sources")
-async def get_lead_sources(
+def get_lead_sources(
     contractor_id: int,
+    request: Request,
     days: int = 30,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
-    contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
-    if not contractor:
-        raise HTTPException(status_code=404, detail="Contractor not found")
-    
-    cutoff_date = datetime.now() - timedelta(days=days)
-    
-    source_breakdown = db.query(
-        Lead.source,
-        func.count(Lead.id).label('count'),
-        func.count(func.distinct(func.date(Lead.created_at))).label('active_days')
-    ).filter(
-        and_(
-            Lead.contractor_id == contractor_id,
-            Lead.created_at >= cutoff_date
-        )
-    ).group_by(Lead.source).all()
-    
-    source_value = db.query(
-        Lead.source,
-        func.sum(Quote.total_price).label('total_value'),
-        func.avg(Quote.total_price).label('avg_value')
-    ).join(Quote).filter(
-        and_(
-            Lead.contractor_id == contractor_id,
-            Lead.created_at >= cutoff_date
-        )
-    ).group_by(Lead.source).all()
+    return cached_stats(request, contractor_id, "lead_sources", days, lambda: lead_sources(db, contractor_id, days))
+
+def lead_sources(db: Session, contractor_id: int, days: int) -> dict:
+    get_contractor_or_404(db, contractor_id)
+    since = window_start(days)
+    
+    lead_counts = defaultdict(int)
+    active_days = defaultdict(set)
+    quote_counts = defaultdict(int)
+    quote_values = defaultdict(float)
+    lead_rows = analytics_rollup.load_rows(
+        db, "leads", contractor_id, since, analytics_rollup.get_compacted_through(db)
+    )
+    for row in lead_rows:
+        lead_counts[row.source] += row.lead_count
+        quote_counts[row.source] += row.quote_count
+        quote_values[row.source] += row.quote_value
+        if row.lead_count:
+            active_days[row.source].add(row.day)
     
     source_metrics = {}
-    for source, count, active_days in source_breakdown:
+    for source, count in lead_counts.items():
+        days_active = len(active_days[source])
         source_metrics[source] = {
             "lead_count": count,
-            "active_days": active_days,
-            "avg_leads_per_day": round(count / active_days, 2) if active_days > 0 else 0
+            "active_days": days_active,
+            "avg_leads_per_day": round(count / days_active, 2) if days_active > 0 else 0
         }
-    
-    for source, total_value, avg_value in source_value:
-        if source in source_metrics:
-            source_metrics[source]["total_value"] = round(float(total_value or 0), 2)
-            source_metrics[source]["avg_quote_value"] = round(float(avg_value or 0), 2)
+        if quote_counts[source]:
+            source_metrics[source]["total_value"] = round(quote_values[source], 2)
+            source_metrics[source]["avg_quote_value"] = round(quote_values[source] / quote_counts[source], 2)
     
     return {
         "period": f"Last {days} days",
         "sources": source_metrics
-    }
\ No newline at end of file
+    }
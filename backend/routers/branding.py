@@ -5,11 +5,14 @@ from models import Branding, Contractor
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional
+import logging
 import os
-import uuid
 from config import settings
+from services import logo_storage
+from services.worker_pool import WorkerPoolError
 
 router = APIRouter()
+logger = logging.getLogger(__name__)
 
 os.makedirs(settings.UPLOAD_DIR, exist_ok=True)
 
@@ -41,7 +44,7 @@ class BrandingResponse(BrandingBase):
         from_attributes = True
 
 @router.get("/contractor/{contractor_id}", response_model=BrandingResponse)
-async def get_contractor_branding(contractor_id: int, db: Session = Depends(get_db)):
+def get_contractor_branding(contractor_id: int, db: Session = Depends(get_db)):
     branding = db.query(Branding).filter(Branding.contractor_id == contractor_id).first()
     if not branding:
         contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
@@ -56,7 +59,7 @@ async def get_contractor_branding(contractor_id: int, db: Session = Depends(get_
     return branding
 
 @router.post("/", response_model=BrandingResponse)
-async def create_branding(branding: BrandingCreate, db: Session = Depends(get_db)):
+def create_branding(branding: BrandingCreate, db: Session = Depends(get_db)):
     existing = db.query(Branding).filter(Branding.contractor_id == branding.contractor_id).first()
     if existing:
         raise HTTPException(status_code=400, detail="Branding already exists for this contractor")
@@ -72,7 +75,7 @@ async def create_branding(branding: BrandingCreate, db: Session = Depends(get_db
     return db_branding
 
 @router.put("/contractor/{contractor_id}", response_model=BrandingResponse)
-async def update_branding(
+def update_branding(
     contractor_id: int,
     branding: BrandingUpdate,
     db: Session = Depends(get_db)
@@ -94,12 +97,12 @@ async def update_branding(
     return db_branding
 
 @router.post("/contractor/{contractor_id}/logo")
-async def upload_logo(
+def upload_logo(
     contractor_id: int,
     file: UploadFile = File(...),
     db: Session = Depends(get_db)
 ):
-    if file.size > settings.MAX_UPLOAD_SIZE:
+    if file.size is not None and file.size > settings.MAX_UPLOAD_SIZE:
         raise HTTPException(status_code=400, detail="File too large")
     
     if not file.content_type.startswith("image/"):
@@ -109,21 +112,21 @@ async def upload_logo(
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
     
-    file_extension = os.path.splitext(file.filename)[1]
-    file_name = f"{uuid.uuid4()}{file_extension}"
-    file_path = os.path.join(settings.UPLOAD_DIR, file_name)
-    
-    with open(file_path, "wb") as buffer:
-        content = await file.read()
-        buffer.write(content)
+    try:
+        logo = logo_storage.store_logo(file.file, file.filename, file.content_type)
+    except logo_storage.LogoError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except WorkerPoolError as e:
+        logger.error(f"Logo variants for contractor {contractor_id} failed: {e}")
+        raise HTTPException(status_code=503, detail="Could not process the logo, please try again")
     
     branding = db.query(Branding).filter(Branding.contractor_id == contractor_id).first()
     if not branding:
         branding = Branding(contractor_id=contractor_id)
         db.add(branding)
     
-    branding.logo_url = f"/{settings.UPLOAD_DIR}/{file_name}"
+    branding.logo_url = logo.url
     db.commit()
     db.refresh(branding)
     
-    return {"logo_url": branding.logo_url, "message": "Logo uploaded successfully"}
\ No newline at end of file
+    return {"logo_url": branding.logo_url, "variants": logo.variants, "message": "Logo uploaded successfully"}
\ No newline at end of file
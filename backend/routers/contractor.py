@@ -36,19 +36,19 @@ class ContractorResponse(ContractorBase):
         from_attributes = True
 
 @router.get("/", response_model=List[ContractorResponse])
-async def get_contractors(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
+def get_contractors(skip: int = 0, limit: int = 100, db: Session = Depends(get_db)):
     contractors = db.query(Contractor).offset(skip).limit(limit).all()
     return contractors
 
 @router.get("/{contractor_id}", response_model=ContractorResponse)
-async def get_contractor(contractor_id: int, db: Session = Depends(get_db)):
+def get_contractor(contractor_id: int, db: Session = Depends(get_db)):
     contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
     return contractor
 
 @router.post("/", response_model=ContractorResponse)
-async def create_contractor(contractor: ContractorCreate, db: Session = Depends(get_db)):
+def create_contractor(contractor: ContractorCreate, db: Session = Depends(get_db)):
     existing = db.query(Contractor).filter(Contractor.email == contractor.email).first()
     if existing:
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -63,7 +63,7 @@ async def create_contractor(contractor: ContractorCreate, db: Session = Depends(
     return db_contractor
 
 @router.put("/{contractor_id}", response_model=ContractorResponse)
-async def update_contractor(
+def update_contractor(
     contractor_id: int, 
     contractor: ContractorUpdate, 
     db: Session = Depends(get_db)
@@ -81,7 +81,7 @@ async def update_contractor(
     return db_contractor
 
 @router.delete("/{contractor_id}")
-async def delete_contractor(contractor_id: int, db: Session = Depends(get_db)):
+def delete_contractor(contractor_id: int, db: Session = Depends(get_db)):
     contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
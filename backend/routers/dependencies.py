@@ -0,0 +1,36 @@
+"""
+Read-replica dependencies shared by the routers.
+
+Read-only dashboard endpoints take ``get_read_db`` and are served by a
+replica. Replicas lag the primary, so the dashboard writes whose results
+those endpoints show depend on ``pin_reads``: their responses carry
+``X-Read-Primary: <seconds>``, and the dashboard sends
+``X-Read-Primary: 1`` with its requests for that long. Anonymous widget
+traffic (tracking, lead capture, quoting) never pins anything.
+"""
+from fastapi import Request, Response
+
+from config import settings
+from database import read_engines, read_session
+
+READ_PRIMARY_HEADER = "X-Read-Primary"
+
+
+def reads_from_primary(request: Request) -> bool:
+    """Whether this request must see the client's own recent writes."""
+    return request.headers.get(READ_PRIMARY_HEADER, "").lower() in ("1", "true", "yes")
+
+
+def get_read_db(request: Request):
+    """Session for read-only handlers; served by a replica unless the request needs the primary."""
+    db = read_session(primary=reads_from_primary(request))
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+def pin_reads(response: Response) -> None:
+    """Tell the dashboard to read from the primary until replicas have caught up with this write."""
+    if read_engines:
+        response.headers[READ_PRIMARY_HEADER] = str(settings.READ_YOUR_WRITES_SECONDS)
@@ -1,129 +1,140 @@
 from fastapi import APIRouter, HTTPException, Depends
-from pydantic import BaseModel, EmailStr
-import os
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition
+from pydantic import BaseModel, EmailStr, Field
+from sqlalchemy.orm import Session
 import base64
 import logging
-from typing import Optional
-from dotenv import load_dotenv
-from pathlib import Path
+import os
+from typing import Dict, List, Optional
+from database import get_db
+from models import EmailMessage, Quote
+from services import email_service, quote_pdf
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
-# Load environment variables from sendgrid.env file
-env_path = Path(__file__).parent.parent / 'sendgrid.env'
-if env_path.exists():
-    load_dotenv(env_path)
-else:
-    logger.warning(f"SendGrid configuration file not found at {env_path}")
-
 class SendQuoteEmailRequest(BaseModel):
     to_email: EmailStr
     subject: str
     email_content: str
     pdf_base64: Optional[str] = None
+    quote_id: Optional[int] = None  # attach the server-rendered quote PDF instead of pdf_base64
     lead_name: str
 
-@router.post("/send-quote-email")
-async def send_quote_email(request: SendQuoteEmailRequest):
-    """Send a quote email with optional PDF attachment using SendGrid"""
-    try:
-        # Check for SendGrid configuration
-        sg_api_key = os.environ.get('SENDGRID_API_KEY')
-        if not sg_api_key or sg_api_key == 'your_sendgrid_api_key_here':
-            logger.error("SendGrid API key not properly configured")
-            raise HTTPException(
-                status_code=500, 
-                detail="Email service not configured. Please set up SendGrid API key in sendgrid.env file."
-            )
-        
-        from_email = os.environ.get('SENDGRID_FROM_EMAIL', 'noreply@roofquotepro.com')
-        reply_to = os.environ.get('SENDGRID_REPLY_TO', from_email)
-        
-        # Convert plain text to HTML with proper formatting
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <div style="white-space: pre-wrap;">{request.email_content}</div>
-                    <hr style="margin: 30px 0; border: none; border-top: 1px solid #ddd;">
-                    <p style="font-size: 12px; color: #666;">
-                        This email was sent by Roof Quote Pro on behalf of your roofing contractor.
-                    </p>
-                </div>
-            </body>
-        </html>
-        """
-        
-        # Create the email message
-        message = Mail(
-            from_email=from_email,
-            to_emails=request.to_email,
-            subject=request.subject,
-            plain_text_content=request.email_content,
-            html_content=html_content
+class BulkRecipient(BaseModel):
+    email: EmailStr
+    name: Optional[str] = None
+    substitutions: Dict[str, str] = {}
+
+class SendBulkEmailRequest(BaseModel):
+    recipients: List[BulkRecipient] = Field(..., min_length=1, max_length=10000)
+    subject: str
+    email_content: str
+
+def require_configured():
+    if not email_service.is_configured():
+        logger.error("SendGrid API key not properly configured")
+        raise HTTPException(
+            status_code=500,
+            detail="Email service not configured. Please set up SendGrid API key in sendgrid.env file."
         )
-        
-        # Set reply-to address
-        message.reply_to = reply_to
-        
-        # Add PDF attachment if provided
-        if request.pdf_base64:
-            try:
-                attachment = Attachment(
-                    FileContent(request.pdf_base64),
-                    FileName(f"Quote_{request.lead_name.replace(' ', '_')}.pdf"),
-                    FileType('application/pdf'),
-                    Disposition('attachment')
-                )
-                message.attachment = attachment
-                logger.info(f"PDF attachment added for {request.lead_name}")
-            except Exception as e:
-                logger.error(f"Failed to attach PDF: {str(e)}")
-                # Continue sending without attachment rather than failing completely
-        
-        # Send the email
-        sg = SendGridAPIClient(sg_api_key)
-        response = sg.send(message)
-        
-        logger.info(f"Email sent successfully to {request.to_email}. Status code: {response.status_code}")
-        
-        return {
-            "success": True,
-            "message": "Email sent successfully",
-            "status_code": response.status_code,
-            "details": {
-                "to": request.to_email,
-                "from": from_email,
-                "pdf_attached": bool(request.pdf_base64)
-            }
+
+@router.post("/send-quote-email", status_code=202)
+def send_quote_email(request: SendQuoteEmailRequest, db: Session = Depends(get_db)):
+    """Queue a quote email with optional PDF attachment; it is sent in the background"""
+    require_configured()
+    
+    pdf_base64 = request.pdf_base64
+    if request.quote_id is not None:
+        quote = db.query(Quote).filter(Quote.id == request.quote_id).first()
+        if not quote:
+            raise HTTPException(status_code=404, detail="Quote not found")
+        try:
+            pdf = quote_pdf.stored_pdf(db, quote)
+        except quote_pdf.RenderError as e:
+            logger.error(f"PDF for quote {request.quote_id} failed: {e}")
+            raise HTTPException(status_code=503, detail="Could not render the quote PDF, please try again")
+        with open(pdf.path, "rb") as f:
+            pdf_base64 = base64.b64encode(f.read()).decode()
+        # Committed with the queued message below
+        quote.pdf_url = pdf.url
+    
+    attachments = []
+    if pdf_base64:
+        # Send without the attachment rather than not at all
+        attachment = email_service.pdf_attachment(
+            pdf_base64, f"Quote_{request.lead_name.replace(' ', '_')}.pdf"
+        )
+        if attachment:
+            attachments.append(attachment)
+    
+    [message] = email_service.enqueue(
+        db,
+        "quote",
+        request.subject,
+        [email_service.personalization(request.to_email, request.lead_name)],
+        text_content=request.email_content,
+        html_content=email_service.plain_text_html(request.email_content),
+        attachments=attachments
+    )
+    db.commit()
+    logger.info(f"Quote email {message.message_id} queued for {request.to_email}")
+    
+    return {
+        "success": True,
+        "message": "Email queued for delivery",
+        "message_id": message.message_id,
+        "status": message.status,
+        "details": {
+            "to": request.to_email,
+            "from": message.from_email,
+            "pdf_attached": bool(attachments)
         }
-        
-    except Exception as e:
-        logger.error(f"Failed to send email: {str(e)}")
-        
-        # Provide more specific error messages
-        if "401" in str(e):
-            error_msg = "Invalid SendGrid API key. Please check your configuration."
-        elif "403" in str(e):
-            error_msg = "SendGrid access forbidden. Please verify your sender email is authenticated."
-        elif "400" in str(e):
-            error_msg = "Invalid email request. Please check the email addresses."
-        else:
-            error_msg = f"Failed to send email: {str(e)}"
-        
-        raise HTTPException(status_code=500, detail=error_msg)
+    }
+
+@router.post("/send-bulk-email", status_code=202)
+def send_bulk_email(request: SendBulkEmailRequest, db: Session = Depends(get_db)):
+    """
+    Queue one email to many recipients.
+    
+    Recipients are batched into as few SendGrid requests as possible; each
+    recipient's ``substitutions`` replace their keys in the subject and body.
+    """
+    require_configured()
+    
+    messages = email_service.enqueue(
+        db,
+        "bulk",
+        request.subject,
+        [
+            email_service.personalization(recipient.email, recipient.name, recipient.substitutions)
+            for recipient in request.recipients
+        ],
+        text_content=request.email_content,
+        html_content=email_service.plain_text_html(request.email_content)
+    )
+    db.commit()
+    logger.info(f"Bulk email to {len(request.recipients)} recipients queued as {len(messages)} messages")
+    
+    return {
+        "success": True,
+        "message": f"Email to {len(request.recipients)} recipients queued for delivery",
+        "message_ids": [message.message_id for message in messages]
+    }
+
+@router.get("/email-messages/{message_id}")
+def get_email_status(message_id: str, db: Session = Depends(get_db)):
+    message = db.query(EmailMessage).filter(EmailMessage.message_id == message_id).first()
+    if not message:
+        raise HTTPException(status_code=404, detail="Email message not found")
+    return email_service.message_status(message)
 
 @router.get("/email-config-status")
 async def get_email_config_status():
     """Check if email configuration is properly set up"""
-    sg_api_key = os.environ.get('SENDGRID_API_KEY')
     from_email = os.environ.get('SENDGRID_FROM_EMAIL')
     reply_to = os.environ.get('SENDGRID_REPLY_TO')
     
-    is_configured = bool(sg_api_key and sg_api_key != 'your_sendgrid_api_key_here')
+    is_configured = email_service.is_configured()
     
     return {
         "sendgrid_configured": is_configured,
@@ -134,47 +145,27 @@ async def get_email_config_status():
         "message": "Email service is ready" if is_configured else "Please configure SendGrid API key in sendgrid.env file"
     }
 
-@router.post("/test-email")
-async def send_test_email(email: EmailStr):
-    """Send a test email to verify SendGrid configuration"""
-    try:
-        sg_api_key = os.environ.get('SENDGRID_API_KEY')
-        if not sg_api_key or sg_api_key == 'your_sendgrid_api_key_here':
-            raise HTTPException(
-                status_code=500,
-                detail="SendGrid not configured. Please add your API key to sendgrid.env file."
-            )
-        
-        from_email = os.environ.get('SENDGRID_FROM_EMAIL', 'noreply@roofquotepro.com')
-        
-        message = Mail(
-            from_email=from_email,
-            to_emails=email,
-            subject="Test Email from Roof Quote Pro",
-            html_content="""
-            <html>
-                <body style="font-family: Arial, sans-serif;">
-                    <h2>Test Email Successful!</h2>
-                    <p>Your SendGrid configuration is working correctly.</p>
-                    <p>You can now send quote emails with PDF attachments to your leads.</p>
-                    <hr>
-                    <p style="color: #666; font-size: 12px;">
-                        This is a test email from Roof Quote Pro
-                    </p>
-                </body>
-            </html>
-            """
+@router.post("/test-email", status_code=202)
+def send_test_email(email: EmailStr, db: Session = Depends(get_db)):
+    """Queue a test email to verify SendGrid configuration"""
+    if not email_service.is_configured():
+        raise HTTPException(
+            status_code=500,
+            detail="SendGrid not configured. Please add your API key to sendgrid.env file."
         )
-        
-        sg = SendGridAPIClient(sg_api_key)
-        response = sg.send(message)
-        
-        return {
-            "success": True,
-            "message": f"Test email sent successfully to {email}",
-            "status_code": response.status_code
-        }
-        
-    except Exception as e:
-        logger.error(f"Test email failed: {str(e)}")
-        raise HTTPException(status_code=500, detail=f"Failed to send test email: {str(e)}")
\ No newline at end of file
+    
+    [message] = email_service.enqueue(
+        db,
+        "test",
+        "Test Email from Roof Quote Pro",
+        [email_service.personalization(email)],
+        html_content=email_service.test_email_html()
+    )
+    db.commit()
+    
+    return {
+        "success": True,
+        "message": f"Test email to {email} queued; check its status for the delivery result",
+        "message_id": message.message_id,
+        "status": message.status
+    }
@@ -1,12 +1,18 @@
-from fastapi import APIRouter, Depends, HTTPException, BackgroundTasks
+from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import StreamingResponse
 from sqlalchemy.orm import Session
 from database import get_db
-from models import Lead, Quote, Contractor
+from models import Contractor, CRMSyncState, Webhook, WebhookDelivery, utcnow
 from pydantic import BaseModel
-from typing import Optional, List
+from typing import AsyncIterator, Dict, Optional, List
+import json
 import random
-import httpx
 from datetime import datetime
+from services import crm, webhooks
+from services.geo import normalize_address
+from services.roof_measurement import eagleview_provider
+from services.webhooks import webhook_dispatcher
 
 router = APIRouter()
 
@@ -34,8 +40,6 @@ class WebhookConfig(BaseModel):
     webhook_url: str
     active: bool = True
 
-webhooks = {}
-
 @router.post("/google-maps/geocode")
 async def geocode_address(lookup: AddressLookup):
     mock_locations = {
@@ -98,15 +102,31 @@ async def get_aerial_imagery(request: AerialImageryRequest):
         "message": "Mock aerial imagery URL generated (actual API key required for real images)"
     }
 
+def contractor_names(db: Session, contractor_ids: List[int]) -> Dict[int, str]:
+    return dict(
+        db.query(Contractor.id, Contractor.company_name).filter(Contractor.id.in_(set(contractor_ids))).all()
+    )
+
+def crm_payload(lead_data: CRMLeadData, contractor: str) -> dict:
+    return crm.lead_payload(
+        lead_data.lead_id, lead_data.name, lead_data.email, lead_data.phone, lead_data.address,
+        lead_data.quote_amount, lead_data.source, contractor
+    )
+
 @router.post("/crm/lead")
 async def send_lead_to_crm(lead_data: CRMLeadData, db: Session = Depends(get_db)):
-    contractor = db.query(Contractor).filter(Contractor.id == lead_data.contractor_id).first()
-    if not contractor:
+    names = await run_in_threadpool(contractor_names, db, [lead_data.contractor_id])
+    if lead_data.contractor_id not in names:
         raise HTTPException(status_code=404, detail="Contractor not found")
     
-    mock_crm_response = {
+    try:
+        crm_lead_id = await crm.crm_adapter.push(crm_payload(lead_data, names[lead_data.contractor_id]))
+    except crm.CRMError as e:
+        raise HTTPException(status_code=502, detail=f"CRM rejected the lead: {e}")
+    
+    return {
         "success": True,
-        "crm_lead_id": f"CRM_{random.randint(100000, 999999)}",
+        "crm_lead_id": crm_lead_id,
         "status": "created",
         "message": "Lead successfully sent to CRM",
         "data": {
@@ -115,101 +135,117 @@ async def send_lead_to_crm(lead_data: CRMLeadData, db: Session = Depends(get_db)
             "phone": lead_data.phone,
             "address": lead_data.address,
             "quote_amount": lead_data.quote_amount,
-            "contractor": contractor.company_name,
+            "contractor": names[lead_data.contractor_id],
             "created_at": datetime.now().isoformat()
         }
     }
+
+async def crm_batch_results(leads: List[CRMLeadData], names: Dict[int, str]) -> AsyncIterator[dict]:
+    contractors = {}
+    payloads = []
+    for lead_data in leads:
+        contractor = names.get(lead_data.contractor_id)
+        if contractor is None:
+            yield {"lead_id": lead_data.lead_id, "status": "skipped", "error": "Contractor not found"}
+            continue
+        contractors[lead_data.lead_id] = contractor
+        payloads.append(crm_payload(lead_data, contractor))
     
-    return mock_crm_response
+    async for result in crm.push_leads(payloads):
+        yield {**result, "contractor": contractors[result["lead_id"]]}
 
 @router.post("/crm/batch-leads")
-async def send_batch_leads_to_crm(leads: List[CRMLeadData], db: Session = Depends(get_db)):
-    results = []
+async def send_batch_leads_to_crm(leads: List[CRMLeadData], request: Request, db: Session = Depends(get_db)):
+    """
+    Push many leads to the CRM concurrently.
     
-    for lead_data in leads:
-        contractor = db.query(Contractor).filter(Contractor.id == lead_data.contractor_id).first()
-        if contractor:
-            results.append({
-                "lead_id": lead_data.lead_id,
-                "crm_lead_id": f"CRM_{random.randint(100000, 999999)}",
-                "status": "created",
-                "contractor": contractor.company_name
-            })
+    With ``Accept: application/x-ndjson`` each lead's result is streamed as
+    soon as the CRM answers, followed by a summary line; otherwise the
+    results are returned together.
+    """
+    # One query for every contractor in the batch
+    names = await run_in_threadpool(contractor_names, db, [lead_data.contractor_id for lead_data in leads])
     
+    if "application/x-ndjson" in request.headers.get("accept", ""):
+        async def stream() -> AsyncIterator[bytes]:
+            created = 0
+            async for result in crm_batch_results(leads, names):
+                created += result["status"] == "created"
+                yield (json.dumps(result) + "\n").encode()
+            yield (json.dumps({"done": True, "count": len(leads), "created": created}) + "\n").encode()
+        
+        return StreamingResponse(stream(), media_type="application/x-ndjson")
+    
+    results = [result async for result in crm_batch_results(leads, names)]
+    created = sum(result["status"] == "created" for result in results)
     return {
-        "success": True,
-        "total_processed": len(results),
+        "success": created == len(leads),
+        "total_processed": created,
         "results": results,
-        "message": f"Successfully processed {len(results)} leads"
+        "message": f"Successfully processed {created} leads"
     }
 
+@router.post("/crm/sync/{contractor_id}")
+async def run_crm_sync(contractor_id: int, db: Session = Depends(get_db)):
+    if not await run_in_threadpool(contractor_names, db, [contractor_id]):
+        raise HTTPException(status_code=404, detail="Contractor not found")
+    try:
+        return await crm.sync_contractor(contractor_id)
+    except crm.CRMSyncBusy:
+        raise HTTPException(status_code=409, detail="A CRM sync is already running for this contractor")
+
+@router.get("/crm/sync/{contractor_id}")
+def get_crm_sync_status(contractor_id: int, db: Session = Depends(get_db)):
+    state = db.query(CRMSyncState).filter(CRMSyncState.contractor_id == contractor_id).first()
+    if not state:
+        raise HTTPException(status_code=404, detail="No CRM sync has run for this contractor")
+    return crm.state_status(state)
+
 @router.post("/webhooks/configure")
-async def configure_webhook(config: WebhookConfig, db: Session = Depends(get_db)):
+def configure_webhook(config: WebhookConfig, db: Session = Depends(get_db)):
     contractor = db.query(Contractor).filter(Contractor.id == config.contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
     
-    webhook_key = f"{config.contractor_id}_{config.event_type}"
-    webhooks[webhook_key] = {
-        "url": config.webhook_url,
-        "active": config.active,
-        "created_at": datetime.now().isoformat()
-    }
+    webhook = db.query(Webhook).filter(
+        Webhook.contractor_id == config.contractor_id,
+        Webhook.event_type == config.event_type
+    ).first()
+    if not webhook:
+        webhook = Webhook(contractor_id=config.contractor_id, event_type=config.event_type)
+        db.add(webhook)
+    webhook.url = config.webhook_url
+    webhook.active = config.active
+    db.commit()
     
     return {
         "success": True,
-        "webhook_id": webhook_key,
+        "webhook_id": webhook.id,
         "message": f"Webhook configured for {config.event_type} events"
     }
 
 @router.get("/webhooks/contractor/{contractor_id}")
-async def get_contractor_webhooks(contractor_id: int):
-    contractor_webhooks = []
-    
-    for key, value in webhooks.items():
-        if key.startswith(f"{contractor_id}_"):
-            event_type = key.split("_", 1)[1]
-            contractor_webhooks.append({
-                "event_type": event_type,
-                "url": value["url"],
-                "active": value["active"],
-                "created_at": value["created_at"]
-            })
+def get_contractor_webhooks(contractor_id: int, db: Session = Depends(get_db)):
+    contractor_webhooks = db.query(Webhook).filter(
+        Webhook.contractor_id == contractor_id
+    ).order_by(Webhook.event_type).all()
     
     return {
         "contractor_id": contractor_id,
-        "webhooks": contractor_webhooks
+        "webhooks": [
+            {
+                "id": webhook.id,
+                "event_type": webhook.event_type,
+                "url": webhook.url,
+                "active": webhook.active,
+                "created_at": webhook.created_at
+            }
+            for webhook in contractor_webhooks
+        ]
     }
 
-async def trigger_webhook(contractor_id: int, event_type: str, data: dict):
-    webhook_key = f"{contractor_id}_{event_type}"
-    
-    if webhook_key in webhooks and webhooks[webhook_key]["active"]:
-        webhook_url = webhooks[webhook_key]["url"]
-        
-        try:
-            async with httpx.AsyncClient() as client:
-                response = await client.post(
-                    webhook_url,
-                    json={
-                        "event": event_type,
-                        "timestamp": datetime.now().isoformat(),
-                        "data": data
-                    },
-                    timeout=10.0
-                )
-                return {"success": True, "status_code": response.status_code}
-        except Exception as e:
-            return {"success": False, "error": str(e)}
-    
-    return {"success": False, "error": "Webhook not configured or inactive"}
-
-@router.post("/webhooks/test/{contractor_id}")
-async def test_webhook(
-    contractor_id: int,
-    event_type: str,
-    background_tasks: BackgroundTasks
-):
+@router.post("/webhooks/test/{contractor_id}", status_code=202)
+def test_webhook(contractor_id: int, event_type: str, db: Session = Depends(get_db)):
     test_data = {
         "test": True,
         "contractor_id": contractor_id,
@@ -217,41 +253,62 @@ async def test_webhook(
         "message": "This is a test webhook event"
     }
     
-    background_tasks.add_task(trigger_webhook, contractor_id, event_type, test_data)
+    delivery_id = webhooks.enqueue(db, contractor_id, event_type, test_data)
+    if delivery_id is None:
+        raise HTTPException(status_code=404, detail="Webhook not configured or inactive")
+    db.commit()
     
     return {
         "success": True,
+        "delivery_id": delivery_id,
         "message": f"Test webhook for {event_type} queued for delivery"
     }
 
+@router.get("/webhooks/contractor/{contractor_id}/deliveries")
+def get_webhook_deliveries(
+    contractor_id: int,
+    status: Optional[str] = None,
+    limit: int = Query(50, ge=1, le=500),
+    db: Session = Depends(get_db)
+):
+    query = db.query(WebhookDelivery).filter(WebhookDelivery.contractor_id == contractor_id)
+    if status:
+        query = query.filter(WebhookDelivery.status == status)
+    deliveries = query.order_by(WebhookDelivery.created_at.desc(), WebhookDelivery.id.desc()).limit(limit).all()
+    
+    return {
+        "contractor_id": contractor_id,
+        "deliveries": [webhooks.delivery_status(delivery) for delivery in deliveries]
+    }
+
+@router.post("/webhooks/deliveries/{delivery_id}/retry", status_code=202)
+def retry_webhook_delivery(delivery_id: int, db: Session = Depends(get_db)):
+    delivery = db.get(WebhookDelivery, delivery_id)
+    if not delivery:
+        raise HTTPException(status_code=404, detail="Delivery not found")
+    if delivery.status == "delivered":
+        raise HTTPException(status_code=400, detail="Delivery already succeeded")
+    
+    # A requeued dead letter gets a fresh set of attempts
+    delivery.status = "pending"
+    delivery.attempts = 0
+    delivery.next_attempt_at = utcnow()
+    db.commit()
+    response = webhooks.delivery_status(delivery)
+    webhook_dispatcher.wake()
+    return response
+
 @router.post("/measurement/eagleview")
 async def mock_eagleview_measurement(address: str):
-    base_sqft = random.randint(1800, 3200)
-    pitch = random.choice(["4:12", "6:12", "8:12", "10:12"])
+    report = eagleview_provider.report(normalize_address(address))
     
     return {
         "success": True,
         "provider": "EagleView (Mock)",
-        "report_id": f"EV_{random.randint(100000, 999999)}",
+        "report_id": report["report_id"],
         "address": address,
-        "measurements": {
-            "total_roof_area": base_sqft,
-            "main_roof_area": int(base_sqft * 0.75),
-            "garage_roof_area": int(base_sqft * 0.25),
-            "pitch": pitch,
-            "number_of_facets": random.randint(4, 12),
-            "edge_length": random.randint(180, 320),
-            "ridge_length": random.randint(40, 80),
-            "valley_length": random.randint(20, 60),
-            "hip_length": random.randint(30, 70)
-        },
-        "imagery": {
-            "top_down_url": f"https://mock-eagleview.com/images/{random.randint(1000, 9999)}/top.jpg",
-            "north_url": f"https://mock-eagleview.com/images/{random.randint(1000, 9999)}/north.jpg",
-            "south_url": f"https://mock-eagleview.com/images/{random.randint(1000, 9999)}/south.jpg",
-            "east_url": f"https://mock-eagleview.com/images/{random.randint(1000, 9999)}/east.jpg",
-            "west_url": f"https://mock-eagleview.com/images/{random.randint(1000, 9999)}/west.jpg"
-        },
-        "confidence_score": random.uniform(0.85, 0.99),
+        "measurements": report["measurements"],
+        "imagery": report["imagery"],
+        "confidence_score": report["confidence_score"],
         "report_date": datetime.now().isoformat()
     }
\ No newline at end of file
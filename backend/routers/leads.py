@@ -1,15 +1,22 @@
 # Leads router - fixed datetime formatting
-from fastapi import APIRouter, Depends, HTTPException, Query
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
 from fastapi.responses import StreamingResponse
-from sqlalchemy.orm import Session
-from sqlalchemy import or_
-from database import get_db
+from sqlalchemy.orm import Session, aliased
+from sqlalchemy import or_, and_, func, select
+from database import get_db, read_session, SessionLocal
 from models import Lead, Contractor, Quote
+from config import settings
+from routers.dependencies import get_read_db, pin_reads, reads_from_primary
+from services import lead_import, lead_search
 from pydantic import BaseModel
-from typing import List, Optional
-from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+from datetime import date, datetime, time, timedelta
+import base64
 import csv
 import io
+import json
+import tempfile
 
 router = APIRouter()
 
@@ -50,15 +57,81 @@ class LeadResponse(LeadBase):
 class LeadWithQuote(LeadResponse):
     latest_quote: Optional[dict] = None
 
+def format_datetime(value: Optional[datetime]) -> Optional[str]:
+    # Always include microseconds so the dashboard can sort timestamps as strings
+    return value.isoformat(timespec='microseconds') if value else None
+
+def latest_quote_subquery(*criteria):
+    """Quotes ranked newest-first within each lead; ``rn == 1`` is the latest quote."""
+    return select(
+        Quote,
+        func.row_number().over(
+            partition_by=Quote.lead_id,
+            order_by=(Quote.created_at.desc(), Quote.id.desc())
+        ).label('rn')
+    ).where(*criteria).subquery()
+
+def get_latest_quotes(db: Session, lead_ids: List[int]) -> Dict[int, Quote]:
+    """Fetch the latest quote of every lead in ``lead_ids`` with a single query."""
+    if not lead_ids:
+        return {}
+    
+    ranked = latest_quote_subquery(Quote.lead_id.in_(lead_ids))
+    latest = aliased(Quote, ranked)
+    quotes = db.query(latest).filter(ranked.c.rn == 1).all()
+    return {quote.lead_id: quote for quote in quotes}
+
+def serialize_quote_summary(quote: Optional[Quote]) -> Optional[dict]:
+    if not quote:
+        return None
+    
+    return {
+        'id': quote.id,
+        'total_price': quote.total_price,
+        'selected_tier': quote.selected_tier,
+        'roof_size_sqft': quote.roof_size_sqft,
+        'price_per_sqft': quote.total_price / quote.roof_size_sqft if quote.roof_size_sqft else 0,
+        'created_at': format_datetime(quote.created_at)
+    }
+
+def serialize_lead(lead: Lead, latest_quote: Optional[Quote]) -> dict:
+    lead_dict = {column.name: getattr(lead, column.name) for column in Lead.__table__.columns}
+    lead_dict['created_at'] = format_datetime(lead.created_at)
+    lead_dict['updated_at'] = format_datetime(lead.updated_at)
+    lead_dict['latest_quote'] = serialize_quote_summary(latest_quote)
+    return lead_dict
+
+def encode_cursor(lead: Lead) -> str:
+    payload = json.dumps({"created_at": lead.created_at.isoformat(), "id": lead.id})
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(payload["created_at"]), int(payload["id"])
+    except (ValueError, KeyError, TypeError):
+        raise HTTPException(status_code=400, detail="Invalid pagination cursor")
+
 @router.get("/contractor/{contractor_id}", response_model=List[LeadWithQuote])
-async def get_contractor_leads(
+def get_contractor_leads(
     contractor_id: int,
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    after: Optional[str] = Query(None, description="Opaque cursor from the X-Next-Cursor header of the previous page"),
     status: Optional[str] = None,
     search: Optional[str] = None,
-    db: Session = Depends(get_db)
+    db: Session = Depends(get_read_db)
 ):
+    """
+    List a contractor's leads, newest first.
+    
+    Pages can be fetched with ``skip``/``limit`` or, for constant-cost deep
+    paging, by passing the ``X-Next-Cursor`` value of the previous page as
+    ``after``. Search results are ranked by relevance and paged with
+    ``skip``/``limit`` only.
+    """
     contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
@@ -68,104 +141,45 @@ async def get_contractor_leads(
     if status:
         query = query.filter(Lead.status == status)
     
+    if search and after:
+        raise HTTPException(status_code=400, detail="Cursor pagination cannot be combined with search")
+    
     if search:
+        query, _ = lead_search.apply_search(query, search)
+    
+    if after:
+        after_created_at, after_id = decode_cursor(after)
         query = query.filter(
             or_(
-                Lead.name.contains(search),
-                Lead.email.contains(search),
-                Lead.phone.contains(search),
-                Lead.address.contains(search)
+                Lead.created_at < after_created_at,
+                and_(Lead.created_at == after_created_at, Lead.id < after_id)
             )
         )
     
-    # Order by created_at descending (newest first) for consistent sorting
-    leads = query.order_by(Lead.created_at.desc()).offset(skip).limit(limit).all()
+    # Order by created_at descending (newest first), id breaks ties so cursors are stable
+    query = query.order_by(Lead.created_at.desc(), Lead.id.desc())
+    if not after:
+        query = query.offset(skip)
     
-    result = []
-    for lead in leads:
-        lead_dict = lead.__dict__.copy()
-        # Ensure consistent datetime formatting with microseconds
-        if lead_dict.get('created_at') and lead.created_at:
-            # Ensure microseconds are always included for consistent sorting
-            if hasattr(lead.created_at, 'isoformat'):
-                dt = lead.created_at
-                # If the datetime doesn't have microseconds, add them as .000000
-                if dt.microsecond == 0:
-                    lead_dict['created_at'] = dt.strftime('%Y-%m-%dT%H:%M:%S.000000')
-                else:
-                    lead_dict['created_at'] = dt.isoformat()
-            else:
-                lead_dict['created_at'] = lead.created_at
-        if lead_dict.get('updated_at') and lead.updated_at:
-            if hasattr(lead.updated_at, 'isoformat'):
-                dt = lead.updated_at
-                if dt.microsecond == 0:
-                    lead_dict['updated_at'] = dt.strftime('%Y-%m-%dT%H:%M:%S.000000')
-                else:
-                    lead_dict['updated_at'] = dt.isoformat()
-            else:
-                lead_dict['updated_at'] = lead.updated_at
-        
-        latest_quote = db.query(Quote).filter(Quote.lead_id == lead.id).order_by(Quote.created_at.desc()).first()
-        if latest_quote:
-            lead_dict['latest_quote'] = {
-                'id': latest_quote.id,
-                'total_price': latest_quote.total_price,
-                'selected_tier': latest_quote.selected_tier,
-                'roof_size_sqft': latest_quote.roof_size_sqft,
-                'price_per_sqft': latest_quote.total_price / latest_quote.roof_size_sqft if latest_quote.roof_size_sqft else 0,
-                'created_at': latest_quote.created_at.strftime('%Y-%m-%dT%H:%M:%S.000000') if hasattr(latest_quote.created_at, 'strftime') and latest_quote.created_at.microsecond == 0 else latest_quote.created_at.isoformat() if hasattr(latest_quote.created_at, 'isoformat') else latest_quote.created_at
-            }
-        else:
-            lead_dict['latest_quote'] = None
-        result.append(lead_dict)
+    leads = query.limit(limit).all()
+    if leads and len(leads) == limit and not search:
+        response.headers["X-Next-Cursor"] = encode_cursor(leads[-1])
+    
+    latest_quotes = get_latest_quotes(db, [lead.id for lead in leads])
     
-    return result
+    return [serialize_lead(lead, latest_quotes.get(lead.id)) for lead in leads]
 
 @router.get("/{lead_id}", response_model=LeadWithQuote)
-async def get_lead(lead_id: int, db: Session = Depends(get_db)):
+def get_lead(lead_id: int, db: Session = Depends(get_db)):
     lead = db.query(Lead).filter(Lead.id == lead_id).first()
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
     
-    lead_dict = lead.__dict__.copy()
-    # Ensure consistent datetime formatting with microseconds
-    if lead_dict.get('created_at') and lead.created_at:
-        if hasattr(lead.created_at, 'isoformat'):
-            dt = lead.created_at
-            if dt.microsecond == 0:
-                lead_dict['created_at'] = dt.strftime('%Y-%m-%dT%H:%M:%S.000000')
-            else:
-                lead_dict['created_at'] = dt.isoformat()
-        else:
-            lead_dict['created_at'] = lead.created_at
-    if lead_dict.get('updated_at') and lead.updated_at:
-        if hasattr(lead.updated_at, 'isoformat'):
-            dt = lead.updated_at
-            if dt.microsecond == 0:
-                lead_dict['updated_at'] = dt.strftime('%Y-%m-%dT%H:%M:%S.000000')
-            else:
-                lead_dict['updated_at'] = dt.isoformat()
-        else:
-            lead_dict['updated_at'] = lead.updated_at
-    
-    latest_quote = db.query(Quote).filter(Quote.lead_id == lead.id).order_by(Quote.created_at.desc()).first()
-    if latest_quote:
-        lead_dict['latest_quote'] = {
-            'id': latest_quote.id,
-            'total_price': latest_quote.total_price,
-            'roof_size_sqft': latest_quote.roof_size_sqft,
-            'price_per_sqft': latest_quote.total_price / latest_quote.roof_size_sqft if latest_quote.roof_size_sqft else 0,
-            'selected_tier': latest_quote.selected_tier,
-            'created_at': latest_quote.created_at.isoformat() if hasattr(latest_quote.created_at, 'isoformat') else latest_quote.created_at
-        }
-    else:
-        lead_dict['latest_quote'] = None
-    
-    return lead_dict
+    latest_quotes = get_latest_quotes(db, [lead.id])
+    return serialize_lead(lead, latest_quotes.get(lead.id))
 
-@router.post("/", response_model=LeadResponse)
-async def create_lead(lead: LeadCreate, db: Session = Depends(get_db)):
+@router.post("/", response_model=LeadResponse, dependencies=[Depends(pin_reads)])
+def create_lead(lead: LeadCreate, db: Session = Depends(get_db)):
     contractor = db.query(Contractor).filter(Contractor.id == lead.contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
@@ -176,8 +190,8 @@ async def create_lead(lead: LeadCreate, db: Session = Depends(get_db)):
     db.refresh(db_lead)
     return db_lead
 
-@router.put("/{lead_id}", response_model=LeadResponse)
-async def update_lead(
+@router.put("/{lead_id}", response_model=LeadResponse, dependencies=[Depends(pin_reads)])
+def update_lead(
     lead_id: int,
     lead: LeadUpdate,
     db: Session = Depends(get_db)
@@ -194,8 +208,8 @@ async def update_lead(
     db.refresh(db_lead)
     return db_lead
 
-@router.delete("/{lead_id}")
-async def delete_lead(lead_id: int, db: Session = Depends(get_db)):
+@router.delete("/{lead_id}", dependencies=[Depends(pin_reads)])
+def delete_lead(lead_id: int, db: Session = Depends(get_db)):
     lead = db.query(Lead).filter(Lead.id == lead_id).first()
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
@@ -204,52 +218,123 @@ async def delete_lead(lead_id: int, db: Session = Depends(get_db)):
     db.commit()
     return {"message": "Lead deleted successfully"}
 
+EXPORT_CHUNK_SIZE = 500
+
+EXPORT_FIELDS = [
+    'id', 'name', 'email', 'phone', 'address', 'status', 'source', 'additional_notes', 'created_at',
+    'latest_quote_id', 'latest_quote_tier', 'latest_quote_roof_size_sqft', 'latest_quote_total_price',
+    'latest_quote_created_at'
+]
+
+def stream_leads_csv(
+    contractor_id: int,
+    status: Optional[str],
+    created_from: Optional[date],
+    created_to: Optional[date],
+    primary: bool = False
+) -> Iterator[bytes]:
+    """
+    Yield the export as encoded CSV chunks of ``EXPORT_CHUNK_SIZE`` rows.
+
+    Rows are streamed from a server-side cursor with their own session, since
+    the request's session is closed before the response body is sent. The
+    session reads from a replica unless ``primary`` is set.
+    """
+    criteria = [Lead.contractor_id == contractor_id]
+    if status:
+        criteria.append(Lead.status == status)
+    if created_from:
+        criteria.append(Lead.created_at >= datetime.combine(created_from, time.min))
+    if created_to:
+        criteria.append(Lead.created_at < datetime.combine(created_to + timedelta(days=1), time.min))
+    
+    ranked = latest_quote_subquery(Quote.lead_id.in_(select(Lead.id).where(*criteria)))
+    stmt = select(
+        Lead.id, Lead.name, Lead.email, Lead.phone, Lead.address, Lead.status, Lead.source,
+        Lead.additional_notes, Lead.created_at,
+        ranked.c.id, ranked.c.selected_tier, ranked.c.roof_size_sqft, ranked.c.total_price,
+        ranked.c.created_at
+    ).outerjoin(
+        ranked, and_(ranked.c.lead_id == Lead.id, ranked.c.rn == 1)
+    ).where(*criteria).order_by(Lead.created_at.desc(), Lead.id.desc())
+    
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(EXPORT_FIELDS)
+    
+    db = read_session(primary=primary)
+    try:
+        result = db.execute(stmt, execution_options={"stream_results": True}).yield_per(EXPORT_CHUNK_SIZE)
+        for rows in result.partitions():
+            for row in rows:
+                writer.writerow([
+                    value.isoformat() if isinstance(value, datetime) else value
+                    for value in row
+                ])
+            yield buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate(0)
+        
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    finally:
+        db.close()
+
 @router.get("/contractor/{contractor_id}/export")
-async def export_leads(
+def export_leads(
     contractor_id: int,
+    request: Request,
     status: Optional[str] = None,
-    db: Session = Depends(get_db)
+    created_from: Optional[date] = None,
+    created_to: Optional[date] = None,
+    db: Session = Depends(get_read_db)
 ):
     contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
     
-    query = db.query(Lead).filter(Lead.contractor_id == contractor_id)
-    if status:
-        query = query.filter(Lead.status == status)
-    
-    leads = query.all()
-    
-    output = io.StringIO()
-    writer = csv.DictWriter(
-        output,
-        fieldnames=['id', 'name', 'email', 'phone', 'address', 'status', 'source', 'additional_notes', 'created_at']
-    )
-    writer.writeheader()
-    
-    for lead in leads:
-        writer.writerow({
-            'id': lead.id,
-            'name': lead.name,
-            'email': lead.email,
-            'phone': lead.phone,
-            'address': lead.address,
-            'status': lead.status,
-            'source': lead.source,
-            'additional_notes': lead.additional_notes,
-            'created_at': lead.created_at.isoformat() if lead.created_at else ''
-        })
-    
-    output.seek(0)
-    
     return StreamingResponse(
-        io.BytesIO(output.getvalue().encode()),
+        stream_leads_csv(contractor_id, status, created_from, created_to, reads_from_primary(request)),
         media_type='text/csv',
         headers={
             "Content-Disposition": f"attachment; filename=leads_{contractor.company_name.replace(' ', '_')}_{datetime.now().strftime('%Y%m%d')}.csv"
         }
     )
 
+def run_lead_import(contractor_id: int, upload: io.IOBase, fmt: str) -> dict:
+    db = SessionLocal()
+    try:
+        return lead_import.import_leads(db, contractor_id, upload, fmt)
+    finally:
+        db.close()
+
+@router.post("/contractor/{contractor_id}/import", dependencies=[Depends(pin_reads)])
+async def import_leads(
+    contractor_id: int,
+    request: Request,
+    format: Optional[str] = Query(None, description="csv or ndjson; defaults to the Content-Type"),
+    db: Session = Depends(get_db)
+):
+    contractor = await run_in_threadpool(db.get, Contractor, contractor_id)
+    if not contractor:
+        raise HTTPException(status_code=404, detail="Contractor not found")
+    
+    fmt = lead_import.detect_format(request.headers.get("content-type"), format)
+    if fmt is None:
+        raise HTTPException(status_code=415, detail="Upload text/csv or application/x-ndjson")
+    
+    # Spool the body as it arrives; large uploads go to disk instead of memory
+    with tempfile.SpooledTemporaryFile(max_size=8 * 1024 * 1024) as upload:
+        size = 0
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.LEAD_IMPORT_MAX_BYTES:
+                raise HTTPException(status_code=413, detail="Import file too large")
+            upload.write(chunk)
+        upload.seek(0)
+        
+        return await run_in_threadpool(run_lead_import, contractor_id, upload, fmt)
+
 class WidgetLeadCreate(BaseModel):
     contractor_id: int
     first_name: str
@@ -268,7 +353,7 @@ class WidgetLeadCreate(BaseModel):
     total_price: float
 
 @router.post("/widget-capture", response_model=LeadResponse)
-async def create_widget_lead(lead_data: WidgetLeadCreate, db: Session = Depends(get_db)):
+def create_widget_lead(lead_data: WidgetLeadCreate, db: Session = Depends(get_db)):
     """
     Create a new lead from the widget with quote information
     """
@@ -1,10 +1,13 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.orm import Session
 from database import get_db
-from models import Pricing, Contractor
+from models import Pricing, Contractor, RepricingJob
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional, List
+from routers.dependencies import pin_reads
+from services import quote_repricing
+from services.quote_repricing import quote_repricer
 
 router = APIRouter()
 
@@ -53,7 +56,7 @@ class PricingResponse(PricingBase):
         from_attributes = True
 
 @router.get("/contractor/{contractor_id}", response_model=PricingResponse)
-async def get_contractor_pricing(contractor_id: int, db: Session = Depends(get_db)):
+def get_contractor_pricing(contractor_id: int, db: Session = Depends(get_db)):
     pricing = db.query(Pricing).filter(Pricing.contractor_id == contractor_id).first()
     if not pricing:
         contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
@@ -68,7 +71,7 @@ async def get_contractor_pricing(contractor_id: int, db: Session = Depends(get_d
     return pricing
 
 @router.post("/", response_model=PricingResponse)
-async def create_pricing(pricing: PricingCreate, db: Session = Depends(get_db)):
+def create_pricing(pricing: PricingCreate, db: Session = Depends(get_db)):
     existing = db.query(Pricing).filter(Pricing.contractor_id == pricing.contractor_id).first()
     if existing:
         raise HTTPException(status_code=400, detail="Pricing already exists for this contractor")
@@ -83,10 +86,11 @@ async def create_pricing(pricing: PricingCreate, db: Session = Depends(get_db)):
     db.refresh(db_pricing)
     return db_pricing
 
-@router.put("/contractor/{contractor_id}", response_model=PricingResponse)
-async def update_pricing(
+@router.put("/contractor/{contractor_id}", response_model=PricingResponse, dependencies=[Depends(pin_reads)])
+def update_pricing(
     contractor_id: int,
     pricing: PricingUpdate,
+    response: Response,
     db: Session = Depends(get_db)
 ):
     db_pricing = db.query(Pricing).filter(Pricing.contractor_id == contractor_id).first()
@@ -98,9 +102,37 @@ async def update_pricing(
         db.add(db_pricing)
     
     update_data = pricing.dict(exclude_unset=True)
+    changes = quote_repricing.price_changes(db_pricing, update_data) if db_pricing.id else {}
     for field, value in update_data.items():
         setattr(db_pricing, field, value)
     
+    job = quote_repricing.enqueue(db, contractor_id, changes) if changes else None
     db.commit()
     db.refresh(db_pricing)
-    return db_pricing
\ No newline at end of file
+    if job is not None:
+        quote_repricer.wake()
+        response.headers["X-Repricing-Job"] = str(job.id)
+    return db_pricing
+
+@router.post("/contractor/{contractor_id}/reprice", status_code=202, dependencies=[Depends(pin_reads)])
+def reprice_quotes(contractor_id: int, db: Session = Depends(get_db)):
+    contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
+    if not contractor:
+        raise HTTPException(status_code=404, detail="Contractor not found")
+    
+    job = quote_repricing.enqueue(db, contractor_id)
+    db.commit()
+    db.refresh(job)
+    quote_repricer.wake()
+    return quote_repricing.job_status(job)
+
+@router.get("/contractor/{contractor_id}/reprice/{job_id}")
+def get_repricing_job(contractor_id: int, job_id: int, db: Session = Depends(get_db)):
+    job = db.query(RepricingJob).filter(
+        RepricingJob.id == job_id,
+        RepricingJob.contractor_id == contractor_id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Repricing job not found")
+    
+    return quote_repricing.job_status(job)
\ No newline at end of file
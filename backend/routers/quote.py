@@ -1,11 +1,21 @@
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import FileResponse, StreamingResponse
 from sqlalchemy.orm import Session
-from database import get_db
+from database import get_db, SessionLocal
 from models import Quote, Lead, Pricing, Contractor
-from pydantic import BaseModel
-from typing import List, Optional
+from pydantic import BaseModel, Field
+from typing import AsyncIterator, List, Optional
 from datetime import datetime
+import asyncio
+import json
+import logging
 import random
+from config import settings
+from services import building_footprints, pricing_engine, quote_pdf
+from services.roof_measurement import roof_measurement
+
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
@@ -15,6 +25,8 @@ class QuoteCreate(BaseModel):
     selected_tier: str
     include_removal: bool = True
     include_permit: bool = True
+    lat: Optional[float] = None
+    lng: Optional[float] = None
 
 class QuoteResponse(BaseModel):
     id: int
@@ -37,6 +49,18 @@ class AddressValidation(BaseModel):
     address: str
     contractor_id: int
 
+class BatchAddress(BaseModel):
+    address: str
+    lat: Optional[float] = None
+    lng: Optional[float] = None
+    reference: Optional[str] = None  # caller's own id, echoed back
+
+class QuoteBatchRequest(BaseModel):
+    contractor_id: int
+    addresses: List[BatchAddress] = Field(..., min_length=1, max_length=settings.QUOTE_BATCH_MAX_ADDRESSES)
+    include_removal: bool = True
+    include_permit: bool = True
+
 class RoofMeasurement(BaseModel):
     address: str
     sqft: float
@@ -44,26 +68,13 @@ class RoofMeasurement(BaseModel):
     complexity: str
     pitch: str
 
-def calculate_roof_size(address: str) -> dict:
-    base_sqft = random.randint(1500, 3500)
-    complexity_factor = random.choice([1.0, 1.15, 1.25])
-    
-    roof_sqft = base_sqft * complexity_factor
-    squares = roof_sqft / 100
-    
-    complexity = "simple" if complexity_factor == 1.0 else "moderate" if complexity_factor == 1.15 else "complex"
-    pitch = random.choice(["4/12", "6/12", "8/12", "10/12"])
-    
-    return {
-        "roof_size_sqft": round(roof_sqft, 2),
-        "squares": round(squares, 2),
-        "complexity": complexity,
-        "pitch": pitch,
-        "home_sqft": base_sqft
-    }
+def calculate_roof_size(db: Session, address: str, lat: Optional[float] = None, lng: Optional[float] = None) -> dict:
+    # Adds the measurement to the session's cache; the handler's commit stores it
+    location = (lat, lng) if lat is not None and lng is not None else None
+    return roof_measurement.measure(db, address, location).as_roof_data()
 
 @router.post("/validate-address")
-async def validate_address(validation: AddressValidation, db: Session = Depends(get_db)):
+def validate_address(validation: AddressValidation, db: Session = Depends(get_db)):
     contractor = db.query(Contractor).filter(Contractor.id == validation.contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
@@ -81,8 +92,14 @@ async def validate_address(validation: AddressValidation, db: Session = Depends(
     }
 
 @router.post("/measure-roof")
-async def measure_roof(address: str):
-    measurement = calculate_roof_size(address)
+def measure_roof(
+    address: str,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    db: Session = Depends(get_db)
+):
+    measurement = calculate_roof_size(db, address, lat, lng)
+    db.commit()
     
     return RoofMeasurement(
         address=address,
@@ -92,8 +109,21 @@ async def measure_roof(address: str):
         pitch=measurement["pitch"]
     )
 
+@router.get("/footprint")
+def get_building_footprint(
+    lat: float = Query(..., ge=-90, le=90),
+    lng: float = Query(..., ge=-180, le=180),
+    radius: float = Query(settings.FOOTPRINT_SEARCH_RADIUS_M, gt=0, le=500),
+    db: Session = Depends(get_db)
+):
+    footprint = building_footprints.nearest(db, lat, lng, radius)
+    if not footprint:
+        raise HTTPException(status_code=404, detail="No building found near this location")
+    
+    return footprint.as_dict()
+
 @router.post("/", response_model=QuoteResponse)
-async def create_quote(quote: QuoteCreate, db: Session = Depends(get_db)):
+def create_quote(quote: QuoteCreate, db: Session = Depends(get_db)):
     lead = db.query(Lead).filter(Lead.id == quote.lead_id).first()
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
@@ -105,36 +135,33 @@ async def create_quote(quote: QuoteCreate, db: Session = Depends(get_db)):
         db.commit()
         db.refresh(pricing)
     
-    roof_data = calculate_roof_size(quote.address)
-    
-    tier_prices = {
-        "good": pricing.good_tier_price,
-        "better": pricing.better_tier_price,
-        "best": pricing.best_tier_price
-    }
-    
-    if quote.selected_tier not in tier_prices:
+    if quote.selected_tier not in pricing_engine.TIERS:
         raise HTTPException(status_code=400, detail="Invalid tier selected")
     
-    base_price = roof_data["roof_size_sqft"] * tier_prices[quote.selected_tier]
-    removal_cost = roof_data["roof_size_sqft"] * pricing.removal_price if quote.include_removal else 0
-    permit_cost = pricing.permit_price if quote.include_permit else 0
-    total_price = base_price + removal_cost + permit_cost
+    roof_data = calculate_roof_size(db, quote.address, quote.lat, quote.lng)
+    price = pricing_engine.price_options(
+        pricing_engine.PriceSheet.from_pricing(pricing),
+        roof_data["roof_size_sqft"],
+        quote.include_removal,
+        quote.include_permit,
+        tiers=[quote.selected_tier]
+    )[quote.selected_tier]
     
     db_quote = Quote(
         lead_id=quote.lead_id,
         address=quote.address,
         roof_size_sqft=roof_data["roof_size_sqft"],
         selected_tier=quote.selected_tier,
-        base_price=round(base_price, 2),
-        removal_cost=round(removal_cost, 2),
-        permit_cost=round(permit_cost, 2),
-        total_price=round(total_price, 2),
+        base_price=price.base_price,
+        removal_cost=price.removal_cost,
+        permit_cost=price.permit_cost,
+        total_price=price.total_price,
         quote_data={
             "roof_squares": roof_data["squares"],
             "complexity": roof_data["complexity"],
             "pitch": roof_data["pitch"],
             "home_sqft": roof_data["home_sqft"],
+            "measurement_provider": roof_data["measurement_provider"],
             "include_removal": quote.include_removal,
             "include_permit": quote.include_permit
         }
@@ -147,7 +174,7 @@ async def create_quote(quote: QuoteCreate, db: Session = Depends(get_db)):
     return db_quote
 
 @router.get("/lead/{lead_id}", response_model=List[QuoteResponse])
-async def get_lead_quotes(lead_id: int, db: Session = Depends(get_db)):
+def get_lead_quotes(lead_id: int, db: Session = Depends(get_db)):
     lead = db.query(Lead).filter(Lead.id == lead_id).first()
     if not lead:
         raise HTTPException(status_code=404, detail="Lead not found")
@@ -156,20 +183,52 @@ async def get_lead_quotes(lead_id: int, db: Session = Depends(get_db)):
     return quotes
 
 @router.get("/{quote_id}", response_model=QuoteResponse)
-async def get_quote(quote_id: int, db: Session = Depends(get_db)):
+def get_quote(quote_id: int, db: Session = Depends(get_db)):
     quote = db.query(Quote).filter(Quote.id == quote_id).first()
     if not quote:
         raise HTTPException(status_code=404, detail="Quote not found")
     
     return quote
 
+@router.get("/{quote_id}/pdf")
+def get_quote_pdf(quote_id: int, request: Request, db: Session = Depends(get_db)):
+    quote = db.query(Quote).filter(Quote.id == quote_id).first()
+    if not quote:
+        raise HTTPException(status_code=404, detail="Quote not found")
+    
+    try:
+        pdf = quote_pdf.stored_pdf(db, quote)
+    except quote_pdf.RenderError as e:
+        logger.error(f"PDF for quote {quote_id} failed: {e}")
+        raise HTTPException(status_code=503, detail="Could not render the quote PDF, please try again")
+    
+    # Versioned URLs (?v=digest) never change content; the bare URL must be revalidated
+    headers = {
+        "ETag": pdf.etag,
+        "Cache-Control": "private, max-age=31536000, immutable" if request.query_params.get("v") == pdf.digest
+        else "private, no-cache"
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if pdf.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    return FileResponse(
+        pdf.path,
+        media_type="application/pdf",
+        filename=f"Quote_{quote_id}.pdf",
+        content_disposition_type="inline",
+        headers=headers
+    )
+
 @router.post("/calculate")
-async def calculate_quote(
+def calculate_quote(
     contractor_id: int,
     address: str,
     selected_tier: str,
     include_removal: bool = True,
     include_permit: bool = True,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
     db: Session = Depends(get_db)
 ):
     contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
@@ -177,47 +236,117 @@ async def calculate_quote(
         raise HTTPException(status_code=404, detail="Contractor not found")
     
     pricing = db.query(Pricing).filter(Pricing.contractor_id == contractor_id).first()
-    if not pricing:
-        pricing = Pricing(contractor_id=contractor_id)
-    
-    roof_data = calculate_roof_size(address)
-    
-    tier_info = {
-        "good": {
-            "name": pricing.good_tier_name,
-            "price": pricing.good_tier_price,
-            "warranty": pricing.good_tier_warranty
-        },
-        "better": {
-            "name": pricing.better_tier_name,
-            "price": pricing.better_tier_price,
-            "warranty": pricing.better_tier_warranty
-        },
-        "best": {
-            "name": pricing.best_tier_name,
-            "price": pricing.best_tier_price,
-            "warranty": pricing.best_tier_warranty
-        }
-    }
+    roof_data = calculate_roof_size(db, address, lat, lng)
+    db.commit()
+    sheet = pricing_engine.PriceSheet.from_pricing(pricing)
+    prices = pricing_engine.price_options(sheet, roof_data["roof_size_sqft"], include_removal, include_permit)
     
-    calculations = {}
-    for tier, info in tier_info.items():
-        base = roof_data["roof_size_sqft"] * info["price"]
-        removal = roof_data["roof_size_sqft"] * pricing.removal_price if include_removal else 0
-        permit = pricing.permit_price if include_permit else 0
-        
-        calculations[tier] = {
-            "name": info["name"],
-            "warranty": info["warranty"],
-            "base_price": round(base, 2),
-            "removal_cost": round(removal, 2),
-            "permit_cost": round(permit, 2),
-            "total_price": round(base + removal + permit, 2)
-        }
+    calculations = {
+        tier: {"name": sheet.names[tier], "warranty": sheet.warranties[tier], **price.as_dict()}
+        for tier, price in prices.items()
+    }
     
     return {
         "address": address,
         "roof_details": roof_data,
         "pricing_tiers": calculations,
         "selected_tier": calculations.get(selected_tier)
-    }
\ No newline at end of file
+    }
+
+@router.post("/calculate/grid")
+def calculate_quote_grid(
+    contractor_id: int,
+    address: str,
+    lat: Optional[float] = None,
+    lng: Optional[float] = None,
+    pitch_multipliers: List[float] = Query([1.0]),
+    db: Session = Depends(get_db)
+):
+    contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
+    if not contractor:
+        raise HTTPException(status_code=404, detail="Contractor not found")
+    
+    if len(pitch_multipliers) > 10 or any(m <= 0 for m in pitch_multipliers):
+        raise HTTPException(status_code=400, detail="Provide up to 10 positive pitch multipliers")
+    
+    pricing = db.query(Pricing).filter(Pricing.contractor_id == contractor_id).first()
+    roof_data = calculate_roof_size(db, address, lat, lng)
+    db.commit()
+    
+    return {
+        "address": address,
+        "roof_details": roof_data,
+        "options": pricing_engine.price_grid(
+            pricing_engine.PriceSheet.from_pricing(pricing),
+            roof_data["roof_size_sqft"],
+            pitch_multipliers=pitch_multipliers
+        )
+    }
+
+def measure_batch_address(item: BatchAddress) -> dict:
+    # Runs on a worker thread, so it needs its own session
+    db = SessionLocal()
+    try:
+        roof_data = calculate_roof_size(db, item.address, item.lat, item.lng)
+        db.commit()
+        return roof_data
+    finally:
+        db.close()
+
+async def stream_batch_quotes(
+    batch: QuoteBatchRequest,
+    sheet: pricing_engine.PriceSheet
+) -> AsyncIterator[bytes]:
+    pending: asyncio.Queue = asyncio.Queue()
+    for index, item in enumerate(batch.addresses):
+        pending.put_nowait((index, item))
+    results: asyncio.Queue = asyncio.Queue()
+    
+    async def worker():
+        while True:
+            try:
+                index, item = pending.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+            line = {"index": index, "reference": item.reference, "address": item.address}
+            try:
+                roof_data = await run_in_threadpool(measure_batch_address, item)
+                prices = pricing_engine.price_options(
+                    sheet, roof_data["roof_size_sqft"], batch.include_removal, batch.include_permit
+                )
+                line["roof_details"] = roof_data
+                line["pricing_tiers"] = {
+                    tier: {"name": sheet.names[tier], "warranty": sheet.warranties[tier], **price.as_dict()}
+                    for tier, price in prices.items()
+                }
+            except Exception as e:
+                logger.error(f"Batch quote for {item.address!r} failed: {e}", exc_info=True)
+                line["error"] = "Could not measure this address"
+            await results.put(line)
+    
+    workers = [
+        asyncio.create_task(worker())
+        for _ in range(min(settings.QUOTE_BATCH_CONCURRENCY, len(batch.addresses)))
+    ]
+    errors = 0
+    try:
+        # Lines are sent in completion order; "index" ties them back to the request
+        for _ in range(len(batch.addresses)):
+            line = await results.get()
+            errors += "error" in line
+            yield (json.dumps(line) + "\n").encode()
+        yield (json.dumps({"done": True, "count": len(batch.addresses), "errors": errors}) + "\n").encode()
+    finally:
+        for task in workers:
+            task.cancel()
+
+@router.post("/calculate/batch")
+def calculate_quote_batch(batch: QuoteBatchRequest, db: Session = Depends(get_db)):
+    contractor = db.query(Contractor).filter(Contractor.id == batch.contractor_id).first()
+    if not contractor:
+        raise HTTPException(status_code=404, detail="Contractor not found")
+    
+    pricing = db.query(Pricing).filter(Pricing.contractor_id == batch.contractor_id).first()
+    sheet = pricing_engine.PriceSheet.from_pricing(pricing)
+    
+    return StreamingResponse(stream_batch_quotes(batch, sheet), media_type="application/x-ndjson")
\ No newline at end of file
@@ -2,6 +2,7 @@ from fastapi import APIRouter, Depends, HTTPException
 from sqlalchemy.orm import Session
 from database import get_db
 from models import Template, Contractor
+from services import templating
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional, List
@@ -47,7 +48,7 @@ class TemplateResponse(TemplateBase):
         from_attributes = True
 
 @router.get("/contractor/{contractor_id}", response_model=TemplateResponse)
-async def get_contractor_template(contractor_id: int, db: Session = Depends(get_db)):
+def get_contractor_template(contractor_id: int, db: Session = Depends(get_db)):
     template = db.query(Template).filter(Template.contractor_id == contractor_id).first()
     if not template:
         contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
@@ -62,7 +63,7 @@ async def get_contractor_template(contractor_id: int, db: Session = Depends(get_
     return template
 
 @router.post("/", response_model=TemplateResponse)
-async def create_template(template: TemplateCreate, db: Session = Depends(get_db)):
+def create_template(template: TemplateCreate, db: Session = Depends(get_db)):
     existing = db.query(Template).filter(Template.contractor_id == template.contractor_id).first()
     if existing:
         raise HTTPException(status_code=400, detail="Template already exists for this contractor")
@@ -78,7 +79,7 @@ async def create_template(template: TemplateCreate, db: Session = Depends(get_db
     return db_template
 
 @router.put("/contractor/{contractor_id}", response_model=TemplateResponse)
-async def update_template(
+def update_template(
     contractor_id: int,
     template: TemplateUpdate,
     db: Session = Depends(get_db)
@@ -100,37 +101,13 @@ async def update_template(
     return db_template
 
 @router.get("/contractor/{contractor_id}/preview")
-async def preview_template(contractor_id: int, db: Session = Depends(get_db)):
+def preview_template(contractor_id: int, db: Session = Depends(get_db)):
     template = db.query(Template).filter(Template.contractor_id == contractor_id).first()
     if not template:
         raise HTTPException(status_code=404, detail="Template not found")
     
-    contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
-    
-    preview_html = f"""
-    <html>
-    <head><style>
-        body {{ font-family: Arial, sans-serif; margin: 20px; }}
-        .header {{ text-align: center; color: #22c55e; }}
-        .section {{ margin: 20px 0; }}
-    </style></head>
-    <body>
-        <h1 class="header">{template.header_text}</h1>
-        <div class="section">
-            <h2>{contractor.company_name}</h2>
-            <p>{contractor.address}</p>
-            <p>{contractor.phone} | {contractor.email}</p>
-        </div>
-        {'<div class="section"><h3>Warranty Information</h3><p>Full warranty details included</p></div>' if template.show_warranty else ''}
-        {'<div class="section"><h3>Financing Options</h3><p>Flexible payment plans available</p></div>' if template.show_financing else ''}
-        {'<div class="section"><h3>Customer Testimonials</h3><p>5-star reviews from satisfied customers</p></div>' if template.show_testimonials else ''}
-        {f'<div class="section"><p>{template.custom_message}</p></div>' if template.custom_message else ''}
-        {f'<div class="section"><small>{template.terms_conditions}</small></div>' if template.terms_conditions else ''}
-        <div class="section" style="text-align: center;">
-            <p>{template.footer_text}</p>
-        </div>
-    </body>
-    </html>
-    """
+    page = templating.contractor_page(db, "template_preview.html", contractor_id)
+    if page is None:
+        raise HTTPException(status_code=404, detail="Contractor not found")
     
-    return {"preview_html": preview_html}
\ No newline at end of file
+    return {"preview_html": page.render()}
@@ -1,10 +1,15 @@
-from fastapi import APIRouter, Depends, HTTPException
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Request, Response
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.orm import Session, joinedload
 from database import get_db
-from models import Contractor, WidgetSettings, Branding, Pricing
+from models import Contractor, WidgetSettings
 from pydantic import BaseModel
 from datetime import datetime
 from typing import Optional
+from config import settings as app_settings
+from services import widget_bundles
+from services.widget_bundles import build_widget_payload
+from services.widget_cache import widget_data_cache
 
 router = APIRouter()
 
@@ -37,7 +42,7 @@ class WidgetSettingsResponse(WidgetSettingsBase):
         from_attributes = True
 
 @router.get("/contractor/{contractor_id}/settings", response_model=WidgetSettingsResponse)
-async def get_widget_settings(contractor_id: int, db: Session = Depends(get_db)):
+def get_widget_settings(contractor_id: int, db: Session = Depends(get_db)):
     settings = db.query(WidgetSettings).filter(WidgetSettings.contractor_id == contractor_id).first()
     if not settings:
         contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
@@ -52,7 +57,7 @@ async def get_widget_settings(contractor_id: int, db: Session = Depends(get_db))
     return settings
 
 @router.put("/contractor/{contractor_id}/settings", response_model=WidgetSettingsResponse)
-async def update_widget_settings(
+def update_widget_settings(
     contractor_id: int,
     settings: WidgetSettingsUpdate,
     db: Session = Depends(get_db)
@@ -74,107 +79,53 @@ async def update_widget_settings(
     return db_settings
 
 @router.get("/contractor/{contractor_id}/embed-code")
-async def get_embed_code(contractor_id: int, db: Session = Depends(get_db)):
+def get_embed_code(contractor_id: int, db: Session = Depends(get_db)):
     contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
     if not contractor:
         raise HTTPException(status_code=404, detail="Contractor not found")
     
-    settings = db.query(WidgetSettings).filter(WidgetSettings.contractor_id == contractor_id).first()
-    if not settings:
-        settings = WidgetSettings(contractor_id=contractor_id)
+    # Built when the bundle was published; only a widget the publisher has not reached yet is built here
+    embed = widget_bundles.published_embed_code(contractor.widget_id)
+    if embed is None:
+        embed = widget_bundles.publish_contractor(db, contractor_id)
+    if embed is None:
+        raise HTTPException(status_code=409, detail="Widget id cannot be published")
     
-    iframe_code = f"""
-<!-- Roof Quote Pro Widget -->
-<iframe 
-    src="http://localhost:5173/widget-embed?id={contractor.widget_id}"
-    style="position: fixed; {settings.position.replace('-', ': 20px; ')}: 20px; width: 400px; height: 600px; border: none; z-index: 9999;"
-    allow="geolocation">
-</iframe>
-"""
-    
-    script_code = f"""
-<!-- Roof Quote Pro Widget Script -->
-<script>
-(function() {{
-    var widget = document.createElement('div');
-    widget.id = 'roof-quote-widget';
-    widget.setAttribute('data-widget-id', '{contractor.widget_id}');
-    widget.setAttribute('data-position', '{settings.position}');
-    widget.setAttribute('data-button-text', '{settings.button_text}');
-    widget.setAttribute('data-auto-open', '{str(settings.auto_open).lower()}');
-    widget.setAttribute('data-delay', '{settings.delay_seconds}');
-    document.body.appendChild(widget);
+    return embed
+
+def load_widget_data(db: Session, widget_id: str):
+    contractor_id = widget_data_cache.owner(widget_id)
+    if contractor_id is None:
+        contractor_id = db.query(Contractor.id).filter(Contractor.widget_id == widget_id).scalar()
+        if contractor_id is None:
+            return None
+        widget_data_cache.set_owner(widget_id, contractor_id)
     
-    var script = document.createElement('script');
-    script.src = 'http://localhost:5173/widget.js';
-    script.async = true;
-    document.head.appendChild(script);
-}})();
-</script>
-"""
+    def load_payload():
+        contractor = db.query(Contractor).options(
+            joinedload(Contractor.pricing),
+            joinedload(Contractor.branding),
+            joinedload(Contractor.widget_settings)
+        ).filter(Contractor.widget_id == widget_id).first()
+        return build_widget_payload(contractor) if contractor else None
     
-    return {
-        "widget_id": contractor.widget_id,
-        "iframe_code": iframe_code,
-        "script_code": script_code
-    }
+    return widget_data_cache.get_or_load(widget_id, contractor_id, load_payload)
 
 @router.get("/data/{widget_id}")
-async def get_widget_data(widget_id: str, db: Session = Depends(get_db)):
-    contractor = db.query(Contractor).filter(Contractor.widget_id == widget_id).first()
-    if not contractor:
-        raise HTTPException(status_code=404, detail="Widget not found")
-    
-    pricing = db.query(Pricing).filter(Pricing.contractor_id == contractor.id).first()
-    branding = db.query(Branding).filter(Branding.contractor_id == contractor.id).first()
-    settings = db.query(WidgetSettings).filter(WidgetSettings.contractor_id == contractor.id).first()
+async def get_widget_data(widget_id: str, request: Request, db: Session = Depends(get_db)):
+    # In-process cache hits are answered on the event loop; misses and remote lookups need a worker thread
+    entry = widget_data_cache.get(widget_id) if widget_data_cache.cache.backend.local else None
+    if entry is None:
+        entry = await run_in_threadpool(load_widget_data, db, widget_id)
+        if entry is None:
+            raise HTTPException(status_code=404, detail="Widget not found")
     
-    if not pricing:
-        pricing = Pricing(contractor_id=contractor.id)
-    if not branding:
-        branding = Branding(contractor_id=contractor.id)
-    if not settings:
-        settings = WidgetSettings(contractor_id=contractor.id)
+    headers = {
+        "ETag": entry.etag,
+        "Cache-Control": f"public, max-age={app_settings.WIDGET_DATA_MAX_AGE}"
+    }
+    if_none_match = request.headers.get("if-none-match", "")
+    if entry.etag in [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]:
+        return Response(status_code=304, headers=headers)
     
-    return {
-        "contractor": {
-            "company_name": contractor.company_name,
-            "email": contractor.email,
-            "phone": contractor.phone,
-            "website": contractor.website
-        },
-        "pricing": {
-            "good": {
-                "name": pricing.good_tier_name,
-                "price": pricing.good_tier_price,
-                "warranty": pricing.good_tier_warranty
-            },
-            "better": {
-                "name": pricing.better_tier_name,
-                "price": pricing.better_tier_price,
-                "warranty": pricing.better_tier_warranty
-            },
-            "best": {
-                "name": pricing.best_tier_name,
-                "price": pricing.best_tier_price,
-                "warranty": pricing.best_tier_warranty
-            },
-            "removal_price": pricing.removal_price,
-            "permit_price": pricing.permit_price
-        },
-        "branding": {
-            "logo_url": branding.logo_url,
-            "primary_color": branding.primary_color,
-            "secondary_color": branding.secondary_color,
-            "accent_color": branding.accent_color,
-            "font_family": branding.font_family
-        },
-        "settings": {
-            "position": settings.position,
-            "button_text": settings.button_text,
-            "auto_open": settings.auto_open,
-            "delay_seconds": settings.delay_seconds,
-            "show_on_mobile": settings.show_on_mobile,
-            "custom_css": settings.custom_css
-        }
-    }
\ No newline at end of file
+    return Response(content=entry.body, media_type="application/json", headers=headers)
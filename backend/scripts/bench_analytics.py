@@ -0,0 +1,198 @@
+"""
+Benchmark the conversion funnel and quote summary queries.
+
+Seeds a throwaway SQLite database with widget events, leads and quotes,
+then compares the per-metric COUNT queries the analytics router used to
+issue against the conditional-aggregate queries over rollups.
+
+    python scripts/bench_analytics.py --events 1000000
+"""
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--events", type=int, default=1_000_000)
+    parser.add_argument("--leads", type=int, default=20_000)
+    parser.add_argument("--contractors", type=int, default=5)
+    parser.add_argument("--history-days", type=int, default=180)
+    parser.add_argument("--window-days", type=int, default=30)
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--db", help="SQLite file to use (default: a temporary file)")
+    return parser.parse_args()
+
+
+args = parse_args()
+db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench_analytics.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+from sqlalchemy import and_, event, func, insert  # noqa: E402
+
+from database import Base, SessionLocal, engine, ensure_schema  # noqa: E402
+from models import Contractor, Lead, Quote, WidgetAnalytics  # noqa: E402
+from services import analytics_rollup  # noqa: E402
+
+EVENT_TYPES = ["widget_view"] * 6 + ["widget_open"] * 3 + ["quote_request"]
+CHUNK = 50_000
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    ensure_schema()
+    now = datetime.utcnow()
+    db = SessionLocal()
+    try:
+        db.execute(insert(Contractor), [
+            {"id": i, "company_name": f"Contractor {i}", "email": f"c{i}@example.com", "widget_id": f"w{i}"}
+            for i in range(1, args.contractors + 1)
+        ])
+
+        def timestamp():
+            return now - timedelta(seconds=random.randint(0, args.history_days * 86400))
+
+        for start in range(0, args.events, CHUNK):
+            db.execute(insert(WidgetAnalytics), [
+                {
+                    "contractor_id": random.randint(1, args.contractors),
+                    "event_type": random.choice(EVENT_TYPES),
+                    "event_data": {},
+                    "created_at": timestamp()
+                }
+                for _ in range(min(CHUNK, args.events - start))
+            ])
+
+        leads = [
+            {
+                "id": i,
+                "contractor_id": random.randint(1, args.contractors),
+                "name": f"Lead {i}",
+                "email": f"lead{i}@example.com",
+                "address": f"{i} Main St",
+                "status": random.choice(["new", "contacted", "quoted", "converted", "lost"]),
+                "source": random.choice(["widget", "website", "referral"]),
+                "created_at": timestamp()
+            }
+            for i in range(1, args.leads + 1)
+        ]
+        db.execute(insert(Lead), leads)
+        db.execute(insert(Quote), [
+            {
+                "lead_id": lead["id"],
+                "address": lead["address"],
+                "roof_size_sqft": random.randint(1000, 5000),
+                "selected_tier": random.choice(["good", "better", "best"]),
+                "base_price": 20000,
+                "total_price": random.randint(15000, 60000),
+                "created_at": lead["created_at"]
+            }
+            for lead in leads
+        ])
+        db.commit()
+    finally:
+        db.close()
+
+
+def legacy_conversion(db, contractor_id, cutoff):
+    counts = [
+        db.query(func.count(WidgetAnalytics.id)).filter(and_(
+            WidgetAnalytics.contractor_id == contractor_id,
+            WidgetAnalytics.event_type == event_type,
+            WidgetAnalytics.created_at >= cutoff
+        )).scalar()
+        for event_type in ["widget_view", "widget_open", "quote_request"]
+    ]
+    counts.append(db.query(func.count(Lead.id)).filter(and_(
+        Lead.contractor_id == contractor_id, Lead.source == "widget", Lead.created_at >= cutoff
+    )).scalar())
+    counts.append(db.query(func.count(Quote.id)).join(Lead).filter(and_(
+        Lead.contractor_id == contractor_id, Lead.source == "widget", Quote.created_at >= cutoff
+    )).scalar())
+    return counts
+
+
+def legacy_size_distribution(db, contractor_id, cutoff):
+    return [
+        db.query(func.count(Quote.id)).join(Lead).filter(and_(
+            Lead.contractor_id == contractor_id,
+            Quote.created_at >= cutoff,
+            Quote.roof_size_sqft >= low,
+            Quote.roof_size_sqft < high
+        )).scalar()
+        for low, high in [(0, 1500), (1500, 2500), (2500, 3500), (3500, 999999)]
+    ]
+
+
+def rollup_conversion(db, contractor_id, since):
+    return analytics_rollup.funnel_counts(db, contractor_id, since, analytics_rollup.get_compacted_through(db))
+
+
+def rollup_size_distribution(db, contractor_id, since):
+    rows = analytics_rollup.load_rows(
+        db, "quotes", contractor_id, since, analytics_rollup.get_compacted_through(db)
+    )
+    sizes = {}
+    for row in rows:
+        sizes[row.size_bucket] = sizes.get(row.size_bucket, 0) + row.quote_count
+    return sizes
+
+
+def measure(label, fn, *fn_args):
+    statements = []
+
+    def count_statement(*_):
+        statements.append(1)
+
+    db = SessionLocal()
+    event.listen(engine, "before_cursor_execute", count_statement)
+    try:
+        timings = []
+        for _ in range(args.repeat):
+            statements.clear()
+            started = time.perf_counter()
+            fn(db, *fn_args)
+            timings.append((time.perf_counter() - started) * 1000)
+        print(f"{label:<42} {len(statements):>6} {statistics.median(timings):>10.2f} {max(timings):>10.2f}")
+    finally:
+        event.remove(engine, "before_cursor_execute", count_statement)
+        db.close()
+
+
+def main():
+    print(f"Seeding {args.events:,} events and {args.leads:,} leads/quotes into {db_path}")
+    started = time.perf_counter()
+    seed()
+    print(f"Seeded in {time.perf_counter() - started:.1f}s")
+
+    contractor_id = 1
+    cutoff = datetime.utcnow() - timedelta(days=args.window_days)
+    since = analytics_rollup.utc_today() - timedelta(days=args.window_days)
+
+    print(f"\n{'query':<42} {'trips':>6} {'median ms':>10} {'max ms':>10}")
+    measure("conversion: per-metric COUNTs (before)", legacy_conversion, contractor_id, cutoff)
+    measure("conversion: conditional aggregate, raw", rollup_conversion, contractor_id, since)
+    measure("size buckets: COUNT per bucket (before)", legacy_size_distribution, contractor_id, cutoff)
+    measure("size buckets: grouped, raw", rollup_size_distribution, contractor_id, since)
+
+    db = SessionLocal()
+    try:
+        started = time.perf_counter()
+        analytics_rollup.compact(db)
+        print(f"\nCompacted rollups in {time.perf_counter() - started:.1f}s")
+    finally:
+        db.close()
+
+    measure("conversion: conditional aggregate, rollups", rollup_conversion, contractor_id, since)
+    measure("size buckets: grouped, rollups", rollup_size_distribution, contractor_id, since)
+
+
+if __name__ == "__main__":
+    main()
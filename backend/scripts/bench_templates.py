@@ -0,0 +1,155 @@
+"""
+Benchmark rendering quote summary emails for a fan-out to many leads.
+
+Seeds a throwaway SQLite database with one contractor, then renders the
+same email for ``--emails`` recipients four ways: the f-string the email
+service used to build, a full Jinja2 render per email, the contractor's
+compiled page looked up per email (what ``quote_email_html`` does), and
+the compiled page filled directly.
+
+    python scripts/bench_templates.py --emails 5000
+"""
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--emails", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--db", help="SQLite file to use (default: a temporary file)")
+    return parser.parse_args()
+
+
+args = parse_args()
+db_path = args.db or os.path.join(tempfile.mkdtemp(), "bench_templates.db")
+os.environ["DATABASE_URL"] = f"sqlite:///{db_path}"
+
+from database import Base, SessionLocal, engine  # noqa: E402
+from models import Branding, Contractor, Template  # noqa: E402
+from services import email_service, templating  # noqa: E402
+
+CONTRACTOR_ID = 1
+TEMPLATE_NAME = "email/quote_summary.html"
+
+
+def seed():
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    try:
+        if db.get(Contractor, CONTRACTOR_ID) is None:
+            db.add(Contractor(id=CONTRACTOR_ID, company_name="Summit Roofing & Sons", email="office@example.com",
+                              widget_id="bench"))
+            db.add(Template(contractor_id=CONTRACTOR_ID))
+            db.add(Branding(contractor_id=CONTRACTOR_ID, primary_color="#059669"))
+            db.commit()
+    finally:
+        db.close()
+
+
+def recipients():
+    return [
+        {
+            "customer_name": f"Lead {i} <lead{i}@example.com>",
+            "address": f"{i} Main St, Dallas, TX",
+            "roof_size_sqft": 1500 + i % 2000,
+            "selected_tier": ("good", "better", "best")[i % 3],
+            "total_price": 12000 + i
+        }
+        for i in range(args.emails)
+    ]
+
+
+def legacy_quote_email_html(customer_name: str, quote_details: dict, contractor_name: str) -> str:
+    # The f-string body the email service built before templates were compiled (trimmed, unescaped)
+    address = quote_details.get('address', 'Your Property')
+    selected_tier = quote_details.get('selected_tier', 'Better').title()
+    total_price = quote_details.get('total_price', 0)
+    roof_size = quote_details.get('roof_size_sqft', 0)
+    return f"""
+        <html>
+            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
+                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
+                    <h2 style="color: #059669;">Your Personalized Roof Quote</h2>
+                    <p>Dear {customer_name},</p>
+                    <div style="background-color: #f3f4f6; padding: 20px; border-radius: 8px; margin: 20px 0;">
+                        <h3 style="color: #059669; margin-top: 0;">Quote Summary</h3>
+                        <p><strong>Property Address:</strong> {address}</p>
+                        <p><strong>Estimated Roof Size:</strong> {roof_size:,} sq ft</p>
+                        <p><strong>Selected Package:</strong> {selected_tier}</p>
+                        <p style="font-size: 1.2em;"><strong>Total Estimated Price:</strong> <span style="color: #059669;">${total_price:,}</span></p>
+                    </div>
+                    <p>Best regards,<br>
+                    <strong>{contractor_name}</strong></p>
+                </div>
+            </body>
+        </html>
+        """
+
+
+def slot_values(lead: dict) -> dict:
+    return {
+        "customer_name": lead["customer_name"],
+        "address": lead["address"],
+        "roof_size": f"{lead['roof_size_sqft']:,}",
+        "selected_tier": lead["selected_tier"].title(),
+        "total_price": f"{lead['total_price']:,}"
+    }
+
+
+def fstring(db, leads):
+    contractor = db.get(Contractor, CONTRACTOR_ID)
+    return [legacy_quote_email_html(lead["customer_name"], lead, contractor.company_name) for lead in leads]
+
+
+def jinja_per_email(db, leads):
+    context = templating.contractor_context(db, CONTRACTOR_ID)
+    template = templating.environment.get_template(TEMPLATE_NAME)
+    return [template.render(slot=slot_values(lead).__getitem__, **context) for lead in leads]
+
+
+def compiled_lookup_per_email(db, leads):
+    return [email_service.quote_email_html(db, CONTRACTOR_ID, lead["customer_name"], lead) for lead in leads]
+
+
+def compiled_page(db, leads):
+    page = templating.contractor_page(db, TEMPLATE_NAME, CONTRACTOR_ID)
+    return [page.render(**slot_values(lead)) for lead in leads]
+
+
+def measure(label, fn, leads):
+    db = SessionLocal()
+    try:
+        timings = []
+        for _ in range(args.repeat):
+            started = time.perf_counter()
+            output = fn(db, leads)
+            timings.append(time.perf_counter() - started)
+        median = statistics.median(timings)
+        print(f"{label:<44} {median * 1000:>10.1f} {median / len(leads) * 1e6:>10.2f}")
+        return output
+    finally:
+        db.close()
+
+
+def main():
+    seed()
+    leads = recipients()
+    print(f"Rendering {len(leads):,} quote emails for one contractor, median of {args.repeat} runs")
+    print(f"\n{'renderer':<44} {'total ms':>10} {'us/email':>10}")
+    measure("f-string per email (before, unescaped)", fstring, leads)
+    full = measure("jinja2 full render per email", jinja_per_email, leads)
+    measure("compiled page, looked up per email", compiled_lookup_per_email, leads)
+    filled = measure("compiled page, slots filled per email", compiled_page, leads)
+    assert full == filled, "two-stage render differs from a full render"
+    print("\nTwo-stage output matches the full render")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,65 @@
+"""
+Load building footprints for a service area into the footprint store.
+
+Accepts GeoJSON FeatureCollections (Polygon/MultiPolygon features with an
+optional ``address`` or ``addr:housenumber``/``addr:street`` and ``pitch``
+property) and Overpass API JSON responses. Footprints already loaded with
+the same id are replaced; GeoJSON features without an id are keyed by a
+hash of their geometry.
+
+    python scripts/import_footprints.py dallas.geojson
+    python scripts/import_footprints.py --replace-all overpass_export.json
+"""
+import argparse
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sqlalchemy import delete  # noqa: E402
+
+from database import Base, SessionLocal, engine, ensure_schema  # noqa: E402
+from models import BuildingFootprint  # noqa: E402
+from services import building_footprints  # noqa: E402
+from services.roof_measurement import roof_measurement  # noqa: E402
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("paths", nargs="+", help="GeoJSON or Overpass JSON files")
+    parser.add_argument("--replace-all", action="store_true", help="delete every stored footprint first")
+    parser.add_argument("--chunk-size", type=int, default=building_footprints.IMPORT_CHUNK_SIZE)
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+    Base.metadata.create_all(bind=engine)
+    ensure_schema()
+    building_footprints.install(engine)
+
+    db = SessionLocal()
+    try:
+        if args.replace_all:
+            db.execute(delete(BuildingFootprint))
+            db.commit()
+
+        for path in args.paths:
+            started = time.perf_counter()
+            with open(path) as f:
+                data = json.load(f)
+            loaded = building_footprints.bulk_load(db, building_footprints.parse(data), args.chunk_size)
+            print(f"{path}: loaded {loaded:,} footprints in {time.perf_counter() - started:.1f}s")
+
+        # Addresses measured by the heuristic may have a footprint now
+        forgotten = roof_measurement.forget_fallbacks(db)
+        db.commit()
+        print(f"Forgot {forgotten:,} cached heuristic roof measurements")
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    main()
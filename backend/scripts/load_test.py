@@ -0,0 +1,91 @@
+"""
+Concurrent load test against a running API.
+
+Keeps ``--concurrency`` requests in flight for ``--duration`` seconds over a
+mix of dashboard, lead list, quote calculation and widget bootstrap
+requests, then reports throughput and latency percentiles per endpoint.
+Run it against two builds to compare them:
+
+    uvicorn main:app --port 8000 &
+    python scripts/load_test.py --url http://localhost:8000 --concurrency 50 --duration 20
+"""
+import argparse
+import asyncio
+import random
+import statistics
+import time
+from collections import defaultdict
+
+import httpx
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8000")
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--duration", type=float, default=20.0)
+    parser.add_argument("--contractor-id", type=int, default=1)
+    return parser.parse_args()
+
+
+def scenarios(contractor_id: int, widget_id: str):
+    return [
+        ("dashboard", "GET", f"/api/analytics/contractor/{contractor_id}/dashboard", {}),
+        ("conversion", "GET", f"/api/analytics/contractor/{contractor_id}/conversion", {}),
+        ("leads", "GET", f"/api/leads/contractor/{contractor_id}", {"params": {"limit": 20}}),
+        ("pricing", "GET", f"/api/pricing/contractor/{contractor_id}", {}),
+        ("widget_data", "GET", f"/api/widget/data/{widget_id}", {}),
+        ("calculate", "POST", "/api/quotes/calculate", {"params_factory": lambda: {
+            "contractor_id": contractor_id,
+            "address": f"{random.randint(1, 500)} Load Test Ln, Dallas, TX",
+            "selected_tier": "better"
+        }}),
+    ]
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+async def run(args):
+    limits = httpx.Limits(max_connections=args.concurrency, max_keepalive_connections=args.concurrency)
+    async with httpx.AsyncClient(base_url=args.url, limits=limits, timeout=60) as client:
+        contractor = (await client.get(f"/api/contractors/{args.contractor_id}")).json()
+        mix = scenarios(args.contractor_id, contractor["widget_id"])
+
+        latencies = defaultdict(list)
+        errors = defaultdict(int)
+        deadline = time.perf_counter() + args.duration
+
+        async def user():
+            while time.perf_counter() < deadline:
+                name, method, path, options = random.choice(mix)
+                params = options["params_factory"]() if "params_factory" in options else options.get("params")
+                started = time.perf_counter()
+                try:
+                    response = await client.request(method, path, params=params)
+                    ok = response.status_code < 400
+                except httpx.HTTPError:
+                    ok = False
+                latencies[name].append((time.perf_counter() - started) * 1000)
+                if not ok:
+                    errors[name] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(user() for _ in range(args.concurrency)))
+        elapsed = time.perf_counter() - started
+
+    total = sum(len(values) for values in latencies.values())
+    print(f"{total:,} requests in {elapsed:.1f}s with {args.concurrency} concurrent clients: {total / elapsed:.1f} req/s")
+    print(f"\n{'endpoint':<14} {'requests':>9} {'errors':>7} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}")
+    for name in sorted(latencies):
+        values = latencies[name]
+        print(
+            f"{name:<14} {len(values):>9} {errors[name]:>7} {statistics.median(values):>9.1f} "
+            f"{percentile(values, 0.95):>9.1f} {percentile(values, 0.99):>9.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(run(parse_args()))
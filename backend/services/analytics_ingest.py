@@ -0,0 +1,213 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import List, Optional, Set
+
+from sqlalchemy import insert
+
+from config import settings
+from database import SessionLocal
+from models import Contractor, WidgetAnalytics
+
+logger = logging.getLogger(__name__)
+
+
+class IngestQueueFull(Exception):
+    """Raised when the buffer has no room for the submitted events."""
+
+
+class AnalyticsIngestor:
+    """
+    Buffers widget analytics events in memory and writes them in batches.
+
+    Requests only validate and enqueue events; a background task drains the
+    queue and inserts up to ``batch_size`` rows per transaction with a single
+    executemany. The queue is bounded: when it is full, submit() raises
+    IngestQueueFull so the caller can tell the widget to back off.
+
+    A batch that fails to insert (e.g. while the database is locked) is
+    retried up to ``write_attempts`` times with exponential backoff; the
+    queue keeps filling meanwhile. If every attempt fails, the batch is
+    spilled to a JSON file in ``spill_dir`` and replayed after the next
+    successful write, or when the app starts again.
+    """
+
+    def __init__(
+        self,
+        max_queue_size: int,
+        batch_size: int,
+        flush_interval: float,
+        contractor_cache_ttl: float,
+        write_attempts: int,
+        retry_base: float,
+        retry_max: float,
+        spill_dir: str
+    ):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.contractor_cache_ttl = contractor_cache_ttl
+        self.write_attempts = write_attempts
+        self.retry_base = retry_base
+        self.retry_max = retry_max
+        self.spill_dir = spill_dir
+        self.queue: asyncio.Queue = asyncio.Queue(maxsize=max_queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self._inflight: Optional[asyncio.Future] = None
+        self._held: List[dict] = []
+        self._contractor_ids: Set[int] = set()
+        self._contractors_loaded_at = 0.0
+        self._has_spilled = False
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background writer and flush everything still buffered."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self._inflight is not None:
+            await self._inflight
+            self._inflight = None
+
+        remaining, self._held = self._held, []
+        while not self.queue.empty():
+            remaining.append(self.queue.get_nowait())
+        for start in range(0, len(remaining), self.batch_size):
+            # No time for backoff on shutdown; whatever fails is replayed on the next start
+            batch = remaining[start:start + self.batch_size]
+            if await asyncio.to_thread(self._write, batch) is not None:
+                await asyncio.to_thread(self._spill, batch)
+        if remaining:
+            logger.info(f"Flushed {len(remaining)} buffered analytics events on shutdown")
+
+    async def is_known_contractor(self, contractor_id: int) -> bool:
+        now = time.monotonic()
+        expired = now - self._contractors_loaded_at > self.contractor_cache_ttl
+        # Unknown ids trigger a refresh too, but at most once a second
+        if expired or (contractor_id not in self._contractor_ids and now - self._contractors_loaded_at > 1):
+            self._contractor_ids = await asyncio.to_thread(self._load_contractor_ids)
+            self._contractors_loaded_at = now
+        return contractor_id in self._contractor_ids
+
+    async def submit(self, events: List[dict]) -> None:
+        if self.queue.maxsize - self.queue.qsize() < len(events):
+            raise IngestQueueFull()
+        for event in events:
+            self.queue.put_nowait(event)
+
+    async def _run(self) -> None:
+        self._has_spilled = await asyncio.to_thread(self._replay_spilled)
+        while True:
+            batch = [await self.queue.get()]
+            try:
+                # Give a quiet queue time to fill up; a busy one is drained immediately
+                if self.queue.qsize() + 1 < self.batch_size:
+                    await asyncio.sleep(self.flush_interval)
+            except asyncio.CancelledError:
+                self._held = batch
+                raise
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self.queue.get_nowait())
+                except asyncio.QueueEmpty:
+                    break
+
+            self._inflight = asyncio.ensure_future(self._write_with_retry(batch))
+            await asyncio.shield(self._inflight)
+            self._inflight = None
+
+    async def _write_with_retry(self, batch: List[dict]) -> None:
+        delay = self.retry_base
+        for attempt in range(1, self.write_attempts + 1):
+            error = await asyncio.to_thread(self._write, batch)
+            if error is None:
+                if self._has_spilled:
+                    self._has_spilled = await asyncio.to_thread(self._replay_spilled)
+                return
+            if attempt < self.write_attempts:
+                logger.warning(
+                    f"Writing {len(batch)} analytics events failed (attempt {attempt}), "
+                    f"retrying in {delay:.1f}s: {error}"
+                )
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, self.retry_max)
+        await asyncio.to_thread(self._spill, batch)
+        self._has_spilled = True
+
+    def _spill(self, batch: List[dict]) -> None:
+        os.makedirs(self.spill_dir, exist_ok=True)
+        path = os.path.join(self.spill_dir, f"{time.time_ns()}-{uuid.uuid4().hex[:8]}.json")
+        rows = [{**row, "created_at": row["created_at"].isoformat()} for row in batch]
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(rows, f)
+        os.replace(tmp_path, path)
+        logger.error(f"Spilled {len(batch)} analytics events to {path}; they are replayed once writes succeed")
+
+    def _replay_spilled(self) -> bool:
+        """Insert spilled batches, oldest first; returns True if any are left."""
+        try:
+            names = sorted(name for name in os.listdir(self.spill_dir) if name.endswith(".json"))
+        except FileNotFoundError:
+            return False
+        for name in names:
+            path = os.path.join(self.spill_dir, name)
+            # Claimed by renaming, so two workers sharing the directory never insert the same file
+            claimed = f"{path}.{uuid.uuid4().hex[:8]}.replaying"
+            try:
+                os.rename(path, claimed)
+            except FileNotFoundError:
+                continue
+            with open(claimed) as f:
+                batch = [{**row, "created_at": datetime.fromisoformat(row["created_at"])} for row in json.load(f)]
+            if self._write(batch) is not None:
+                os.rename(claimed, path)
+                return True
+            os.remove(claimed)
+            logger.info(f"Replayed {len(batch)} spilled analytics events from {name}")
+        return False
+
+    @staticmethod
+    def _load_contractor_ids() -> Set[int]:
+        db = SessionLocal()
+        try:
+            return {contractor_id for (contractor_id,) in db.query(Contractor.id)}
+        finally:
+            db.close()
+
+    @staticmethod
+    def _write(batch: List[dict]) -> Optional[Exception]:
+        """Insert ``batch`` in one transaction; returns the error instead of raising it."""
+        db = SessionLocal()
+        try:
+            db.execute(insert(WidgetAnalytics), batch)
+            db.commit()
+            return None
+        except Exception as e:
+            db.rollback()
+            return e
+        finally:
+            db.close()
+
+
+analytics_ingestor = AnalyticsIngestor(
+    max_queue_size=settings.ANALYTICS_QUEUE_SIZE,
+    batch_size=settings.ANALYTICS_BATCH_SIZE,
+    flush_interval=settings.ANALYTICS_FLUSH_INTERVAL,
+    contractor_cache_ttl=settings.ANALYTICS_CONTRACTOR_CACHE_TTL,
+    write_attempts=settings.ANALYTICS_WRITE_ATTEMPTS,
+    retry_base=settings.ANALYTICS_RETRY_BASE,
+    retry_max=settings.ANALYTICS_RETRY_MAX,
+    spill_dir=settings.ANALYTICS_SPILL_DIR
+)
@@ -0,0 +1,459 @@
+"""
+Per-contractor, per-day analytics rollups.
+
+Closed days are summarized into the ``daily_*_rollups`` tables by a
+periodic compaction job; the dashboard endpoints read those rollups and
+aggregate only the raw rows that are newer than the last compacted day.
+A dashboard request therefore costs O(days) instead of O(rows).
+
+Edits to leads and quotes on already compacted days (status changes, new
+quotes on old leads, deletes) are recorded in ``rollup_dirty_days`` by a
+flush listener and rebuilt on the next compaction run.
+
+Every API worker runs the compactor, so a run first takes a lease on the
+``rollup_state`` row (``locked_until``), like the webhook and email
+outboxes lease deliveries. Workers that find it held skip that run; a
+lease left by a crashed worker runs out after
+``ANALYTICS_ROLLUP_LEASE_SECONDS``.
+"""
+import asyncio
+import logging
+import uuid
+from collections import namedtuple
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Dict, Iterable, Optional
+
+from sqlalchemy import Select, case, delete, event, func, insert, literal, or_, select, union_all, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from sqlalchemy.orm.attributes import get_history
+
+from config import settings
+from database import SessionLocal
+from models import (
+    DailyEventRollup, DailyLeadRollup, DailyQuoteRollup, Lead, Quote, RollupDirtyDay, RollupState,
+    WidgetAnalytics, utcnow
+)
+
+logger = logging.getLogger(__name__)
+
+UNKNOWN = "unknown"
+
+SIZE_BUCKETS = [
+    ("small", 1500, "Small (< 1500 sqft)"),
+    ("medium", 2500, "Medium (1500-2500 sqft)"),
+    ("large", 3500, "Large (2500-3500 sqft)"),
+    ("extra_large", None, "Extra Large (> 3500 sqft)")
+]
+
+EventRow = namedtuple("EventRow", "contractor_id day event_type event_count")
+LeadRow = namedtuple("LeadRow", "contractor_id day status source lead_count quote_count quote_value")
+QuoteRow = namedtuple("QuoteRow", "contractor_id day tier size_bucket lead_source quote_count total_value")
+
+ROLLUP_MODELS = {
+    "events": (DailyEventRollup, EventRow),
+    "leads": (DailyLeadRollup, LeadRow),
+    "quotes": (DailyQuoteRollup, QuoteRow)
+}
+
+
+def utc_today() -> date:
+    return datetime.now(timezone.utc).date()
+
+
+def as_day(value) -> Optional[date]:
+    if value is None:
+        return None
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc)
+        return value.date()
+    if isinstance(value, date):
+        return value
+    return date.fromisoformat(str(value)[:10])
+
+
+def day_start(day: date) -> datetime:
+    return datetime.combine(day, time.min)
+
+
+def size_bucket_expression():
+    whens = [(Quote.roof_size_sqft < upper, key) for key, upper, _ in SIZE_BUCKETS if upper is not None]
+    return case(*whens, else_=SIZE_BUCKETS[-1][0])
+
+
+def _merge(rows: Iterable[tuple], row_type, dims: int) -> list:
+    """Sum measures of rows that share the same key (NULL and 'unknown' dimensions collapse)."""
+    merged: Dict[tuple, list] = {}
+    for row in rows:
+        key = (row[0], as_day(row[1])) + tuple(value or UNKNOWN for value in row[2:2 + dims])
+        measures = [value or 0 for value in row[2 + dims:]]
+        if key in merged:
+            merged[key] = [a + b for a, b in zip(merged[key], measures)]
+        else:
+            merged[key] = measures
+    return [row_type(*key, *measures) for key, measures in merged.items()]
+
+
+def events_select(start: datetime, end: Optional[datetime] = None, contractor_id: Optional[int] = None) -> Select:
+    day = func.date(WidgetAnalytics.created_at)
+    stmt = select(
+        WidgetAnalytics.contractor_id, day, WidgetAnalytics.event_type, func.count(WidgetAnalytics.id)
+    ).where(WidgetAnalytics.created_at >= start)
+    if end is not None:
+        stmt = stmt.where(WidgetAnalytics.created_at < end)
+    if contractor_id is not None:
+        stmt = stmt.where(WidgetAnalytics.contractor_id == contractor_id)
+    return stmt.group_by(WidgetAnalytics.contractor_id, day, WidgetAnalytics.event_type)
+
+
+def leads_select(start: datetime, end: Optional[datetime] = None, contractor_id: Optional[int] = None) -> Select:
+    day = func.date(Lead.created_at)
+    stmt = select(
+        Lead.contractor_id, day, Lead.status, Lead.source,
+        func.count(func.distinct(Lead.id)), func.count(Quote.id), func.sum(Quote.total_price)
+    ).outerjoin(Quote, Quote.lead_id == Lead.id).where(Lead.created_at >= start)
+    if end is not None:
+        stmt = stmt.where(Lead.created_at < end)
+    if contractor_id is not None:
+        stmt = stmt.where(Lead.contractor_id == contractor_id)
+    return stmt.group_by(Lead.contractor_id, day, Lead.status, Lead.source)
+
+
+def quotes_select(start: datetime, end: Optional[datetime] = None, contractor_id: Optional[int] = None) -> Select:
+    day = func.date(Quote.created_at)
+    bucket = size_bucket_expression()
+    stmt = select(
+        Lead.contractor_id, day, Quote.selected_tier, bucket, Lead.source,
+        func.count(Quote.id), func.sum(Quote.total_price)
+    ).join(Lead, Quote.lead_id == Lead.id).where(Quote.created_at >= start)
+    if end is not None:
+        stmt = stmt.where(Quote.created_at < end)
+    if contractor_id is not None:
+        stmt = stmt.where(Lead.contractor_id == contractor_id)
+    return stmt.group_by(Lead.contractor_id, day, Quote.selected_tier, bucket, Lead.source)
+
+
+RAW_SELECTS = {
+    "events": events_select,
+    "leads": leads_select,
+    "quotes": quotes_select
+}
+
+DIMENSIONS = {
+    "events": 1,
+    "leads": 2,
+    "quotes": 3
+}
+
+
+def aggregate(db: Session, kind: str, start: datetime, end: Optional[datetime] = None,
+              contractor_id: Optional[int] = None) -> list:
+    """Aggregate raw rows of ``kind`` ('events', 'leads' or 'quotes') per contractor and day."""
+    rows = db.execute(RAW_SELECTS[kind](start, end, contractor_id)).all()
+    return _merge(rows, ROLLUP_MODELS[kind][1], DIMENSIONS[kind])
+
+
+def _rebuild(db: Session, first_day: date, end_day: date, contractor_id: Optional[int] = None) -> None:
+    """Replace the rollups of days in [first_day, end_day) with fresh aggregates of the raw rows."""
+    for kind, (model, _) in ROLLUP_MODELS.items():
+        stmt = delete(model).where(model.day >= first_day, model.day < end_day)
+        if contractor_id is not None:
+            stmt = stmt.where(model.contractor_id == contractor_id)
+        db.execute(stmt)
+
+        rows = aggregate(db, kind, day_start(first_day), day_start(end_day), contractor_id)
+        if rows:
+            db.execute(insert(model), [row._asdict() for row in rows])
+
+
+def _earliest_day(db: Session) -> Optional[date]:
+    candidates = [
+        db.query(func.min(WidgetAnalytics.created_at)).scalar(),
+        db.query(func.min(Lead.created_at)).scalar(),
+        db.query(func.min(Quote.created_at)).scalar()
+    ]
+    days = [as_day(value) for value in candidates if value is not None]
+    return min(days) if days else None
+
+
+def compact(db: Session, now: Optional[datetime] = None) -> dict:
+    """
+    Roll up every closed day that has not been compacted yet, plus dirty days.
+
+    A day is closed once ``ANALYTICS_ROLLUP_GRACE_SECONDS`` have passed since
+    midnight UTC, which leaves buffered analytics events time to land.
+    """
+    now = now or datetime.now(timezone.utc)
+    closed_before = (now - timedelta(seconds=settings.ANALYTICS_ROLLUP_GRACE_SECONDS)).date()
+
+    state = db.get(RollupState, 1)
+    if state is None:
+        state = RollupState(id=1)
+        db.add(state)
+
+    if state.compacted_through is not None:
+        start_day = state.compacted_through + timedelta(days=1)
+    else:
+        start_day = _earliest_day(db) or closed_before
+
+    compacted_days = 0
+    if start_day < closed_before:
+        _rebuild(db, start_day, closed_before)
+        compacted_days = (closed_before - start_day).days
+
+    dirty_days = db.query(RollupDirtyDay).filter(RollupDirtyDay.day < closed_before).all()
+    for dirty in dirty_days:
+        # Days at or after start_day were rebuilt for every contractor above
+        if dirty.day < start_day:
+            _rebuild(db, dirty.day, dirty.day + timedelta(days=1), dirty.contractor_id)
+        db.delete(dirty)
+
+    if state.compacted_through is None or state.compacted_through < closed_before - timedelta(days=1):
+        state.compacted_through = closed_before - timedelta(days=1)
+    db.commit()
+
+    return {
+        "compacted_through": state.compacted_through.isoformat(),
+        "compacted_days": compacted_days,
+        "dirty_days_rebuilt": len(dirty_days)
+    }
+
+
+def get_compacted_through(db: Session) -> Optional[date]:
+    return as_day(db.query(RollupState.compacted_through).filter(RollupState.id == 1).scalar())
+
+
+def _split(since: date, compacted_through: Optional[date]):
+    """Return the last rollup day to read (None for no rollups) and where raw aggregation starts."""
+    if compacted_through is not None and compacted_through >= since:
+        return compacted_through, compacted_through + timedelta(days=1)
+    return None, since
+
+
+def load_rows(db: Session, kind: str, contractor_id: int, since: date,
+              compacted_through: Optional[date] = None) -> list:
+    """
+    Rows of ``kind`` ('events', 'leads' or 'quotes') for a contractor from ``since`` until now.
+
+    Compacted days come from the rollup table and anything newer is
+    aggregated from the raw rows, in a single UNION ALL round trip. Pass
+    ``compacted_through`` from get_compacted_through() when loading several
+    kinds in one request.
+    """
+    model, row_type = ROLLUP_MODELS[kind]
+    rollup_through, live_from = _split(since, compacted_through)
+
+    stmt = RAW_SELECTS[kind](day_start(live_from), None, contractor_id)
+    if rollup_through is not None:
+        stmt = union_all(
+            select(*[getattr(model, field) for field in row_type._fields]).where(
+                model.contractor_id == contractor_id,
+                model.day >= since,
+                model.day <= rollup_through
+            ),
+            stmt
+        )
+    return _merge(db.execute(stmt).all(), row_type, DIMENSIONS[kind])
+
+
+FUNNEL_EVENTS = ["widget_view", "widget_open", "quote_request"]
+
+
+def funnel_counts(db: Session, contractor_id: int, since: date, compacted_through: Optional[date],
+                  source: str = "widget") -> dict:
+    """
+    Conversion funnel totals in one statement.
+
+    Rollup rows and counts of the raw rows newer than the last compacted day
+    are normalized to (metric, n) pairs and summed with conditional
+    aggregates; the raw event count is served by the
+    (contractor_id, event_type, created_at) index.
+    """
+    rollup_through, live_from = _split(since, compacted_through)
+    live_start = day_start(live_from)
+
+    parts = [
+        select(WidgetAnalytics.event_type.label("metric"), func.count().label("n")).where(
+            WidgetAnalytics.contractor_id == contractor_id,
+            WidgetAnalytics.event_type.in_(FUNNEL_EVENTS),
+            WidgetAnalytics.created_at >= live_start
+        ).group_by(WidgetAnalytics.event_type),
+        select(literal("lead"), func.count()).select_from(Lead).where(
+            Lead.contractor_id == contractor_id,
+            Lead.source == source,
+            Lead.created_at >= live_start
+        ),
+        select(literal("quote"), func.count()).select_from(Quote).join(Lead, Quote.lead_id == Lead.id).where(
+            Lead.contractor_id == contractor_id,
+            Lead.source == source,
+            Quote.created_at >= live_start
+        )
+    ]
+    if rollup_through is not None:
+        parts += [
+            select(DailyEventRollup.event_type, DailyEventRollup.event_count).where(
+                DailyEventRollup.contractor_id == contractor_id,
+                DailyEventRollup.event_type.in_(FUNNEL_EVENTS),
+                DailyEventRollup.day.between(since, rollup_through)
+            ),
+            select(literal("lead"), DailyLeadRollup.lead_count).where(
+                DailyLeadRollup.contractor_id == contractor_id,
+                DailyLeadRollup.source == source,
+                DailyLeadRollup.day.between(since, rollup_through)
+            ),
+            select(literal("quote"), DailyQuoteRollup.quote_count).where(
+                DailyQuoteRollup.contractor_id == contractor_id,
+                DailyQuoteRollup.lead_source == source,
+                DailyQuoteRollup.day.between(since, rollup_through)
+            )
+        ]
+
+    metrics = union_all(*parts).subquery()
+    metric_names = FUNNEL_EVENTS + ["lead", "quote"]
+    row = db.execute(select(*[
+        func.coalesce(func.sum(case((metrics.c.metric == name, metrics.c.n), else_=0)), 0).label(name)
+        for name in metric_names
+    ])).one()
+    return dict(zip(metric_names, row))
+
+
+def mark_dirty(db: Session, contractor_id: Optional[int], day) -> None:
+    """Schedule a closed day for re-aggregation; open days are read raw anyway."""
+    day = as_day(day)
+    if contractor_id is None or day is None or day >= utc_today():
+        return
+    for pending in db.new:
+        if isinstance(pending, RollupDirtyDay) and pending.contractor_id == contractor_id and pending.day == day:
+            return
+    with db.no_autoflush:
+        exists = db.query(RollupDirtyDay.id).filter(
+            RollupDirtyDay.contractor_id == contractor_id,
+            RollupDirtyDay.day == day
+        ).first()
+    if not exists:
+        db.add(RollupDirtyDay(contractor_id=contractor_id, day=day))
+
+
+def _history_days(obj, attribute: str) -> list:
+    history = get_history(obj, attribute)
+    return [value for value in list(history.added or []) + list(history.deleted or []) if value is not None]
+
+
+def _lead_for(db: Session, quote: Quote) -> Optional[Lead]:
+    if quote.lead is not None:
+        return quote.lead
+    with db.no_autoflush:
+        return db.get(Lead, quote.lead_id) if quote.lead_id else None
+
+
+LEAD_ROLLUP_FIELDS = ("status", "source", "created_at", "contractor_id")
+QUOTE_ROLLUP_FIELDS = ("total_price", "selected_tier", "roof_size_sqft", "created_at", "lead_id")
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def _track_dirty_days(db: Session, flush_context, instances) -> None:
+    for obj in list(db.new) + list(db.dirty) + list(db.deleted):
+        is_new = obj in db.new
+        is_deleted = obj in db.deleted
+
+        if isinstance(obj, Lead):
+            if is_new or is_deleted or any(get_history(obj, f).has_changes() for f in LEAD_ROLLUP_FIELDS):
+                for day in [obj.created_at] + _history_days(obj, "created_at"):
+                    mark_dirty(db, obj.contractor_id, day)
+            if is_deleted and obj.id is not None:
+                with db.no_autoflush:
+                    quote_days = db.query(Quote.created_at).filter(Quote.lead_id == obj.id).all()
+                for (quote_day,) in quote_days:
+                    mark_dirty(db, obj.contractor_id, quote_day)
+
+        elif isinstance(obj, Quote):
+            if is_new or is_deleted or any(get_history(obj, f).has_changes() for f in QUOTE_ROLLUP_FIELDS):
+                lead = _lead_for(db, obj)
+                if lead is not None:
+                    mark_dirty(db, lead.contractor_id, obj.created_at)
+                    mark_dirty(db, lead.contractor_id, lead.created_at)
+
+
+def claim_lease(db: Session, token: str) -> bool:
+    """Lease compaction to ``token``; False while another worker holds an unexpired lease."""
+    if db.get(RollupState, 1) is None:
+        try:
+            db.add(RollupState(id=1))
+            db.commit()
+        except IntegrityError:
+            # Created by another worker meanwhile
+            db.rollback()
+    now = utcnow()
+    result = db.execute(
+        update(RollupState)
+        .where(
+            RollupState.id == 1,
+            or_(RollupState.locked_until.is_(None), RollupState.locked_until < now)
+        )
+        .values(locked_until=now + timedelta(seconds=settings.ANALYTICS_ROLLUP_LEASE_SECONDS), claim_token=token)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def release_lease(db: Session, token: str) -> None:
+    db.execute(
+        update(RollupState)
+        .where(RollupState.id == 1, RollupState.claim_token == token)
+        .values(locked_until=None, claim_token=None)
+    )
+    db.commit()
+
+
+def compact_leased(db: Session) -> Optional[dict]:
+    """compact() under the lease; returns None without compacting while another worker holds it."""
+    token = uuid.uuid4().hex
+    if not claim_lease(db, token):
+        return None
+    try:
+        return compact(db)
+    finally:
+        db.rollback()
+        release_lease(db, token)
+
+
+def run_compaction() -> Optional[dict]:
+    db = SessionLocal()
+    try:
+        return compact_leased(db)
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Analytics rollup compaction failed: {e}", exc_info=True)
+        return None
+    finally:
+        db.close()
+
+
+class RollupCompactor:
+    """Runs the compaction job on an interval for the lifetime of the app."""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.interval_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.to_thread(run_compaction)
+            await asyncio.sleep(self.interval_seconds)
+
+
+rollup_compactor = RollupCompactor(interval_seconds=settings.ANALYTICS_ROLLUP_INTERVAL)
@@ -0,0 +1,277 @@
+"""
+Server-side building footprint store.
+
+Footprints for a service area are bulk-loaded from GeoJSON or an Overpass
+(OSM JSON) extract with ``scripts/import_footprints.py``. Area, pitch
+adjusted roof area and bounding box are computed once at import time.
+
+On SQLite an R*Tree virtual table (``building_footprints_rtree``) is kept
+in sync with ``building_footprints`` through triggers, so a nearest
+building lookup is an index probe plus an exact distance check over the
+handful of candidates in the search box. Other dialects filter on the
+indexed bounding box columns instead.
+
+OSM footprints carry only "housenumber street", while quote addresses
+usually go on with the city, state and ZIP, so an address lookup matches
+the longest stored address the quote address starts with.
+"""
+import hashlib
+import json
+import logging
+from dataclasses import dataclass
+from typing import Dict, Iterable, Iterator, List, Optional
+
+from sqlalchemy import column, delete, insert, select, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+from models import BuildingFootprint, utcnow
+from services.geo import (
+    SQM_TO_SQFT, Point, centroid, degrees_around, distance_to_ring_m, normalize_address, normalize_pitch,
+    outer_rings, pitch_factor, polygon_area_sqm
+)
+
+logger = logging.getLogger(__name__)
+
+IMPORT_CHUNK_SIZE = 1000
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS building_footprints_rtree USING rtree(id, min_lat, max_lat, min_lng, max_lng)",
+    """CREATE TRIGGER IF NOT EXISTS building_footprints_rtree_insert AFTER INSERT ON building_footprints BEGIN
+        INSERT INTO building_footprints_rtree VALUES (new.id, new.min_lat, new.max_lat, new.min_lng, new.max_lng);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS building_footprints_rtree_delete AFTER DELETE ON building_footprints BEGIN
+        DELETE FROM building_footprints_rtree WHERE id = old.id;
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS building_footprints_rtree_update
+    AFTER UPDATE OF min_lat, max_lat, min_lng, max_lng ON building_footprints BEGIN
+        UPDATE building_footprints_rtree
+        SET min_lat = new.min_lat, max_lat = new.max_lat, min_lng = new.min_lng, max_lng = new.max_lng
+        WHERE id = new.id;
+    END""",
+]
+
+SQLITE_REBUILD = [
+    "DELETE FROM building_footprints_rtree",
+    "INSERT INTO building_footprints_rtree SELECT id, min_lat, max_lat, min_lng, max_lng FROM building_footprints",
+]
+
+rtree = table(
+    "building_footprints_rtree",
+    column("id"), column("min_lat"), column("max_lat"), column("min_lng"), column("max_lng")
+)
+
+CANDIDATE_COLUMNS = [
+    BuildingFootprint.id,
+    BuildingFootprint.source_id,
+    BuildingFootprint.address,
+    BuildingFootprint.pitch,
+    BuildingFootprint.centroid_lat,
+    BuildingFootprint.centroid_lng,
+    BuildingFootprint.area_sqft,
+    BuildingFootprint.roof_area_sqft,
+    BuildingFootprint.vertices,
+    BuildingFootprint.rings
+]
+
+
+@dataclass
+class FootprintMatch:
+    id: int
+    source_id: str
+    address: Optional[str]
+    pitch: str
+    centroid_lat: float
+    centroid_lng: float
+    area_sqft: float
+    roof_area_sqft: float
+    vertices: int
+    rings: List[List[Point]]
+    distance_m: float = 0.0
+
+    def as_dict(self) -> dict:
+        """Same fields as the frontend's BuildingFootprint, plus the roof measurements."""
+        return {
+            "id": self.source_id,
+            "polygon": [{"lat": lat, "lng": lng} for lng, lat in self.rings[0]],
+            "area_sqm": round(self.area_sqft / SQM_TO_SQFT, 2),
+            "area_sqft": self.area_sqft,
+            "roof_area_sqft": self.roof_area_sqft,
+            "pitch": self.pitch,
+            "address": self.address,
+            "centroid": {"lat": self.centroid_lat, "lng": self.centroid_lng},
+            "distance_m": round(self.distance_m, 2)
+        }
+
+
+def install(engine: Engine) -> None:
+    """Create the spatial index for SQLite and backfill it if needed."""
+    if engine.dialect.name != "sqlite":
+        return
+    with engine.begin() as conn:
+        for statement in SQLITE_DDL:
+            conn.execute(text(statement))
+        indexed = conn.execute(text("SELECT count(*) FROM building_footprints_rtree")).scalar()
+        total = conn.execute(text("SELECT count(*) FROM building_footprints")).scalar()
+        if indexed != total:
+            logger.info(f"Rebuilding building footprint index ({indexed} of {total} footprints indexed)")
+            for statement in SQLITE_REBUILD:
+                conn.execute(text(statement))
+
+
+def footprint_row(source_id: str, rings: List[List[Point]], properties: Dict) -> dict:
+    """Precompute everything a lookup needs for one building."""
+    address = properties.get("address") or " ".join(
+        str(properties[key]) for key in ("addr:housenumber", "addr:street") if properties.get(key)
+    ) or None
+    pitch = normalize_pitch(properties.get("pitch") or properties.get("roof:pitch"))
+    area_sqft = sum(polygon_area_sqm(ring) for ring in rings) * SQM_TO_SQFT
+    points = [point for ring in rings for point in ring]
+    center_lng, center_lat = centroid(points)
+    return {
+        "source_id": str(source_id),
+        "address": address,
+        "normalized_address": normalize_address(address) if address else None,
+        "pitch": pitch,
+        "min_lat": min(lat for _, lat in points),
+        "max_lat": max(lat for _, lat in points),
+        "min_lng": min(lng for lng, _ in points),
+        "max_lng": max(lng for lng, _ in points),
+        "centroid_lat": center_lat,
+        "centroid_lng": center_lng,
+        "area_sqft": round(area_sqft, 2),
+        "roof_area_sqft": round(area_sqft * pitch_factor(pitch), 2),
+        "vertices": len(points),
+        "rings": [[list(point) for point in ring] for ring in rings],
+        "created_at": utcnow()
+    }
+
+
+def geometry_id(rings: List[List[Point]]) -> str:
+    """Stable id for a feature without one, so features from different files never collide."""
+    digest = hashlib.sha1(json.dumps(rings, separators=(",", ":")).encode()).hexdigest()
+    return f"geometry/{digest[:20]}"
+
+
+def parse_geojson(collection: dict) -> Iterator[dict]:
+    for feature in collection.get("features", []):
+        rings = outer_rings(feature.get("geometry"))
+        if rings:
+            source_id = feature.get("id") or (feature.get("properties") or {}).get("id") or geometry_id(rings)
+            yield footprint_row(source_id, rings, feature.get("properties") or {})
+
+
+def parse_overpass(data: dict) -> Iterator[dict]:
+    """Buildings mapped as closed ways in an Overpass ``out body; >; out skel qt;`` response."""
+    nodes = {
+        element["id"]: (element["lon"], element["lat"])
+        for element in data.get("elements", []) if element.get("type") == "node"
+    }
+    for element in data.get("elements", []):
+        tags = element.get("tags") or {}
+        if element.get("type") != "way" or not tags.get("building"):
+            continue
+        ring = [nodes[node_id] for node_id in element.get("nodes", []) if node_id in nodes]
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        if len(ring) >= 3:
+            yield footprint_row(f"way/{element['id']}", [ring], tags)
+
+
+def parse(data: dict) -> Iterator[dict]:
+    return parse_overpass(data) if "elements" in data else parse_geojson(data)
+
+
+def bulk_load(db: Session, rows: Iterable[dict], chunk_size: int = IMPORT_CHUNK_SIZE) -> int:
+    """Insert footprints in chunks, replacing any already loaded with the same source_id."""
+    loaded = 0
+    chunk: List[dict] = []
+
+    def flush():
+        source_ids = [row["source_id"] for row in chunk]
+        db.execute(delete(BuildingFootprint).where(BuildingFootprint.source_id.in_(source_ids)))
+        db.execute(insert(BuildingFootprint), chunk)
+        db.commit()
+
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            flush()
+            loaded += len(chunk)
+            chunk = []
+    if chunk:
+        flush()
+        loaded += len(chunk)
+    return loaded
+
+
+def _match(row, distance_m: float = 0.0) -> FootprintMatch:
+    rings = [[tuple(point) for point in ring] for ring in row.rings]
+    return FootprintMatch(
+        id=row.id,
+        source_id=row.source_id,
+        address=row.address,
+        pitch=row.pitch,
+        centroid_lat=row.centroid_lat,
+        centroid_lng=row.centroid_lng,
+        area_sqft=row.area_sqft,
+        roof_area_sqft=row.roof_area_sqft,
+        vertices=row.vertices,
+        rings=rings,
+        distance_m=distance_m
+    )
+
+
+def nearest(db: Session, lat: float, lng: float, radius_m: float) -> Optional[FootprintMatch]:
+    """The building containing, or closest to, the point within ``radius_m`` meters."""
+    dlat, dlng = degrees_around(lat, radius_m)
+    if db.get_bind().dialect.name == "sqlite":
+        box = rtree.c
+        query = select(*CANDIDATE_COLUMNS).join(rtree, box.id == BuildingFootprint.id)
+    else:
+        box = BuildingFootprint
+        query = select(*CANDIDATE_COLUMNS)
+    query = query.where(
+        box.min_lat <= lat + dlat,
+        box.max_lat >= lat - dlat,
+        box.min_lng <= lng + dlng,
+        box.max_lng >= lng - dlng
+    )
+
+    best = None
+    for row in db.execute(query):
+        rings = [[tuple(point) for point in ring] for ring in row.rings]
+        distance = min(distance_to_ring_m(ring, (lng, lat)) for ring in rings)
+        if distance <= radius_m and (best is None or distance < best[1]):
+            best = (row, distance)
+    return _match(*best) if best else None
+
+
+def address_prefixes(normalized_address: str) -> List[str]:
+    """
+    Leading parts of an address that can identify a building, longest first.
+
+    "123 main st dallas tx 75201" gives "123 main st dallas tx 75201", ...,
+    "123 main st", "123 main": a house number and at least one street word.
+    """
+    words = normalized_address.split()
+    if len(words) < 2 or not words[0][0].isdigit():
+        return []
+    return [" ".join(words[:end]) for end in range(len(words), 1, -1)]
+
+
+def find_by_address(db: Session, normalized_address: str) -> Optional[FootprintMatch]:
+    """The building whose stored address is the longest prefix of ``normalized_address``."""
+    prefixes = address_prefixes(normalized_address)
+    if not prefixes:
+        return None
+    rank = {prefix: position for position, prefix in enumerate(prefixes)}
+    rows = db.execute(
+        select(*CANDIDATE_COLUMNS, BuildingFootprint.normalized_address)
+        .where(BuildingFootprint.normalized_address.in_(prefixes))
+    ).all()
+    if not rows:
+        return None
+    # Garages and sheds can share the house's address; the house has the largest roof
+    row = min(rows, key=lambda row: (rank[row.normalized_address], -row.roof_area_sqft))
+    return _match(row)
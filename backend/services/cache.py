@@ -0,0 +1,334 @@
+"""
+Cache shared by every API worker.
+
+Two backends store the entries:
+
+- ``memory``: an LRU with per-entry TTLs inside this process. This is the
+  default, and it is enough for a single worker.
+- ``redis``: any Redis-protocol server (Redis, Valkey, KeyDB, or fakeredis
+  in tests). All workers behind the load balancer share it.
+
+Keys are namespaced per contractor and include the contractor's cache
+version::
+
+    {prefix}:c{contractor_id}:v{version}:{namespace}:{key}
+
+When a Contractor, Pricing, Branding, Template or WidgetSettings row
+changes, the contractor's version is bumped once the transaction commits.
+Every worker then stops reading the old entries at the same moment, with
+no need to find and delete them; they simply expire.
+
+Hot keys are loaded single-flight. Concurrent misses in one process wait
+for a single loader. On a shared backend, a short lock key (SET NX) lets
+one worker rebuild an entry while the others poll for its result.
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Callable, Dict, Optional, Set
+
+from sqlalchemy import event
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import Branding, Contractor, Pricing, Template, WidgetSettings
+
+logger = logging.getLogger(__name__)
+
+VERSIONED_MODELS = (Contractor, Pricing, Branding, Template, WidgetSettings)
+
+
+class MemoryBackend:
+    """LRU + TTL store for a single process."""
+
+    local = True
+    errors = ()
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+        # Versions live outside the LRU: evicting one would reset it and resurrect old entries
+        self._counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[bytes]:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is None:
+                return None
+            value, expires_at = item
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        with self._lock:
+            self._entries[key] = (value, time.monotonic() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] > time.monotonic():
+                return False
+            self._entries[key] = (value, time.monotonic() + ttl)
+            return True
+
+    def delete(self, key: str) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def get_counter(self, key: str) -> Optional[int]:
+        return self._counters.get(key)
+
+    def init_counter(self, key: str, value: int) -> None:
+        with self._lock:
+            self._counters.setdefault(key, value)
+
+    def incr(self, key: str) -> int:
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + 1
+            return self._counters[key]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._counters.clear()
+
+
+class RedisBackend:
+    """Store on a Redis-protocol server; ``client`` may be any redis-py compatible client."""
+
+    local = False
+
+    def __init__(self, url: Optional[str] = None, client=None):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("CACHE_BACKEND=redis requires the redis package (pip install redis)")
+        self.errors = (redis.RedisError,)
+        self.client = client if client is not None else redis.Redis.from_url(
+            url,
+            socket_timeout=settings.CACHE_SOCKET_TIMEOUT,
+            socket_connect_timeout=settings.CACHE_SOCKET_TIMEOUT
+        )
+
+    def get(self, key: str) -> Optional[bytes]:
+        return self.client.get(key)
+
+    def set(self, key: str, value: bytes, ttl: float) -> None:
+        self.client.set(key, value, px=max(1, int(ttl * 1000)))
+
+    def add(self, key: str, value: bytes, ttl: float) -> bool:
+        return bool(self.client.set(key, value, px=max(1, int(ttl * 1000)), nx=True))
+
+    def delete(self, key: str) -> None:
+        self.client.delete(key)
+
+    def get_counter(self, key: str) -> Optional[int]:
+        value = self.client.get(key)
+        return int(value) if value is not None else None
+
+    def init_counter(self, key: str, value: int) -> None:
+        self.client.set(key, value, nx=True)
+
+    def incr(self, key: str) -> int:
+        return self.client.incr(key)
+
+    def clear(self) -> None:
+        self.client.flushdb()
+
+
+@dataclass
+class _Flight:
+    done: threading.Event = field(default_factory=threading.Event)
+    value: Optional[bytes] = None
+    failed: bool = False
+
+
+class SharedCache:
+    def __init__(self, backend, prefix: str, default_ttl: float, lock_ttl: float):
+        self.backend = backend
+        self.prefix = prefix
+        self.default_ttl = default_ttl
+        self.lock_ttl = lock_ttl
+        self._flights: Dict[str, _Flight] = {}
+        self._lock = threading.Lock()
+
+    def _version_key(self, contractor_id: int) -> str:
+        return f"{self.prefix}:c{contractor_id}:version"
+
+    def version(self, contractor_id: int) -> int:
+        key = self._version_key(contractor_id)
+        version = self.backend.get_counter(key)
+        if version is None:
+            # Start from the clock, so a lost counter can never land back on an old version
+            self.backend.init_counter(key, time.time_ns() // 1000)
+            version = self.backend.get_counter(key)
+        return version
+
+    def key(self, namespace: str, key: str, contractor_id: Optional[int] = None) -> str:
+        if contractor_id is None:
+            return f"{self.prefix}:g:{namespace}:{key}"
+        return f"{self.prefix}:c{contractor_id}:v{self.version(contractor_id)}:{namespace}:{key}"
+
+    def get(self, namespace: str, key: str, contractor_id: Optional[int] = None) -> Optional[bytes]:
+        try:
+            return self.backend.get(self.key(namespace, key, contractor_id))
+        except self.backend.errors as e:
+            logger.warning(f"Cache read failed for {namespace}:{key}: {e}")
+            return None
+
+    def set(self, namespace: str, key: str, value: bytes, contractor_id: Optional[int] = None,
+            ttl: Optional[float] = None) -> None:
+        try:
+            self.backend.set(self.key(namespace, key, contractor_id), value, ttl or self.default_ttl)
+        except self.backend.errors as e:
+            logger.warning(f"Cache write failed for {namespace}:{key}: {e}")
+
+    def get_or_load(self, namespace: str, key: str, loader: Callable[[], Optional[bytes]],
+                    contractor_id: Optional[int] = None, ttl: Optional[float] = None) -> Optional[bytes]:
+        """
+        Cached value, or the result of ``loader`` stored under the key.
+
+        Only one caller per process runs ``loader`` for a key at a time. A
+        loader that returns None (nothing to cache) is not stored.
+        """
+        try:
+            full_key = self.key(namespace, key, contractor_id)
+            value = self.backend.get(full_key)
+        except self.backend.errors as e:
+            logger.warning(f"Cache read failed for {namespace}:{key}: {e}")
+            return loader()
+        if value is not None:
+            return value
+
+        with self._lock:
+            flight = self._flights.get(full_key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[full_key] = _Flight()
+
+        if not leader:
+            if flight.done.wait(self.lock_ttl) and not flight.failed:
+                return flight.value
+            return loader()
+
+        try:
+            flight.value = self._load_shared(full_key, loader, ttl or self.default_ttl)
+            return flight.value
+        except BaseException:
+            flight.failed = True
+            raise
+        finally:
+            with self._lock:
+                self._flights.pop(full_key, None)
+            flight.done.set()
+
+    def _load_shared(self, full_key: str, loader: Callable[[], Optional[bytes]], ttl: float) -> Optional[bytes]:
+        # Other processes only share the entry through a remote backend
+        if self.backend.local:
+            return self._load_and_store(full_key, loader, ttl)
+
+        lock_key = f"{full_key}:lock"
+        try:
+            acquired = self.backend.add(lock_key, b"1", self.lock_ttl)
+        except self.backend.errors as e:
+            logger.warning(f"Cache lock failed for {full_key}: {e}")
+            return loader()
+        if acquired:
+            try:
+                return self._load_and_store(full_key, loader, ttl)
+            finally:
+                try:
+                    self.backend.delete(lock_key)
+                except self.backend.errors:
+                    pass
+
+        # Another worker is rebuilding the entry; wait for it rather than hitting the database too
+        deadline = time.monotonic() + self.lock_ttl
+        try:
+            while time.monotonic() < deadline:
+                time.sleep(settings.CACHE_LOCK_POLL_INTERVAL)
+                value = self.backend.get(full_key)
+                if value is not None:
+                    return value
+                if self.backend.get(lock_key) is None:
+                    break
+        except self.backend.errors as e:
+            logger.warning(f"Cache read failed for {full_key}: {e}")
+        return self._load_and_store(full_key, loader, ttl)
+
+    def _load_and_store(self, full_key: str, loader: Callable[[], Optional[bytes]], ttl: float) -> Optional[bytes]:
+        value = loader()
+        if value is not None:
+            try:
+                self.backend.set(full_key, value, ttl)
+            except self.backend.errors as e:
+                logger.warning(f"Cache write failed for {full_key}: {e}")
+        return value
+
+    def invalidate_contractor(self, contractor_id: int) -> None:
+        """Retire every cached entry of the contractor by moving them to a new version."""
+        try:
+            self.version(contractor_id)
+            self.backend.incr(self._version_key(contractor_id))
+        except self.backend.errors as e:
+            logger.error(f"Cache invalidation failed for contractor {contractor_id}: {e}")
+
+    def clear(self) -> None:
+        self.backend.clear()
+
+
+def build_backend(name: str):
+    if name == "memory":
+        return MemoryBackend(max_entries=settings.CACHE_MAX_ENTRIES)
+    if name == "redis":
+        return RedisBackend(url=settings.CACHE_URL)
+    raise ValueError(f"Unknown cache backend {name!r}")
+
+
+def _contractor_id_of(obj) -> Optional[int]:
+    if isinstance(obj, Contractor):
+        return obj.id
+    return obj.contractor_id
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_invalidations(db: Session, flush_context) -> None:
+    pending: Set[int] = db.info.setdefault("cache_invalidations", set())
+    for obj in list(db.new) + list(db.dirty) + list(db.deleted):
+        if not isinstance(obj, VERSIONED_MODELS):
+            continue
+        if obj in db.dirty and not db.is_modified(obj):
+            continue
+        contractor_id = _contractor_id_of(obj)
+        if contractor_id is not None:
+            pending.add(contractor_id)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _apply_invalidations(db: Session) -> None:
+    # Bumped only after commit, so no worker can re-cache the old rows under the new version
+    for contractor_id in db.info.pop("cache_invalidations", ()):
+        shared_cache.invalidate_contractor(contractor_id)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_invalidations(db: Session) -> None:
+    db.info.pop("cache_invalidations", None)
+
+
+shared_cache = SharedCache(
+    build_backend(settings.CACHE_BACKEND),
+    prefix=settings.CACHE_PREFIX,
+    default_ttl=settings.CACHE_DEFAULT_TTL,
+    lock_ttl=settings.CACHE_LOCK_TTL
+)
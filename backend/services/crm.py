@@ -0,0 +1,374 @@
+"""
+Pushing leads to the contractor's CRM.
+
+Leads go to the CRM through an adapter. ``CRM_API_URL`` selects an HTTP
+CRM; when it is empty, a mock adapter answers in-process. Leads are pushed
+concurrently, with at most ``CRM_CONCURRENCY`` requests in flight. When
+the adapter has a bulk API, leads are coalesced into requests of up to
+``CRM_BULK_SIZE`` leads. Results are yielded one per lead as requests
+complete.
+
+The incremental sync sends only the leads changed since the contractor's
+watermark, which is (updated_at, id) of the last lead sent. Leads changed
+in the last ``CRM_SYNC_LAG_SECONDS`` wait for the next run, so a
+transaction that commits late cannot slip behind the watermark. The
+watermark only advances past a chunk once every lead in it was accepted.
+CRMs upsert by ``external_id``, so a retried chunk is harmless.
+
+Every API worker runs the scheduler and syncs can also be started by
+hand, so a sync first leases the contractor's ``crm_sync_state`` row
+(``locked_until``/``claim_token``) and renews the lease with every chunk.
+A sync that finds the row leased does not run (``CRMSyncBusy``), so
+changed leads are never pushed by two workers at once.
+
+The HTTP adapter speaks this protocol::
+
+    POST {CRM_API_URL}/leads       {lead}               -> {"id": ...}
+    POST {CRM_API_URL}/leads/bulk  {"leads": [lead...]} -> {"results": [{"external_id", "id" | "error"}...]}
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import timedelta
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+from sqlalchemy import and_, or_, select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import Contractor, CRMSyncState, Lead, Quote, utcnow
+
+logger = logging.getLogger(__name__)
+
+
+class CRMError(Exception):
+    pass
+
+
+class CRMSyncBusy(CRMError):
+    """Another worker is syncing the contractor."""
+
+
+class MockCRMAdapter:
+    """Stands in for a CRM when none is configured."""
+
+    name = "mock"
+    supports_bulk = True
+
+    async def push(self, lead: dict) -> str:
+        return f"CRM_{random.randint(100000, 999999)}"
+
+    async def push_bulk(self, leads: List[dict]) -> Dict[int, dict]:
+        return {lead["external_id"]: {"id": await self.push(lead)} for lead in leads}
+
+    async def close(self) -> None:
+        pass
+
+
+class HttpCRMAdapter:
+    name = "http"
+    supports_bulk = True
+
+    def __init__(self, base_url: str, api_key: str):
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self._client: Optional[httpx.AsyncClient] = None
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # One pooled client for all pushes; created on first use inside the event loop
+        if self._client is None:
+            self._client = httpx.AsyncClient(
+                base_url=self.base_url,
+                timeout=settings.CRM_TIMEOUT,
+                headers={"Authorization": f"Bearer {self.api_key}"} if self.api_key else {},
+                limits=httpx.Limits(
+                    max_connections=settings.CRM_CONCURRENCY,
+                    max_keepalive_connections=settings.CRM_CONCURRENCY
+                )
+            )
+        return self._client
+
+    async def push(self, lead: dict) -> str:
+        try:
+            response = await self.client.post("/leads", json=lead)
+            response.raise_for_status()
+            return str(response.json()["id"])
+        except (httpx.HTTPError, ValueError, KeyError) as e:
+            raise CRMError(f"{type(e).__name__}: {e}")
+
+    async def push_bulk(self, leads: List[dict]) -> Dict[int, dict]:
+        try:
+            response = await self.client.post("/leads/bulk", json={"leads": leads})
+            response.raise_for_status()
+            return {item["external_id"]: item for item in response.json()["results"]}
+        except (httpx.HTTPError, ValueError, KeyError, TypeError) as e:
+            raise CRMError(f"{type(e).__name__}: {e}")
+
+    async def close(self) -> None:
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+
+
+def build_adapter():
+    if settings.CRM_API_URL:
+        return HttpCRMAdapter(settings.CRM_API_URL, settings.CRM_API_KEY)
+    return MockCRMAdapter()
+
+
+crm_adapter = build_adapter()
+
+
+def lead_payload(lead_id: int, name: str, email: str, phone: Optional[str], address: str,
+                 quote_amount: Optional[float], source: Optional[str], contractor: str) -> dict:
+    return {
+        "external_id": lead_id,
+        "name": name,
+        "email": email,
+        "phone": phone,
+        "address": address,
+        "quote_amount": quote_amount,
+        "source": source,
+        "contractor": contractor
+    }
+
+
+async def push_leads(
+    leads: List[dict],
+    adapter=None,
+    concurrency: int = settings.CRM_CONCURRENCY,
+    bulk_size: int = settings.CRM_BULK_SIZE
+) -> AsyncIterator[dict]:
+    """Push lead payloads and yield ``{"lead_id", "status", "crm_lead_id" | "error"}`` as each completes."""
+    adapter = adapter or crm_adapter
+    use_bulk = adapter.supports_bulk and bulk_size > 1
+    if use_bulk:
+        groups = [leads[i:i + bulk_size] for i in range(0, len(leads), bulk_size)]
+    else:
+        groups = [[lead] for lead in leads]
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def send(group: List[dict]) -> List[dict]:
+        async with semaphore:
+            try:
+                if not use_bulk:
+                    crm_lead_id = await adapter.push(group[0])
+                    return [{"lead_id": group[0]["external_id"], "status": "created", "crm_lead_id": crm_lead_id}]
+                accepted = await adapter.push_bulk(group)
+            except CRMError as e:
+                logger.warning(f"CRM push of {len(group)} leads failed: {e}")
+                return [{"lead_id": lead["external_id"], "status": "failed", "error": str(e)} for lead in group]
+        results = []
+        for lead in group:
+            item = accepted.get(lead["external_id"]) or {"error": "missing from CRM response"}
+            if item.get("id") is not None:
+                results.append({"lead_id": lead["external_id"], "status": "created", "crm_lead_id": str(item["id"])})
+            else:
+                results.append({"lead_id": lead["external_id"], "status": "failed", "error": str(item.get("error"))})
+        return results
+
+    tasks = [asyncio.ensure_future(send(group)) for group in groups]
+    try:
+        for finished in asyncio.as_completed(tasks):
+            for result in await finished:
+                yield result
+    finally:
+        # A client that stops reading the stream should not leave pushes running
+        for task in tasks:
+            task.cancel()
+
+
+def _changed_leads(db: Session, contractor_id: int, state: CRMSyncState, limit: int):
+    latest_quote = (
+        select(Quote.total_price)
+        .where(Quote.lead_id == Lead.id)
+        .order_by(Quote.created_at.desc(), Quote.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    stmt = select(
+        Lead.id, Lead.name, Lead.email, Lead.phone, Lead.address, Lead.source, Lead.updated_at,
+        latest_quote.label("quote_amount")
+    ).where(
+        Lead.contractor_id == contractor_id,
+        Lead.updated_at <= utcnow() - timedelta(seconds=settings.CRM_SYNC_LAG_SECONDS)
+    )
+    if state.watermark_at is not None:
+        stmt = stmt.where(or_(
+            Lead.updated_at > state.watermark_at,
+            and_(Lead.updated_at == state.watermark_at, Lead.id > state.watermark_lead_id)
+        ))
+    return db.execute(stmt.order_by(Lead.updated_at, Lead.id).limit(limit)).all()
+
+
+def _lease_expiry():
+    return utcnow() + timedelta(seconds=settings.CRM_SYNC_LEASE_SECONDS)
+
+
+def claim_sync(db: Session, contractor_id: int, token: str) -> CRMSyncState:
+    """Lease the contractor's sync state to ``token``, creating it on the first sync; raises CRMSyncBusy."""
+    exists = db.execute(
+        select(CRMSyncState.id).where(CRMSyncState.contractor_id == contractor_id)
+    ).scalar() is not None
+    if not exists:
+        try:
+            db.add(CRMSyncState(contractor_id=contractor_id, watermark_lead_id=0, last_synced=0, total_synced=0))
+            db.commit()
+        except IntegrityError:
+            # Created by a first sync on another worker meanwhile
+            db.rollback()
+    now = utcnow()
+    result = db.execute(
+        update(CRMSyncState)
+        .where(
+            CRMSyncState.contractor_id == contractor_id,
+            or_(CRMSyncState.locked_until.is_(None), CRMSyncState.locked_until < now)
+        )
+        .values(locked_until=_lease_expiry(), claim_token=token)
+    )
+    db.commit()
+    if result.rowcount != 1:
+        raise CRMSyncBusy(f"CRM sync for contractor {contractor_id} is already running")
+    return db.query(CRMSyncState).filter(CRMSyncState.contractor_id == contractor_id).one()
+
+
+def _renew_lease(db: Session, contractor_id: int, token: str, release: bool = False) -> bool:
+    """Extend (or release) the lease in the current transaction; False when it is no longer ours."""
+    values = {"locked_until": None, "claim_token": None} if release else {"locked_until": _lease_expiry()}
+    result = db.execute(
+        update(CRMSyncState)
+        .where(CRMSyncState.contractor_id == contractor_id, CRMSyncState.claim_token == token)
+        .values(**values)
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def state_status(state: CRMSyncState) -> dict:
+    return {
+        "contractor_id": state.contractor_id,
+        "watermark_at": state.watermark_at,
+        "watermark_lead_id": state.watermark_lead_id,
+        "last_run_at": state.last_run_at,
+        "last_synced": state.last_synced,
+        "total_synced": state.total_synced,
+        "last_error": state.last_error
+    }
+
+
+async def sync_contractor(contractor_id: int, chunk_size: int = settings.CRM_SYNC_CHUNK_SIZE) -> dict:
+    """Send the contractor's leads changed since the watermark; returns the sync state or raises CRMSyncBusy."""
+    # Nothing is reloaded after a commit, so attribute access never hits the database on the event loop
+    db = SessionLocal(expire_on_commit=False)
+    token = uuid.uuid4().hex
+    try:
+        contractor = await asyncio.to_thread(db.get, Contractor, contractor_id)
+        if contractor is None:
+            raise CRMError(f"Contractor {contractor_id} not found")
+        company_name = contractor.company_name
+        state = await asyncio.to_thread(claim_sync, db, contractor_id, token)
+        synced = 0
+        error = None
+        while True:
+            rows = await asyncio.to_thread(_changed_leads, db, contractor_id, state, chunk_size)
+            if not rows:
+                break
+            payloads = [
+                lead_payload(row.id, row.name, row.email, row.phone, row.address, row.quote_amount, row.source,
+                             company_name)
+                for row in rows
+            ]
+            failed = [result async for result in push_leads(payloads) if result["status"] != "created"]
+            if failed:
+                error = f"{len(failed)} of {len(rows)} leads rejected, first: {failed[0]['error']}"
+                break
+            if not await asyncio.to_thread(_renew_lease, db, contractor_id, token):
+                # Only possible after the lease ran out mid-chunk; the new holder owns the watermark now
+                await asyncio.to_thread(db.rollback)
+                raise CRMSyncBusy(f"CRM sync for contractor {contractor_id} lost its lease")
+            state.watermark_at = rows[-1].updated_at
+            state.watermark_lead_id = rows[-1].id
+            synced += len(rows)
+            state.total_synced += len(rows)
+            await asyncio.to_thread(db.commit)
+            if len(rows) < chunk_size:
+                break
+
+        state.last_run_at = utcnow()
+        state.last_synced = synced
+        state.last_error = error
+        await asyncio.to_thread(_renew_lease, db, contractor_id, token, True)
+        await asyncio.to_thread(db.commit)
+        if synced or error:
+            logger.info(f"CRM sync for contractor {contractor_id}: {synced} leads sent" + (f", {error}" if error else ""))
+        return state_status(state)
+    except BaseException:
+        # Let the next run start at once instead of waiting out the lease
+        await asyncio.to_thread(_release_after_failure, db, contractor_id, token)
+        raise
+    finally:
+        db.close()
+
+
+def _release_after_failure(db: Session, contractor_id: int, token: str) -> None:
+    try:
+        db.rollback()
+        _renew_lease(db, contractor_id, token, release=True)
+        db.commit()
+    except Exception as e:
+        logger.warning(f"Could not release the CRM sync lease for contractor {contractor_id}: {e}")
+
+
+def _contractor_ids() -> List[int]:
+    db = SessionLocal()
+    try:
+        return list(db.execute(select(Contractor.id).order_by(Contractor.id)).scalars())
+    finally:
+        db.close()
+
+
+class CRMSyncScheduler:
+    """Runs the incremental sync for every contractor on an interval for the lifetime of the app."""
+
+    def __init__(self, interval_seconds: float):
+        self.interval_seconds = interval_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if self.interval_seconds > 0 and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await crm_adapter.close()
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                contractor_ids = await asyncio.to_thread(_contractor_ids)
+            except Exception as e:
+                logger.error(f"Could not list contractors for CRM sync: {e}", exc_info=True)
+                contractor_ids = []
+            for contractor_id in contractor_ids:
+                try:
+                    await sync_contractor(contractor_id)
+                except CRMSyncBusy:
+                    pass
+                except Exception as e:
+                    # One failing contractor should not hold up the rest
+                    logger.error(f"CRM sync for contractor {contractor_id} failed: {e}", exc_info=True)
+            await asyncio.sleep(self.interval_seconds)
+
+
+crm_sync_scheduler = CRMSyncScheduler(interval_seconds=settings.CRM_SYNC_INTERVAL)
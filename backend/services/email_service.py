@@ -1,132 +1,358 @@
-import os
+"""
+Outgoing email.
+
+Requests never talk to SendGrid themselves. They write an
+``email_messages`` row and return its message id straight away. A
+background dispatcher then sends queued messages to the SendGrid v3 API,
+``EMAIL_CONCURRENCY`` at a time, over one pooled HTTP client.
+
+One message can carry many recipients: a bulk send becomes one request
+per ``EMAIL_MAX_PERSONALIZATIONS`` recipients, each of them a
+personalization with its own substitutions. Rate limits (429), server
+errors and network errors are retried with exponential backoff. Other
+rejections, such as a bad key or an unverified sender, fail the message
+at once, since retrying would not help.
+
+SendGrid credentials come from ``sendgrid.env`` (SENDGRID_API_KEY,
+SENDGRID_FROM_EMAIL, SENDGRID_FROM_NAME, SENDGRID_REPLY_TO).
+``EMAIL_API_URL`` can point the dispatcher at a local stand-in.
+"""
+import asyncio
 import base64
-from sendgrid import SendGridAPIClient
-from sendgrid.helpers.mail import Mail, Attachment, FileContent, FileName, FileType, Disposition
-from typing import Optional
+import binascii
+import logging
+import os
+import random
+import uuid
+from datetime import timedelta
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import httpx
 from dotenv import load_dotenv
+from sqlalchemy import event, or_, select, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import EmailMessage, utcnow
+from services import templating
+
+logger = logging.getLogger(__name__)
+
+env_path = Path(__file__).parent.parent / "sendgrid.env"
+if env_path.exists():
+    load_dotenv(env_path)
+else:
+    logger.warning(f"SendGrid configuration file not found at {env_path}")
+
+PLACEHOLDER_API_KEY = "your_sendgrid_api_key_here"
+
+# Retrying these will not change SendGrid's answer
+PERMANENT_STATUS_CODES = {400, 401, 403, 404, 413}
+
+
+def api_key() -> Optional[str]:
+    key = os.environ.get("SENDGRID_API_KEY")
+    return key if key and key != PLACEHOLDER_API_KEY else None
+
+
+def is_configured() -> bool:
+    return api_key() is not None
+
+
+def sender() -> Dict[str, Optional[str]]:
+    from_email = os.environ.get("SENDGRID_FROM_EMAIL", "noreply@roofquotepro.com")
+    return {
+        "from_email": from_email,
+        "from_name": os.environ.get("SENDGRID_FROM_NAME", "Roof Quote Pro"),
+        "reply_to": os.environ.get("SENDGRID_REPLY_TO", from_email)
+    }
+
+
+def plain_text_html(text: str) -> str:
+    return templating.page("email/plain_text.html").render(body=text)
+
+
+def test_email_html() -> str:
+    return templating.page("email/test.html").render()
+
+
+def quote_email_html(db: Session, contractor_id: int, customer_name: str, quote_details: dict) -> Optional[str]:
+    """HTML body of the quote summary email sent with a quote PDF; None for an unknown contractor."""
+    page = templating.contractor_page(db, "email/quote_summary.html", contractor_id)
+    if page is None:
+        return None
+    return page.render(
+        customer_name=customer_name,
+        address=quote_details.get('address', 'Your Property'),
+        roof_size=f"{quote_details.get('roof_size_sqft', 0):,}",
+        selected_tier=quote_details.get('selected_tier', 'Better').title(),
+        total_price=f"{quote_details.get('total_price', 0):,}"
+    )
+
+
+def pdf_attachment(pdf_base64: str, filename: str) -> Optional[dict]:
+    """SendGrid attachment for a base64 PDF, or None when the data is not valid base64."""
+    try:
+        base64.b64decode(pdf_base64, validate=True)
+    except (binascii.Error, ValueError) as e:
+        logger.error(f"Ignoring invalid PDF attachment {filename}: {e}")
+        return None
+    return {"content": pdf_base64, "filename": filename, "type": "application/pdf", "disposition": "attachment"}
+
+
+def personalization(email: str, name: Optional[str] = None, substitutions: Optional[dict] = None) -> dict:
+    to = {"email": email, **({"name": name} if name else {})}
+    return {"to": [to], **({"substitutions": substitutions} if substitutions else {})}
+
+
+def enqueue(
+    db: Session,
+    kind: str,
+    subject: str,
+    personalizations: List[dict],
+    text_content: Optional[str] = None,
+    html_content: Optional[str] = None,
+    attachments: Optional[List[dict]] = None
+) -> List[EmailMessage]:
+    """Queue one message per ``EMAIL_MAX_PERSONALIZATIONS`` recipients; the caller commits."""
+    size = settings.EMAIL_MAX_PERSONALIZATIONS
+    messages = [
+        EmailMessage(
+            message_id=uuid.uuid4().hex,
+            kind=kind,
+            subject=subject,
+            text_content=text_content,
+            html_content=html_content,
+            personalizations=personalizations[i:i + size],
+            attachments=attachments or None,
+            status="queued",
+            attempts=0,
+            next_attempt_at=utcnow(),
+            **sender()
+        )
+        for i in range(0, len(personalizations), size)
+    ]
+    db.add_all(messages)
+    db.info["emails_enqueued"] = True
+    return messages
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _wake_dispatcher(db: Session) -> None:
+    if db.info.pop("emails_enqueued", False):
+        email_dispatcher.wake()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_wakeup(db: Session) -> None:
+    db.info.pop("emails_enqueued", None)
+
+
+def message_status(message: EmailMessage) -> dict:
+    return {
+        "message_id": message.message_id,
+        "kind": message.kind,
+        "status": message.status,
+        "recipients": sum(len(p["to"]) for p in message.personalizations),
+        "attempts": message.attempts,
+        "next_attempt_at": message.next_attempt_at if message.status == "queued" else None,
+        "last_status_code": message.last_status_code,
+        "last_error": message.last_error,
+        "provider_message_id": message.provider_message_id,
+        "created_at": message.created_at,
+        "sent_at": message.sent_at
+    }
+
+
+def sendgrid_payload(message: EmailMessage) -> dict:
+    content = []
+    if message.text_content:
+        content.append({"type": "text/plain", "value": message.text_content})
+    if message.html_content:
+        content.append({"type": "text/html", "value": message.html_content})
+    payload = {
+        "personalizations": message.personalizations,
+        "from": {"email": message.from_email, **({"name": message.from_name} if message.from_name else {})},
+        "subject": message.subject,
+        "content": content
+    }
+    if message.reply_to:
+        payload["reply_to"] = {"email": message.reply_to}
+    if message.attachments:
+        payload["attachments"] = message.attachments
+    return payload
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(settings.EMAIL_BACKOFF_BASE * 2 ** (attempts - 1), settings.EMAIL_BACKOFF_MAX)
+    return delay * random.uniform(0.5, 1.0)
+
+
+def claim_batch(limit: int) -> List[EmailMessage]:
+    """Lease up to ``limit`` due messages to this worker."""
+    db = SessionLocal()
+    try:
+        now = utcnow()
+        token = uuid.uuid4().hex
+        lease_free = or_(EmailMessage.locked_until.is_(None), EmailMessage.locked_until < now)
+        ids = list(db.execute(
+            select(EmailMessage.id)
+            .where(EmailMessage.status == "queued", EmailMessage.next_attempt_at <= now, lease_free)
+            .order_by(EmailMessage.next_attempt_at)
+            .limit(limit)
+        ).scalars())
+        if not ids:
+            return []
+        db.execute(
+            update(EmailMessage)
+            .where(EmailMessage.id.in_(ids), lease_free)
+            .values(locked_until=now + timedelta(seconds=settings.EMAIL_LEASE_SECONDS), claim_token=token)
+        )
+        db.commit()
+        messages = list(db.execute(select(EmailMessage).where(EmailMessage.claim_token == token)).scalars())
+        db.expunge_all()
+        return messages
+    finally:
+        db.close()
+
+
+def record_results(results: List[dict]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(update(EmailMessage), results)
+        db.commit()
+    finally:
+        db.close()
+
+
+class EmailDispatcher:
+    """Sends queued email for the lifetime of the app."""
+
+    def __init__(self, poll_interval: float, batch_size: int, concurrency: int):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.client: Optional[httpx.AsyncClient] = None
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        self.client = httpx.AsyncClient(
+            base_url=settings.EMAIL_API_URL,
+            timeout=settings.EMAIL_TIMEOUT,
+            limits=httpx.Limits(max_connections=self.concurrency, max_keepalive_connections=self.concurrency)
+        )
+        self._semaphore = asyncio.Semaphore(self.concurrency)
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def wake(self) -> None:
+        """Send newly queued messages now instead of at the next poll; safe to call from any thread."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def send(self, message: EmailMessage) -> dict:
+        attempts = message.attempts + 1
+        result = {
+            "id": message.id,
+            "attempts": attempts,
+            "locked_until": None,
+            "claim_token": None,
+            "last_status_code": None
+        }
+        key = api_key()
+        if key is None:
+            logger.error(f"Email {message.message_id} not sent: SendGrid API key not configured")
+            return {**result, "status": "failed", "last_error": "SendGrid API key not configured"}
+
+        async with self._semaphore:
+            try:
+                response = await self.client.post(
+                    "/v3/mail/send",
+                    json=sendgrid_payload(message),
+                    headers={"Authorization": f"Bearer {key}"}
+                )
+            except httpx.HTTPError as e:
+                response = None
+                result["last_error"] = f"{type(e).__name__}: {e}"[:1000]
+
+        if response is not None:
+            result["last_status_code"] = response.status_code
+            if response.is_success:
+                logger.info(
+                    f"Email {message.message_id} ({message.kind}) sent to "
+                    f"{len(message.personalizations)} recipients on attempt {attempts}"
+                )
+                return {
+                    **result,
+                    "status": "sent",
+                    "sent_at": utcnow(),
+                    "last_error": None,
+                    "provider_message_id": response.headers.get("x-message-id")
+                }
+            result["last_error"] = f"HTTP {response.status_code}: {response.text[:500]}"
+            if response.status_code in PERMANENT_STATUS_CODES:
+                logger.error(f"Email {message.message_id} rejected by SendGrid: {result['last_error']}")
+                return {**result, "status": "failed"}
+
+        if attempts >= settings.EMAIL_MAX_ATTEMPTS:
+            logger.error(f"Email {message.message_id} failed after {attempts} attempts: {result['last_error']}")
+            return {**result, "status": "failed"}
+        delay = backoff_seconds(attempts)
+        logger.warning(
+            f"Email {message.message_id} attempt {attempts} failed ({result['last_error']}); retrying in {delay:.0f}s"
+        )
+        return {**result, "status": "queued", "next_attempt_at": utcnow() + timedelta(seconds=delay)}
+
+    async def run_once(self) -> int:
+        messages = await asyncio.to_thread(claim_batch, self.batch_size)
+        if not messages:
+            return 0
+        results = await asyncio.gather(*(self.send(message) for message in messages))
+        # executemany needs the same keys in every row
+        keys = set().union(*results)
+        await asyncio.to_thread(record_results, [
+            {key: result.get(key, getattr(message, key)) for key in keys}
+            for message, result in zip(messages, results)
+        ])
+        return len(messages)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                sent = await self.run_once()
+            except Exception as e:
+                logger.error(f"Email dispatch failed: {e}", exc_info=True)
+                sent = 0
+            if sent:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
 
-load_dotenv()
-
-class EmailService:
-    def __init__(self):
-        self.api_key = os.environ.get('SENDGRID_API_KEY')
-        self.from_email = os.environ.get('SENDGRID_FROM_EMAIL', 'noreply@roofquotepro.com')
-        self.from_name = os.environ.get('SENDGRID_FROM_NAME', 'Roof Quote Pro')
-        
-    def send_quote_email(
-        self,
-        to_email: str,
-        customer_name: str,
-        pdf_content: bytes,
-        quote_details: dict,
-        contractor_name: str = "Your Local Roofing Expert"
-    ) -> bool:
-        """
-        Send a quote email with PDF attachment
-        
-        Args:
-            to_email: Recipient email address
-            customer_name: Customer's full name
-            pdf_content: PDF file content as bytes
-            quote_details: Dictionary containing quote details (address, price, tier, etc.)
-            contractor_name: Name of the contractor sending the quote
-            
-        Returns:
-            bool: True if email sent successfully, False otherwise
-        """
-        try:
-            if not self.api_key:
-                print("WARNING: SENDGRID_API_KEY not configured. Email will not be sent.")
-                return False
-                
-            # Create the email message
-            message = Mail(
-                from_email=(self.from_email, self.from_name),
-                to_emails=to_email,
-                subject=f"Your Roof Quote from {contractor_name}",
-                html_content=self._create_email_html(customer_name, quote_details, contractor_name)
-            )
-            
-            # Attach the PDF
-            encoded_pdf = base64.b64encode(pdf_content).decode()
-            attachment = Attachment(
-                FileContent(encoded_pdf),
-                FileName('roof_quote.pdf'),
-                FileType('application/pdf'),
-                Disposition('attachment')
-            )
-            message.attachment = attachment
-            
-            # Send the email
-            sg = SendGridAPIClient(self.api_key)
-            response = sg.send(message)
-            
-            print(f"Email sent successfully to {to_email}. Status code: {response.status_code}")
-            return response.status_code in [200, 201, 202]
-            
-        except Exception as e:
-            print(f"Error sending email: {str(e)}")
-            return False
-    
-    def _create_email_html(self, customer_name: str, quote_details: dict, contractor_name: str) -> str:
-        """Create HTML content for the email"""
-        
-        address = quote_details.get('address', 'Your Property')
-        selected_tier = quote_details.get('selected_tier', 'Better').title()
-        total_price = quote_details.get('total_price', 0)
-        roof_size = quote_details.get('roof_size_sqft', 0)
-        
-        html_content = f"""
-        <html>
-            <body style="font-family: Arial, sans-serif; line-height: 1.6; color: #333;">
-                <div style="max-width: 600px; margin: 0 auto; padding: 20px;">
-                    <h2 style="color: #059669;">Your Personalized Roof Quote</h2>
-                    
-                    <p>Dear {customer_name},</p>
-                    
-                    <p>Thank you for requesting a roof quote! We're excited to help you with your roofing project.</p>
-                    
-                    <div style="background-color: #f3f4f6; padding: 20px; border-radius: 8px; margin: 20px 0;">
-                        <h3 style="color: #059669; margin-top: 0;">Quote Summary</h3>
-                        <p><strong>Property Address:</strong> {address}</p>
-                        <p><strong>Estimated Roof Size:</strong> {roof_size:,} sq ft</p>
-                        <p><strong>Selected Package:</strong> {selected_tier}</p>
-                        <p style="font-size: 1.2em;"><strong>Total Estimated Price:</strong> <span style="color: #059669;">${total_price:,}</span></p>
-                    </div>
-                    
-                    <p>Please find your detailed quote attached as a PDF. This quote includes:</p>
-                    <ul>
-                        <li>Complete pricing breakdown</li>
-                        <li>Material specifications</li>
-                        <li>Warranty information</li>
-                        <li>Next steps</li>
-                    </ul>
-                    
-                    <p><strong>What's Next?</strong></p>
-                    <p>One of our roofing specialists will contact you within 24-48 hours to:</p>
-                    <ul>
-                        <li>Schedule a detailed roof inspection</li>
-                        <li>Answer any questions you may have</li>
-                        <li>Discuss financing options if needed</li>
-                        <li>Confirm final measurements and pricing</li>
-                    </ul>
-                    
-                    <p>If you have any immediate questions, please don't hesitate to reach out to us.</p>
-                    
-                    <p>Best regards,<br>
-                    <strong>{contractor_name}</strong></p>
-                    
-                    <hr style="margin-top: 40px; border: none; border-top: 1px solid #e5e7eb;">
-                    <p style="font-size: 0.9em; color: #6b7280; text-align: center;">
-                        This quote is valid for 30 days from the date of generation. 
-                        Final pricing may vary based on actual roof measurements and conditions.
-                    </p>
-                </div>
-            </body>
-        </html>
-        """
-        
-        return html_content
-
-# Create a singleton instance
-email_service = EmailService()
\ No newline at end of file
+email_dispatcher = EmailDispatcher(
+    poll_interval=settings.EMAIL_POLL_INTERVAL,
+    batch_size=settings.EMAIL_BATCH_SIZE,
+    concurrency=settings.EMAIL_CONCURRENCY
+)
@@ -0,0 +1,139 @@
+"""
+Address normalization and the small amount of planar geometry the roof
+measurement code needs.
+
+Polygons are lists of (lng, lat) points. Areas and distances are computed
+on a local equirectangular projection around the polygon, which matches
+the frontend's overpassService and is accurate to well under a percent at
+building scale.
+"""
+import math
+import re
+from typing import List, Optional, Tuple
+
+SQM_TO_SQFT = 10.764
+METERS_PER_DEGREE = 111320.0
+DEFAULT_PITCH = "6/12"
+
+Point = Tuple[float, float]
+
+STREET_SUFFIXES = {
+    "street": "st", "avenue": "ave", "road": "rd", "drive": "dr", "lane": "ln", "boulevard": "blvd",
+    "court": "ct", "circle": "cir", "place": "pl", "parkway": "pkwy", "highway": "hwy", "terrace": "ter",
+    "trail": "trl", "way": "way", "square": "sq"
+}
+DIRECTIONS = {
+    "north": "n", "south": "s", "east": "e", "west": "w",
+    "northeast": "ne", "northwest": "nw", "southeast": "se", "southwest": "sw"
+}
+UNIT_WORDS = {"apartment": "apt", "suite": "ste", "unit": "unit", "#": "unit"}
+
+
+def normalize_address(address: str) -> str:
+    """
+    Canonical form used to key measurements and footprints.
+
+    "123 North Main Street, Dallas, TX" and "123 n. main st dallas tx"
+    normalize to the same string.
+    """
+    words = re.findall(r"[a-z0-9#]+", (address or "").lower())
+    normalized = []
+    for word in words:
+        word = STREET_SUFFIXES.get(word, word)
+        word = DIRECTIONS.get(word, word)
+        word = UNIT_WORDS.get(word, word)
+        normalized.append(word)
+    return " ".join(normalized)
+
+
+def normalize_pitch(pitch) -> str:
+    """Return pitch as "rise/12" whether given as "6:12", "6/12", "6" or 6."""
+    if pitch is None:
+        return DEFAULT_PITCH
+    match = re.match(r"\s*(\d+(?:\.\d+)?)\s*(?:[:/]\s*12)?\s*$", str(pitch))
+    if not match:
+        return DEFAULT_PITCH
+    rise = float(match.group(1))
+    return f"{rise:g}/12"
+
+
+def pitch_factor(pitch) -> float:
+    """Ratio of sloped roof area to its horizontal projection."""
+    rise = float(normalize_pitch(pitch).split("/")[0])
+    return math.sqrt(1 + (rise / 12) ** 2)
+
+
+def _scales(lat: float) -> Tuple[float, float]:
+    return METERS_PER_DEGREE * abs(math.cos(math.radians(lat))), METERS_PER_DEGREE
+
+
+def polygon_area_sqm(ring: List[Point]) -> float:
+    """Shoelace area of a ring, projected to meters around its mean latitude."""
+    if len(ring) < 3:
+        return 0.0
+    lng_to_m, lat_to_m = _scales(sum(lat for _, lat in ring) / len(ring))
+    local = [(lng * lng_to_m, lat * lat_to_m) for lng, lat in ring]
+    area = 0.0
+    for i, (x1, y1) in enumerate(local):
+        x2, y2 = local[(i + 1) % len(local)]
+        area += x1 * y2 - x2 * y1
+    return abs(area) / 2
+
+
+def centroid(ring: List[Point]) -> Point:
+    return sum(lng for lng, _ in ring) / len(ring), sum(lat for _, lat in ring) / len(ring)
+
+
+def contains(ring: List[Point], point: Point) -> bool:
+    """Even-odd point in polygon test."""
+    x, y = point
+    inside = False
+    for i, (x1, y1) in enumerate(ring):
+        x2, y2 = ring[i - 1]
+        if (y1 > y) != (y2 > y) and x < (x2 - x1) * (y - y1) / (y2 - y1) + x1:
+            inside = not inside
+    return inside
+
+
+def distance_to_ring_m(ring: List[Point], point: Point) -> float:
+    """Meters from the point to the polygon; zero when the point is inside it."""
+    if contains(ring, point):
+        return 0.0
+    lng_to_m, lat_to_m = _scales(point[1])
+    px, py = point[0] * lng_to_m, point[1] * lat_to_m
+    best = math.inf
+    for i, (lng1, lat1) in enumerate(ring):
+        lng2, lat2 = ring[i - 1]
+        x1, y1, x2, y2 = lng1 * lng_to_m, lat1 * lat_to_m, lng2 * lng_to_m, lat2 * lat_to_m
+        dx, dy = x2 - x1, y2 - y1
+        length = dx * dx + dy * dy
+        t = 0.0 if length == 0 else max(0.0, min(1.0, ((px - x1) * dx + (py - y1) * dy) / length))
+        best = min(best, math.hypot(px - (x1 + t * dx), py - (y1 + t * dy)))
+    return best
+
+
+def degrees_around(lat: float, meters: float) -> Tuple[float, float]:
+    """Half-widths in degrees (lat, lng) of a box extending ``meters`` around a latitude."""
+    lng_to_m, lat_to_m = _scales(lat)
+    return meters / lat_to_m, meters / max(lng_to_m, 1e-9)
+
+
+def outer_rings(geometry: Optional[dict]) -> List[List[Point]]:
+    """Outer rings of a GeoJSON Polygon or MultiPolygon, without the closing point."""
+    geometry = geometry or {}
+    if geometry.get("type") == "Polygon":
+        polygons = [geometry["coordinates"]]
+    elif geometry.get("type") == "MultiPolygon":
+        polygons = geometry["coordinates"]
+    else:
+        return []
+    rings = []
+    for polygon in polygons:
+        if not polygon:
+            continue
+        ring = [(float(point[0]), float(point[1])) for point in polygon[0]]
+        if len(ring) > 1 and ring[0] == ring[-1]:
+            ring = ring[:-1]
+        if len(ring) >= 3:
+            rings.append(ring)
+    return rings
@@ -0,0 +1,48 @@
+"""
+Resized WebP variants of an uploaded logo.
+
+Runs in the logo worker pool's processes, so it imports nothing from the
+app. Variants are written next to the original as
+``{digest}-w{width}.webp``. Images are never upscaled, so a variant
+wider than the original has the original's size.
+"""
+import os
+import threading
+from typing import Dict, List
+
+from PIL import Image, ImageOps
+
+
+def make_variants(path: str, digest: str, widths: List[int], quality: int, max_pixels: int) -> Dict[int, str]:
+    """Write the missing variants of the image at ``path``; returns ``{width: file name}``.
+
+    Raises ValueError when the file is not an image Pillow can read, or is
+    larger than ``max_pixels``.
+    """
+    directory = os.path.dirname(path)
+    try:
+        with Image.open(path) as original:
+            if original.width * original.height > max_pixels:
+                raise ValueError(f"Image is {original.width}x{original.height}, over the {max_pixels:,} pixel limit")
+            # Decode now, so truncated files and decompression bombs fail here
+            original.load()
+            image = ImageOps.exif_transpose(original)
+            image = image.convert("RGBA" if "A" in image.getbands() or "transparency" in image.info else "RGB")
+    except (OSError, Image.DecompressionBombError) as e:
+        # The message may name the file's path on disk; callers show this one to users
+        raise ValueError(f"Not a readable image ({type(e).__name__})")
+
+    variants = {}
+    for width in sorted(set(widths)):
+        name = f"{digest}-w{width}.webp"
+        target = os.path.join(directory, name)
+        if not os.path.exists(target):
+            variant = image
+            if image.width > width:
+                height = max(1, round(image.height * width / image.width))
+                variant = image.resize((width, height), Image.Resampling.LANCZOS)
+            tmp_path = f"{target}.{os.getpid()}.{threading.get_ident()}.tmp"
+            variant.save(tmp_path, "WEBP", quality=quality, method=6)
+            os.replace(tmp_path, target)
+        variants[width] = name
+    return variants
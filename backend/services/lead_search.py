@@ -0,0 +1,165 @@
+"""
+Indexed lead search.
+
+SQLite keeps an FTS5 table (``leads_fts``) in sync with ``leads`` through
+triggers, so ORM writes, Core bulk inserts and cascading deletes are all
+covered. Postgres uses expression indexes (a tsvector GIN index plus a
+trigram index on the digits of the phone number) which the database
+maintains itself. Other dialects fall back to substring matching.
+
+Phone numbers are indexed as digits only, so "555-0100", "(555) 0100" and
+"5550100" all find the same lead. Any run of at least
+``PHONE_SEARCH_MIN_DIGITS`` digits from the number finds it too ("0100"
+finds 555-0100): SQLite keeps the digits in a second FTS5 table with the
+trigram tokenizer (SQLite 3.34+), Postgres in its trigram index.
+"""
+import logging
+import re
+from typing import Optional, Tuple
+
+from sqlalchemy import Float, Integer, or_, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Query
+
+from models import Lead
+
+logger = logging.getLogger(__name__)
+
+PHONE_SEARCH_MIN_DIGITS = 3
+# bm25 ranks are small negative numbers; a phone number match sorts before any text match
+PHONE_MATCH_RANK = -1000.0
+
+SQLITE_PHONE_DIGITS = (
+    "replace(replace(replace(replace(replace(replace(coalesce({col}, ''), "
+    "'-', ''), ' ', ''), '(', ''), ')', ''), '.', ''), '+', '')"
+)
+
+SQLITE_DDL = [
+    "CREATE VIRTUAL TABLE IF NOT EXISTS leads_fts USING fts5("
+    "name, email, phone, address, tokenize = 'unicode61 remove_diacritics 2')",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_fts_insert AFTER INSERT ON leads BEGIN
+        INSERT INTO leads_fts(rowid, name, email, phone, address)
+        VALUES (new.id, new.name, new.email, {SQLITE_PHONE_DIGITS.format(col='new.phone')}, new.address);
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS leads_fts_delete AFTER DELETE ON leads BEGIN
+        DELETE FROM leads_fts WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_fts_update AFTER UPDATE OF name, email, phone, address ON leads BEGIN
+        DELETE FROM leads_fts WHERE rowid = old.id;
+        INSERT INTO leads_fts(rowid, name, email, phone, address)
+        VALUES (new.id, new.name, new.email, {SQLITE_PHONE_DIGITS.format(col='new.phone')}, new.address);
+    END""",
+    "CREATE VIRTUAL TABLE IF NOT EXISTS leads_phone_fts USING fts5(phone, tokenize = 'trigram')",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_phone_fts_insert AFTER INSERT ON leads BEGIN
+        INSERT INTO leads_phone_fts(rowid, phone) VALUES (new.id, {SQLITE_PHONE_DIGITS.format(col='new.phone')});
+    END""",
+    """CREATE TRIGGER IF NOT EXISTS leads_phone_fts_delete AFTER DELETE ON leads BEGIN
+        DELETE FROM leads_phone_fts WHERE rowid = old.id;
+    END""",
+    f"""CREATE TRIGGER IF NOT EXISTS leads_phone_fts_update AFTER UPDATE OF phone ON leads BEGIN
+        DELETE FROM leads_phone_fts WHERE rowid = old.id;
+        INSERT INTO leads_phone_fts(rowid, phone) VALUES (new.id, {SQLITE_PHONE_DIGITS.format(col='new.phone')});
+    END""",
+]
+
+SQLITE_REBUILD = [
+    "DELETE FROM leads_fts",
+    f"""INSERT INTO leads_fts(rowid, name, email, phone, address)
+        SELECT id, name, email, {SQLITE_PHONE_DIGITS.format(col='phone')}, address FROM leads""",
+    "DELETE FROM leads_phone_fts",
+    f"""INSERT INTO leads_phone_fts(rowid, phone)
+        SELECT id, {SQLITE_PHONE_DIGITS.format(col='phone')} FROM leads""",
+]
+
+# The query expressions below must match the indexed expressions exactly
+PG_DOCUMENT = "to_tsvector('simple', coalesce(name, '') || ' ' || coalesce(email, '') || ' ' || coalesce(address, ''))"
+PG_PHONE_DIGITS = "regexp_replace(coalesce(phone, ''), '[^0-9]', '', 'g')"
+
+POSTGRES_DDL = [
+    "CREATE EXTENSION IF NOT EXISTS pg_trgm",
+    f"CREATE INDEX IF NOT EXISTS ix_leads_search_document ON leads USING gin ({PG_DOCUMENT})",
+    f"CREATE INDEX IF NOT EXISTS ix_leads_phone_digits_trgm ON leads USING gin (({PG_PHONE_DIGITS}) gin_trgm_ops)",
+]
+
+
+def install(engine: Engine) -> None:
+    """Create the search index for the engine's dialect and backfill it if needed."""
+    if engine.dialect.name == "sqlite":
+        with engine.begin() as conn:
+            for statement in SQLITE_DDL:
+                conn.execute(text(statement))
+            indexed = conn.execute(text("SELECT count(*) FROM leads_fts")).scalar()
+            phones_indexed = conn.execute(text("SELECT count(*) FROM leads_phone_fts")).scalar()
+            total = conn.execute(text("SELECT count(*) FROM leads")).scalar()
+            if indexed != total or phones_indexed != total:
+                logger.info(f"Rebuilding lead search index ({indexed} of {total} leads indexed)")
+                for statement in SQLITE_REBUILD:
+                    conn.execute(text(statement))
+    elif engine.dialect.name == "postgresql":
+        with engine.begin() as conn:
+            for statement in POSTGRES_DDL:
+                conn.execute(text(statement))
+
+
+def normalize_phone(value: str) -> str:
+    return re.sub(r"\D", "", value or "")
+
+
+def _terms(search: str) -> Tuple[list, Optional[str]]:
+    words = re.findall(r"\w+", search.lower())
+    digits = normalize_phone(search)
+    # Only treat the search as a phone number when it contains nothing but digits and separators
+    if len(digits) < PHONE_SEARCH_MIN_DIGITS or re.search(r"[^\d\s().+-]", search):
+        digits = None
+    return words, digits
+
+
+def apply_search(query: Query, search: str) -> Tuple[Query, bool]:
+    """
+    Restrict a ``Lead`` query to leads matching ``search``.
+
+    Returns the filtered query and whether it is already ordered by relevance.
+    """
+    words, digits = _terms(search)
+    if not words:
+        return query.filter(False), False
+
+    dialect = query.session.get_bind().dialect.name
+
+    if dialect == "sqlite":
+        match = " AND ".join(f'"{word}"*' for word in words)
+        statement = "SELECT rowid AS lead_id, bm25(leads_fts) AS rank FROM leads_fts WHERE leads_fts MATCH :match"
+        params = {"match": match}
+        if digits:
+            # A trigram match of the quoted digits is a substring match anywhere in the number
+            statement = (
+                f"SELECT lead_id, min(rank) AS rank FROM ({statement} "
+                "UNION ALL SELECT rowid, :phone_rank FROM leads_phone_fts WHERE leads_phone_fts MATCH :phone) "
+                "GROUP BY lead_id"
+            )
+            params.update(phone=f'"{digits}"', phone_rank=PHONE_MATCH_RANK)
+        ranked = text(statement).bindparams(**params).columns(
+            lead_id=Integer, rank=Float
+        ).subquery("lead_matches")
+        query = query.join(ranked, Lead.id == ranked.c.lead_id).order_by(ranked.c.rank)
+        return query, True
+
+    if dialect == "postgresql":
+        ts_query = " & ".join(f"{word}:*" for word in words)
+        condition = text(f"{PG_DOCUMENT} @@ to_tsquery('simple', :ts_query)").bindparams(ts_query=ts_query)
+        if digits:
+            condition = or_(
+                condition,
+                text(f"{PG_PHONE_DIGITS} LIKE :phone_pattern").bindparams(phone_pattern=f"%{digits}%")
+            )
+        rank = text(f"ts_rank({PG_DOCUMENT}, to_tsquery('simple', :rank_query)) DESC").bindparams(rank_query=ts_query)
+        return query.filter(condition).order_by(rank), True
+
+    return query.filter(
+        or_(
+            Lead.name.contains(search),
+            Lead.email.contains(search),
+            Lead.phone.contains(search),
+            Lead.address.contains(search)
+        )
+    ), False
@@ -0,0 +1,126 @@
+"""
+Content-addressed logo storage.
+
+Uploads are streamed to disk in chunks while being hashed, then stored as
+``{UPLOAD_DIR}/{sha256}{ext}``. Uploading the same image twice, for any
+contractor, stores it once. Resized WebP variants
+(``LOGO_VARIANT_WIDTHS``) are made at upload time in the logo worker
+pool. The widget bootstrap links the ``LOGO_WIDGET_WIDTH`` variant
+instead of the original.
+
+A content-addressed file never changes, so the uploads mount (a
+``CachedStaticFiles`` matching ``CONTENT_ADDRESSED``) serves these files
+with a year-long immutable Cache-Control and the digest as their ETag.
+Other uploads (older uuid-named logos) keep a short max-age and are
+revalidated.
+"""
+import hashlib
+import logging
+import mimetypes
+import os
+import re
+import tempfile
+from dataclasses import dataclass, field
+from typing import BinaryIO, Dict, Optional
+
+from config import settings
+from services import image_variants
+from services.worker_pool import WorkerPool
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+LOGO_EXTENSIONS = {".png", ".jpg", ".jpeg", ".gif", ".webp", ".svg"}
+CONTENT_ADDRESSED = re.compile(r"^([0-9a-f]{64})(-w\d+)?\.[a-z]+$")
+
+
+class LogoError(Exception):
+    pass
+
+
+@dataclass
+class StoredLogo:
+    digest: str
+    url: str
+    variants: Dict[int, str] = field(default_factory=dict)
+
+
+logo_pool = WorkerPool("Logo resize", workers=settings.LOGO_WORKERS, timeout=settings.LOGO_RESIZE_TIMEOUT)
+
+
+def _url(name: str) -> str:
+    return f"/{settings.UPLOAD_DIR}/{name}"
+
+
+def _extension(filename: Optional[str], content_type: Optional[str]) -> str:
+    ext = os.path.splitext(filename or "")[1].lower()
+    if ext not in LOGO_EXTENSIONS:
+        ext = (mimetypes.guess_extension(content_type or "") or "").lower()
+    if ext not in LOGO_EXTENSIONS:
+        raise LogoError("Only PNG, JPEG, GIF, WebP and SVG images are allowed")
+    return ext
+
+
+def store_logo(upload: BinaryIO, filename: Optional[str], content_type: Optional[str]) -> StoredLogo:
+    """Store an uploaded logo and its variants; raises LogoError for files that are not usable logos."""
+    ext = _extension(filename, content_type)
+    digest = hashlib.sha256()
+    size = 0
+    with tempfile.NamedTemporaryFile(dir=settings.UPLOAD_DIR, suffix=".part", delete=False) as tmp:
+        try:
+            while chunk := upload.read(CHUNK_SIZE):
+                size += len(chunk)
+                if size > settings.MAX_UPLOAD_SIZE:
+                    raise LogoError("File too large")
+                digest.update(chunk)
+                tmp.write(chunk)
+        except BaseException:
+            tmp.close()
+            os.remove(tmp.name)
+            raise
+
+    name = f"{digest.hexdigest()}{ext}"
+    path = os.path.join(settings.UPLOAD_DIR, name)
+    created = not os.path.exists(path)
+    if created:
+        os.replace(tmp.name, path)
+    else:
+        os.remove(tmp.name)
+    logo = StoredLogo(digest=digest.hexdigest(), url=_url(name))
+    if ext == ".svg":
+        # Vector logos scale on their own
+        return logo
+
+    try:
+        variants = logo_pool.run(
+            image_variants.make_variants,
+            os.path.abspath(path),
+            logo.digest,
+            settings.LOGO_VARIANT_WIDTHS,
+            settings.LOGO_WEBP_QUALITY,
+            settings.LOGO_MAX_PIXELS
+        )
+    except ValueError as e:
+        if created:
+            os.remove(path)
+        raise LogoError(str(e))
+    logo.variants = {width: _url(variant) for width, variant in variants.items()}
+    logger.info(f"Stored logo {name} ({size} bytes, {'new' if created else 'deduplicated'})")
+    return logo
+
+
+def variant_url(logo_url: Optional[str], width: int) -> Optional[str]:
+    """URL of the logo's ``width`` variant, if the logo is content-addressed and the variant exists."""
+    prefix = f"/{settings.UPLOAD_DIR}/"
+    if not logo_url or not logo_url.startswith(prefix):
+        return None
+    match = CONTENT_ADDRESSED.match(logo_url[len(prefix):])
+    if not match or match.group(2):
+        return None
+    name = f"{match.group(1)}-w{width}.webp"
+    return _url(name) if os.path.exists(os.path.join(settings.UPLOAD_DIR, name)) else None
+
+
+def widget_logo_url(logo_url: Optional[str]) -> Optional[str]:
+    return variant_url(logo_url, settings.LOGO_WIDGET_WIDTH) or logo_url
+
@@ -0,0 +1,233 @@
+"""
+Quote PDF layout.
+
+This module runs in the render pool's worker processes, so it imports
+nothing from the app: ``render`` takes plain dicts (a contractor template
+spec and a quote spec) and returns the PDF bytes. Compiled templates
+(paragraph styles, colors and the decoded logo) are kept per process,
+keyed by the spec's fingerprint, so a contractor's template and logo are
+parsed once per worker rather than once per quote.
+"""
+import io
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, List, Optional
+from xml.sax.saxutils import escape
+
+from reportlab.lib import colors
+from reportlab.lib.enums import TA_RIGHT
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.styles import ParagraphStyle
+from reportlab.lib.units import mm
+from reportlab.lib.utils import ImageReader
+from reportlab.platypus import HRFlowable, KeepTogether, Paragraph, SimpleDocTemplate, Spacer, Table, TableStyle
+
+logger = logging.getLogger(__name__)
+
+# Bump when the layout changes, so stored PDFs are rendered again
+RENDERER_VERSION = 1
+
+MARGIN = 20 * mm
+LOGO_MAX_WIDTH = 45 * mm
+LOGO_MAX_HEIGHT = 18 * mm
+MAX_COMPILED_TEMPLATES = 64
+
+WARRANTY_TEXT = (
+    "Our comprehensive warranty covers materials and workmanship, giving you peace of mind for years to come."
+)
+FINANCING_TEXT = "Flexible payment plans available with competitive rates. Ask about our 0% interest options."
+TESTIMONIALS_TEXT = '"Excellent work and professional service. Highly recommended!" - Recent Customer'
+
+
+def _color(value: Optional[str], default: str) -> colors.Color:
+    try:
+        return colors.HexColor(value or default)
+    except ValueError:
+        return colors.HexColor(default)
+
+
+@dataclass
+class CompiledTemplate:
+    styles: Dict[str, ParagraphStyle]
+    primary: colors.Color
+    highlight: colors.Color
+    logo: Optional[ImageReader]
+    logo_size: tuple
+
+
+def _load_logo(path: Optional[str]):
+    if not path:
+        return None, (0, 0)
+    try:
+        logo = ImageReader(path)
+        width, height = logo.getSize()
+    except Exception as e:
+        # A missing or corrupt logo should not stop the quote going out
+        logger.warning(f"Skipping unreadable logo {path}: {e}")
+        return None, (0, 0)
+    scale = min(LOGO_MAX_WIDTH / width, LOGO_MAX_HEIGHT / height, 1.0)
+    return logo, (width * scale, height * scale)
+
+
+def compile_template(spec: dict) -> CompiledTemplate:
+    primary = _color(spec.get("primary_color"), "#22c55e")
+    body = ParagraphStyle("body", fontName="Helvetica", fontSize=10, leading=14)
+    styles = {
+        "title": ParagraphStyle("title", parent=body, fontName="Helvetica-Bold", fontSize=18, leading=22,
+                                textColor=primary),
+        "body": body,
+        "meta": ParagraphStyle("meta", parent=body, fontSize=9, leading=12, alignment=TA_RIGHT),
+        "heading": ParagraphStyle("heading", parent=body, fontName="Helvetica-Bold", fontSize=12, leading=16,
+                                  spaceBefore=10, spaceAfter=4),
+        "bold": ParagraphStyle("bold", parent=body, fontName="Helvetica-Bold"),
+        "price": ParagraphStyle("price", parent=body, fontName="Helvetica-Bold", alignment=TA_RIGHT),
+        "selected": ParagraphStyle("selected", parent=body, fontName="Helvetica-Bold", fontSize=8, textColor=primary),
+        "italic": ParagraphStyle("italic", parent=body, fontName="Helvetica-Oblique"),
+        "terms": ParagraphStyle("terms", parent=body, fontSize=8, leading=10, textColor=colors.grey)
+    }
+    logo, logo_size = _load_logo(spec.get("logo_path"))
+    return CompiledTemplate(
+        styles=styles,
+        primary=primary,
+        highlight=_color(spec.get("secondary_color"), "#16a34a").clone(alpha=0.12),
+        logo=logo,
+        logo_size=logo_size
+    )
+
+
+_compiled: "OrderedDict[str, CompiledTemplate]" = OrderedDict()
+
+
+def compiled_template(spec: dict) -> CompiledTemplate:
+    fingerprint = spec["fingerprint"]
+    compiled = _compiled.get(fingerprint)
+    if compiled is None:
+        compiled = _compiled[fingerprint] = compile_template(spec)
+        if len(_compiled) > MAX_COMPILED_TEMPLATES:
+            _compiled.popitem(last=False)
+    else:
+        _compiled.move_to_end(fingerprint)
+    return compiled
+
+
+def _text(value) -> str:
+    return escape(str(value)).replace("\n", "<br/>")
+
+
+def _money(value: float) -> str:
+    return f"${value:,.2f}"
+
+
+def _section(compiled: CompiledTemplate, title: str, text: str, style: str = "body") -> list:
+    return [KeepTogether([Paragraph(_text(title), compiled.styles["heading"]),
+                          Paragraph(_text(text), compiled.styles[style])])]
+
+
+def _pricing_table(compiled: CompiledTemplate, spec: dict, quote: dict) -> Table:
+    styles = compiled.styles
+    rows = []
+    commands = [("VALIGN", (0, 0), (-1, -1), "TOP"), ("BOTTOMPADDING", (0, 0), (-1, -1), 6)]
+    for tier, price in quote["prices"].items():
+        tier_spec = spec["tiers"][tier]
+        label = [Paragraph(_text(f"{tier.title()} - {tier_spec['name']}"), styles["bold"]),
+                 Paragraph(_text(f"{tier_spec['warranty']} warranty"), styles["body"])]
+        if tier == quote["selected_tier"]:
+            label.append(Paragraph("YOUR SELECTED OPTION", styles["selected"]))
+        row = len(rows)
+        rows.append([label, Paragraph(_money(price), styles["price"])])
+        if tier == quote["selected_tier"]:
+            commands += [("BACKGROUND", (0, row), (-1, row), compiled.highlight),
+                         ("BOX", (0, row), (-1, row), 1, compiled.primary)]
+        else:
+            commands.append(("BOX", (0, row), (-1, row), 0.5, colors.lightgrey))
+    table = Table(rows, colWidths=["75%", "25%"])
+    table.setStyle(TableStyle(commands))
+    return table
+
+
+def _story(compiled: CompiledTemplate, spec: dict, quote: dict) -> list:
+    styles = compiled.styles
+    header = Table(
+        [[
+            [Paragraph(_text(spec["header_text"]), styles["title"]),
+             Paragraph(_text(spec["company_name"]), styles["body"])],
+            [Spacer(1, compiled.logo_size[1] + 2 * mm if compiled.logo else 0),
+             Paragraph(_text(f"Quote #{quote['number']}"), styles["meta"]),
+             Paragraph(_text(f"Date: {quote['date']}"), styles["meta"])]
+        ]],
+        colWidths=["65%", "35%"]
+    )
+    header.setStyle(TableStyle([("VALIGN", (0, 0), (-1, -1), "TOP"), ("LEFTPADDING", (0, 0), (0, 0), 0),
+                                ("RIGHTPADDING", (-1, 0), (-1, 0), 0)]))
+    story = [header, HRFlowable(width="100%", color=colors.lightgrey, spaceBefore=6, spaceAfter=6)]
+
+    story.append(Paragraph("Customer Information", styles["heading"]))
+    for label, key in (("Name", "customer_name"), ("Email", "customer_email"), ("Phone", "customer_phone")):
+        if quote.get(key):
+            story.append(Paragraph(f"{label}: {_text(quote[key])}", styles["body"]))
+
+    story.append(Paragraph("Property Information", styles["heading"]))
+    for part in quote["address"].split(","):
+        story.append(Paragraph(_text(part.strip()), styles["body"]))
+    story.append(Paragraph(f"Roof Size: {quote['roof_size_sqft']:,.0f} sq ft", styles["body"]))
+
+    story.append(Paragraph("Pricing Options", styles["heading"]))
+    story.append(_pricing_table(compiled, spec, quote))
+    extras = [(label, quote[key]) for label, key in (("Tear-off", "removal_cost"), ("Permit", "permit_cost"))
+              if quote.get(key)]
+    if extras:
+        story.append(Paragraph(
+            "Your selected option includes " + ", ".join(f"{label.lower()} {_money(value)}" for label, value in extras),
+            styles["body"]
+        ))
+
+    if spec["show_warranty"]:
+        story += _section(compiled, "Warranty Information", WARRANTY_TEXT)
+    if spec["show_financing"]:
+        story += _section(compiled, "Financing Options", FINANCING_TEXT)
+    if spec["show_testimonials"]:
+        story += _section(compiled, "Customer Testimonials", TESTIMONIALS_TEXT, style="italic")
+    if spec.get("custom_message"):
+        message = Table([[Paragraph(_text(spec["custom_message"]), styles["body"])]], colWidths=["100%"])
+        message.setStyle(TableStyle([("BACKGROUND", (0, 0), (-1, -1), colors.whitesmoke)]))
+        story += [Spacer(1, 4 * mm), message]
+
+    services: List[str] = spec.get("included_services") or []
+    if services:
+        story.append(Paragraph("Included Services", styles["heading"]))
+        story += [Paragraph(f"&bull; {_text(service)}", styles["body"]) for service in services]
+
+    story.append(HRFlowable(width="100%", color=colors.lightgrey, spaceBefore=10, spaceAfter=6))
+    story.append(Paragraph(_text(spec["footer_text"]), styles["body"]))
+    if spec.get("terms_conditions"):
+        story += [Spacer(1, 2 * mm), Paragraph(_text(spec["terms_conditions"]), styles["terms"])]
+    return story
+
+
+def render(spec: dict, quote: dict) -> bytes:
+    """PDF bytes for ``quote`` laid out with the contractor template ``spec``."""
+    compiled = compiled_template(spec)
+    buffer = io.BytesIO()
+    doc = SimpleDocTemplate(
+        buffer,
+        pagesize=A4,
+        leftMargin=MARGIN,
+        rightMargin=MARGIN,
+        topMargin=MARGIN,
+        bottomMargin=MARGIN,
+        title=f"Quote #{quote['number']}",
+        author=spec["company_name"],
+        creator="Roof Quote Pro",
+        # Fixed timestamps and document id: identical input gives identical bytes
+        invariant=True
+    )
+
+    def first_page(canvas, doc):
+        if compiled.logo is not None:
+            width, height = compiled.logo_size
+            canvas.drawImage(compiled.logo, A4[0] - MARGIN - width, A4[1] - MARGIN - height,
+                             width=width, height=height, mask="auto")
+
+    doc.build(_story(compiled, spec, quote), onFirstPage=first_page)
+    return buffer.getvalue()
@@ -0,0 +1,148 @@
+"""
+Quote pricing.
+
+Every price the API returns is computed here so quotes, calculations and
+repricing agree to the cent. Money is rounded half-up to cents with
+Decimal, per line item, and totals are the sum of the rounded items, so a
+quote's items always add up to its total.
+
+Prices are computed column-wise: the per-tier rates are resolved once per
+price sheet and then applied to whole lists of roof sizes or to every
+tier/option combination of a what-if grid in one pass.
+"""
+from dataclasses import dataclass
+from decimal import ROUND_HALF_UP, Decimal
+from itertools import product
+from typing import Dict, Iterable, List, Optional, Sequence
+
+from models import Pricing
+
+TIERS = ("good", "better", "best")
+
+CENT = Decimal("0.01")
+
+
+def round_money(value) -> float:
+    return float(Decimal(repr(value)).quantize(CENT, rounding=ROUND_HALF_UP))
+
+
+def _pricing_value(pricing: Optional[Pricing], name: str):
+    # An unsaved Pricing has no column defaults applied yet
+    value = getattr(pricing, name, None)
+    if value is None:
+        value = Pricing.__table__.c[name].default.arg
+    return value
+
+
+@dataclass(frozen=True)
+class PriceSheet:
+    rates: Dict[str, float]
+    names: Dict[str, str]
+    warranties: Dict[str, str]
+    removal_rate: float
+    permit_price: float
+
+    @classmethod
+    def from_pricing(cls, pricing: Optional[Pricing]) -> "PriceSheet":
+        """Price sheet for a contractor; missing values fall back to the Pricing defaults."""
+        return cls(
+            rates={tier: _pricing_value(pricing, f"{tier}_tier_price") for tier in TIERS},
+            names={tier: _pricing_value(pricing, f"{tier}_tier_name") for tier in TIERS},
+            warranties={tier: _pricing_value(pricing, f"{tier}_tier_warranty") for tier in TIERS},
+            removal_rate=_pricing_value(pricing, "removal_price"),
+            permit_price=_pricing_value(pricing, "permit_price")
+        )
+
+
+@dataclass(frozen=True)
+class PriceBreakdown:
+    tier: str
+    roof_size_sqft: float
+    base_price: float
+    removal_cost: float
+    permit_cost: float
+    total_price: float
+
+    def as_dict(self) -> dict:
+        return {
+            "base_price": self.base_price,
+            "removal_cost": self.removal_cost,
+            "permit_cost": self.permit_cost,
+            "total_price": self.total_price
+        }
+
+
+def price_batch(
+    sheet: PriceSheet,
+    roof_sizes: Sequence[float],
+    tier: str,
+    include_removal: bool = True,
+    include_permit: bool = True
+) -> List[PriceBreakdown]:
+    """Price many roofs at one tier, e.g. to reprice stored quotes."""
+    if tier not in sheet.rates:
+        raise ValueError(f"Unknown tier {tier!r}")
+    rate = sheet.rates[tier]
+    removal_rate = sheet.removal_rate if include_removal else 0
+    permit = round_money(sheet.permit_price if include_permit else 0)
+
+    base = [round_money(size * rate) for size in roof_sizes]
+    removal = [round_money(size * removal_rate) for size in roof_sizes]
+    return [
+        PriceBreakdown(tier, size, b, r, permit, round_money(b + r + permit))
+        for size, b, r in zip(roof_sizes, base, removal)
+    ]
+
+
+def price_options(
+    sheet: PriceSheet,
+    roof_size_sqft: float,
+    include_removal: bool = True,
+    include_permit: bool = True,
+    tiers: Iterable[str] = TIERS
+) -> Dict[str, PriceBreakdown]:
+    """Every tier for one roof. Removal and permit are computed once and shared."""
+    removal = round_money(roof_size_sqft * sheet.removal_rate) if include_removal else 0.0
+    permit = round_money(sheet.permit_price) if include_permit else 0.0
+    prices = {}
+    for tier in tiers:
+        base = round_money(roof_size_sqft * sheet.rates[tier])
+        prices[tier] = PriceBreakdown(tier, roof_size_sqft, base, removal, permit, round_money(base + removal + permit))
+    return prices
+
+
+def price_grid(
+    sheet: PriceSheet,
+    roof_size_sqft: float,
+    tiers: Iterable[str] = TIERS,
+    removal_options: Iterable[bool] = (True, False),
+    permit_options: Iterable[bool] = (True, False),
+    pitch_multipliers: Iterable[float] = (1.0,)
+) -> List[dict]:
+    """
+    What-if grid for one roof: tiers x removal x permit x pitch multipliers.
+
+    A pitch multiplier scales the roof area, e.g. 1.12 for a steeper roof
+    than measured.
+    """
+    tiers = list(tiers)
+    permit_cost = {option: round_money(sheet.permit_price) if option else 0.0 for option in permit_options}
+    rows = []
+    for multiplier in pitch_multipliers:
+        size = roof_size_sqft * multiplier
+        base = {tier: round_money(size * sheet.rates[tier]) for tier in tiers}
+        removal = {option: round_money(size * sheet.removal_rate) if option else 0.0 for option in removal_options}
+        for tier, include_removal, include_permit in product(tiers, removal, permit_cost):
+            total = round_money(base[tier] + removal[include_removal] + permit_cost[include_permit])
+            rows.append({
+                "tier": tier,
+                "include_removal": include_removal,
+                "include_permit": include_permit,
+                "pitch_multiplier": multiplier,
+                "roof_size_sqft": round_money(size),
+                "base_price": base[tier],
+                "removal_cost": removal[include_removal],
+                "permit_cost": permit_cost[include_permit],
+                "total_price": total
+            })
+    return rows
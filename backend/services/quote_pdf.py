@@ -0,0 +1,212 @@
+"""
+Quote PDFs rendered on the server.
+
+A quote's PDF combines the contractor's Template, Branding and Pricing
+rows (the template spec) with the quote and its lead. Each piece is
+cached in a different way:
+
+- The template spec lives in the shared cache under the contractor's
+  namespace. Any change to those rows retires it in every worker, and
+  the logo's digest is computed only when the spec is rebuilt.
+- Render workers keep the compiled template (styles and the decoded
+  logo) per spec fingerprint. See ``pdf_renderer``.
+- Rendered files are stored as ``{PDF_DIR}/{quote_id}/{digest}.pdf``,
+  where the digest covers everything drawn on the page. Repeat downloads
+  and emails reuse the same file and bytes. Editing the quote, the lead
+  or the template changes the digest, so the next request renders a new
+  file and removes the old ones from the quote's directory.
+
+Serving a PDF writes nothing to the database; callers that send the PDF
+somewhere record ``StoredPdf.url`` on the quote themselves.
+
+Rendering is CPU-bound, so it runs in a worker pool of
+``PDF_RENDER_WORKERS`` processes, off the API workers' GIL.
+"""
+import hashlib
+import json
+import logging
+import os
+import threading
+from concurrent.futures import Future
+from dataclasses import dataclass
+from typing import Dict, Optional
+
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import Branding, Contractor, Lead, Pricing, Quote, Template, utcnow
+from services import pdf_renderer, pricing_engine
+from services.cache import shared_cache
+from services.worker_pool import WorkerPool, WorkerPoolError
+
+logger = logging.getLogger(__name__)
+
+
+class RenderError(Exception):
+    pass
+
+
+@dataclass(frozen=True)
+class StoredPdf:
+    quote_id: int
+    digest: str
+    path: str
+
+    @property
+    def url(self) -> str:
+        # The digest in the URL lets clients cache each version for good
+        return f"/api/quotes/{self.quote_id}/pdf?v={self.digest}"
+
+    @property
+    def etag(self) -> str:
+        return f'"{self.digest}"'
+
+
+def _digest(value: dict) -> str:
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode()).hexdigest()
+
+
+def _logo_file(logo_url: Optional[str]) -> Optional[str]:
+    # Only logos uploaded to this server are drawn; remote URLs are not fetched while rendering
+    prefix = f"/{settings.UPLOAD_DIR}/"
+    if not logo_url or not logo_url.startswith(prefix):
+        return None
+    path = os.path.abspath(os.path.join(settings.UPLOAD_DIR, os.path.basename(logo_url)))
+    return path if os.path.isfile(path) else None
+
+
+def _file_digest(path: str) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(65536), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def build_template_spec(db: Session, contractor_id: int) -> dict:
+    contractor = db.get(Contractor, contractor_id)
+    template = db.query(Template).filter(Template.contractor_id == contractor_id).first() or Template()
+    branding = db.query(Branding).filter(Branding.contractor_id == contractor_id).first() or Branding()
+    pricing = db.query(Pricing).filter(Pricing.contractor_id == contractor_id).first()
+    sheet = pricing_engine.PriceSheet.from_pricing(pricing)
+    logo_path = _logo_file(branding.logo_url)
+    spec = {
+        "company_name": contractor.company_name if contractor else "Professional Roofing Services",
+        "header_text": template.header_text or "Professional Roof Quote",
+        "footer_text": template.footer_text or "Thank you for choosing us!",
+        "show_warranty": template.show_warranty is not False,
+        "show_financing": template.show_financing is not False,
+        "show_testimonials": template.show_testimonials is not False,
+        "custom_message": template.custom_message,
+        "terms_conditions": template.terms_conditions,
+        "included_services": template.included_services
+        if template.included_services is not None
+        else Template.__table__.c.included_services.default.arg,
+        "primary_color": branding.primary_color,
+        "secondary_color": branding.secondary_color,
+        "logo_path": logo_path,
+        "logo_sha256": _file_digest(logo_path) if logo_path else None,
+        "tiers": {tier: {"name": sheet.names[tier], "warranty": sheet.warranties[tier]} for tier in pricing_engine.TIERS}
+    }
+    spec["fingerprint"] = _digest(spec)
+    return spec
+
+
+def template_spec(db: Session, contractor_id: int) -> dict:
+    value = shared_cache.get_or_load(
+        "pdf_template",
+        "spec",
+        lambda: json.dumps(build_template_spec(db, contractor_id)).encode(),
+        contractor_id=contractor_id,
+        ttl=settings.PDF_TEMPLATE_CACHE_TTL
+    )
+    return json.loads(value)
+
+
+def quote_spec(quote: Quote, lead: Lead) -> dict:
+    created = quote.created_at or utcnow()
+    prices: Dict[str, float] = {}
+    for tier in pricing_engine.TIERS:
+        price = quote.total_price if tier == quote.selected_tier else getattr(quote, f"{tier}_tier_price")
+        if price is not None:
+            prices[tier] = price
+    return {
+        "id": quote.id,
+        "number": f"{created.year}-{quote.id:03d}",
+        "date": created.strftime("%m/%d/%Y"),
+        "customer_name": lead.name,
+        "customer_email": lead.email,
+        "customer_phone": lead.phone,
+        "address": quote.address,
+        "roof_size_sqft": quote.roof_size_sqft,
+        "selected_tier": quote.selected_tier,
+        "prices": prices,
+        "removal_cost": quote.removal_cost,
+        "permit_cost": quote.permit_cost,
+        "total_price": quote.total_price
+    }
+
+
+render_pool = WorkerPool("PDF render", workers=settings.PDF_RENDER_WORKERS, timeout=settings.PDF_RENDER_TIMEOUT)
+
+_inflight: Dict[str, Future] = {}
+_inflight_lock = threading.Lock()
+
+
+def _write(path: str, spec: dict, quote: dict) -> None:
+    # Concurrent requests for the same file wait for one render
+    with _inflight_lock:
+        future = _inflight.get(path)
+        leader = future is None
+        if leader:
+            future = _inflight[path] = Future()
+    if not leader:
+        future.result()
+        return
+
+    try:
+        try:
+            pdf = render_pool.run(pdf_renderer.render, spec, quote)
+        except WorkerPoolError as e:
+            raise RenderError(str(e))
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(pdf)
+        os.replace(tmp_path, path)
+        future.set_result(None)
+    except Exception as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(path, None)
+
+    # Only this quote's directory is listed, usually just the file written above
+    directory, current = os.path.split(path)
+    for name in os.listdir(directory):
+        if name.endswith(".pdf") and name != current:
+            try:
+                os.remove(os.path.join(directory, name))
+            except FileNotFoundError:
+                pass
+
+
+def stored_pdf(db: Session, quote: Quote) -> StoredPdf:
+    """The quote's PDF file, rendered if its content changed."""
+    lead = db.get(Lead, quote.lead_id) if quote.lead_id is not None else None
+    if lead is None:
+        raise RenderError(f"Quote {quote.id} has no lead")
+    spec = template_spec(db, lead.contractor_id)
+    content = quote_spec(quote, lead)
+    digest = _digest({
+        "renderer": pdf_renderer.RENDERER_VERSION,
+        "template": spec["fingerprint"],
+        "quote": content
+    })[:16]
+    directory = os.path.join(settings.PDF_DIR, str(quote.id))
+    pdf = StoredPdf(quote_id=quote.id, digest=digest, path=os.path.join(directory, f"{digest}.pdf"))
+    if not os.path.exists(pdf.path):
+        os.makedirs(directory, exist_ok=True)
+        _write(pdf.path, spec, content)
+        logger.info(f"Rendered PDF for quote {quote.id} ({digest})")
+    return pdf
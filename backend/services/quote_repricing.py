@@ -0,0 +1,338 @@
+"""
+Re-prices a contractor's open quotes after their pricing changes.
+
+Jobs are rows in ``repricing_jobs``. A background worker picks them up in
+order and walks the contractor's open quotes (leads not yet converted or
+lost) in primary key order, one chunk per transaction:
+
+- the chunk is read with a keyset query, so memory stays flat however
+  many quotes there are;
+- prices are recomputed by the pricing engine from the stored roof size
+  and options;
+- quotes whose options are unknown (widget captures store neither the
+  options nor an itemized tear-off or permit) are skipped and counted in
+  ``skipped_quotes`` rather than repriced on a guess;
+- changed rows are written back with a single bulk UPDATE by primary key,
+  and their previous prices are appended to ``quote_data["price_history"]``.
+
+Progress (including the keyset position) is committed with every chunk,
+so a job interrupted by a restart resumes where it stopped.
+
+Every API worker runs the repricer, so a job is claimed with a lease
+(``locked_until``/``claim_token``) like rollup compaction, and the lease
+is renewed with every chunk. A ``running`` job is only resumed by another
+worker once its lease has run out, and a contractor never has two jobs
+running at once. A worker that finds its lease taken over stops without
+committing the chunk in hand.
+"""
+import asyncio
+import logging
+import uuid
+from datetime import timedelta
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from sqlalchemy import and_, exists, func, or_, select, update
+from sqlalchemy.orm import Session, aliased
+
+from config import settings
+from database import SessionLocal
+from models import Lead, Pricing, Quote, RepricingJob, utcnow
+from services import pricing_engine
+from services.analytics_rollup import mark_dirty
+
+logger = logging.getLogger(__name__)
+
+OPEN_LEAD_STATUSES = ("new", "contacted", "quoted")
+
+PRICE_FIELDS = [f"{tier}_tier_price" for tier in pricing_engine.TIERS] + ["removal_price", "permit_price"]
+
+PRICE_HISTORY_LIMIT = 10
+
+
+def price_changes(pricing: Pricing, update_data: Dict) -> Dict:
+    """The price fields ``update_data`` actually changes, as {field: [old, new]}."""
+    return {
+        field: [getattr(pricing, field), value]
+        for field, value in update_data.items()
+        if field in PRICE_FIELDS and getattr(pricing, field) != value
+    }
+
+
+def enqueue(db: Session, contractor_id: int, changed_fields: Optional[Dict] = None) -> RepricingJob:
+    """Queue a job for the contractor, folding into one that has not started yet; the caller commits."""
+    job = db.query(RepricingJob).filter(
+        RepricingJob.contractor_id == contractor_id,
+        RepricingJob.status == "pending"
+    ).first()
+    if job is not None:
+        job.changed_fields = {**(job.changed_fields or {}), **(changed_fields or {})}
+        return job
+    job = RepricingJob(contractor_id=contractor_id, status="pending", changed_fields=changed_fields or {})
+    db.add(job)
+    return job
+
+
+def job_status(job: RepricingJob) -> dict:
+    elapsed = None
+    if job.started_at is not None:
+        finished = job.finished_at or utcnow()
+        elapsed = (_aware(finished) - _aware(job.started_at)).total_seconds()
+    return {
+        "id": job.id,
+        "contractor_id": job.contractor_id,
+        "status": job.status,
+        "changed_fields": job.changed_fields,
+        "total_quotes": job.total_quotes,
+        "processed_quotes": job.processed_quotes,
+        "updated_quotes": job.updated_quotes,
+        "skipped_quotes": job.skipped_quotes or 0,
+        "progress": round(job.processed_quotes / job.total_quotes, 4) if job.total_quotes else (
+            1.0 if job.status == "completed" else 0.0
+        ),
+        "quotes_per_second": round(job.processed_quotes / elapsed, 1) if elapsed else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at
+    }
+
+
+def _aware(value):
+    # SQLite hands back naive datetimes; they were written in UTC
+    return value if value.tzinfo is not None else value.replace(tzinfo=utcnow().tzinfo)
+
+
+def _open_quotes(contractor_id: int):
+    return (
+        select(
+            Quote.id, Quote.roof_size_sqft, Quote.selected_tier, Quote.quote_data, Quote.base_price,
+            Quote.removal_cost, Quote.permit_cost, Quote.total_price, Quote.good_tier_price,
+            Quote.better_tier_price, Quote.best_tier_price, Quote.created_at, Lead.created_at.label("lead_created_at")
+        )
+        .join(Lead, Quote.lead_id == Lead.id)
+        .where(Lead.contractor_id == contractor_id, Lead.status.in_(OPEN_LEAD_STATUSES))
+    )
+
+
+def _quoted_options(row) -> Optional[Tuple[bool, bool]]:
+    """(include_removal, include_permit) the quote was priced with, or None when unknown."""
+    quote_data = row.quote_data or {}
+    options = []
+    for option, cost in (("include_removal", row.removal_cost), ("include_permit", row.permit_cost)):
+        if option in quote_data:
+            options.append(bool(quote_data[option]))
+        elif cost:
+            # An itemized cost means the option was taken; a zero cost may just mean nothing was itemized
+            options.append(True)
+        else:
+            return None
+    return options[0], options[1]
+
+
+def _reprice(sheet: pricing_engine.PriceSheet, row, job_id: int, now) -> Optional[dict]:
+    """New column values for one quote, or None when its prices did not change."""
+    quote_data = dict(row.quote_data or {})
+    include_removal, include_permit = _quoted_options(row)
+    prices = pricing_engine.price_options(sheet, row.roof_size_sqft, include_removal, include_permit)
+    selected = prices.get(row.selected_tier)
+    values = {f"{tier}_tier_price": price.total_price for tier, price in prices.items()}
+    if selected is not None:
+        values.update(selected.as_dict())
+
+    previous = {name: getattr(row, name) for name in values}
+    if previous == values:
+        return None
+
+    history = list(quote_data.get("price_history", []))
+    history.append({"repriced_at": now.isoformat(), "job_id": job_id, **previous})
+    quote_data["price_history"] = history[-PRICE_HISTORY_LIMIT:]
+    return {"id": row.id, "quote_data": quote_data, **values}
+
+
+def _mark_rollups_dirty(db: Session, contractor_id: int, rows: Iterable) -> None:
+    # Bulk UPDATEs bypass the flush listener that normally records these
+    days = set()
+    for row in rows:
+        days.add(row.created_at)
+        days.add(row.lead_created_at)
+    for day in days:
+        mark_dirty(db, contractor_id, day)
+
+
+def _claimable(now):
+    """Jobs a worker may take: pending, or running under a lease that has run out."""
+    other = aliased(RepricingJob)
+    contractor_busy = exists().where(
+        other.contractor_id == RepricingJob.contractor_id,
+        other.id != RepricingJob.id,
+        other.status == "running",
+        other.locked_until >= now
+    )
+    lease_expired = or_(RepricingJob.locked_until.is_(None), RepricingJob.locked_until < now)
+    return and_(
+        or_(RepricingJob.status == "pending", and_(RepricingJob.status == "running", lease_expired)),
+        ~contractor_busy
+    )
+
+
+def _lease_expiry():
+    return utcnow() + timedelta(seconds=settings.REPRICING_LEASE_SECONDS)
+
+
+def claim_job(db: Session, job_id: int, token: str) -> bool:
+    """Lease the job to ``token``; False when it is finished or another worker holds it."""
+    result = db.execute(
+        update(RepricingJob)
+        .where(RepricingJob.id == job_id, _claimable(utcnow()))
+        .values(status="running", locked_until=_lease_expiry(), claim_token=token)
+        .execution_options(synchronize_session=False)
+    )
+    db.commit()
+    return result.rowcount == 1
+
+
+def _save(db: Session, job_id: int, token: str, **values) -> bool:
+    """Write job columns and renew the lease; False when another worker has taken the job over."""
+    result = db.execute(
+        update(RepricingJob)
+        .where(RepricingJob.id == job_id, RepricingJob.claim_token == token)
+        .values(**{"locked_until": _lease_expiry(), **values})
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount == 1
+
+
+def run_job(job_id: int, chunk_size: int = settings.REPRICING_CHUNK_SIZE) -> None:
+    db = SessionLocal()
+    token = uuid.uuid4().hex
+    try:
+        if not claim_job(db, job_id, token):
+            return
+        job = db.get(RepricingJob, job_id)
+        contractor_id = job.contractor_id
+        sheet = pricing_engine.PriceSheet.from_pricing(
+            db.query(Pricing).filter(Pricing.contractor_id == contractor_id).first()
+        )
+        if job.started_at is None:
+            total = db.execute(
+                select(func.count()).select_from(_open_quotes(contractor_id).subquery())
+            ).scalar()
+            _save(db, job_id, token, started_at=utcnow(), total_quotes=total)
+            db.commit()
+
+        last_quote_id = job.last_quote_id or 0
+        processed = job.processed_quotes or 0
+        updated = job.updated_quotes or 0
+        # Jobs created before the column existed read it back as NULL
+        skipped = job.skipped_quotes or 0
+        while True:
+            rows = db.execute(
+                _open_quotes(contractor_id)
+                .where(Quote.id > last_quote_id)
+                .order_by(Quote.id)
+                .limit(chunk_size)
+            ).all()
+            if not rows:
+                break
+
+            now = utcnow()
+            changed: List[dict] = []
+            changed_rows = []
+            for row in rows:
+                if _quoted_options(row) is None:
+                    skipped += 1
+                    continue
+                values = _reprice(sheet, row, job_id, now)
+                if values is not None:
+                    changed.append(values)
+                    changed_rows.append(row)
+            if changed:
+                db.execute(update(Quote), changed)
+                _mark_rollups_dirty(db, contractor_id, changed_rows)
+
+            last_quote_id = rows[-1].id
+            processed += len(rows)
+            updated += len(changed)
+            if not _save(db, job_id, token, last_quote_id=last_quote_id, processed_quotes=processed,
+                         updated_quotes=updated, skipped_quotes=skipped):
+                db.rollback()
+                logger.warning(f"Repricing job {job_id} was taken over by another worker; stopping")
+                return
+            db.commit()
+
+        _save(db, job_id, token, status="completed", finished_at=utcnow(), locked_until=None, claim_token=None)
+        db.commit()
+        logger.info(
+            f"Repricing job {job_id} for contractor {contractor_id}: "
+            f"{updated} of {processed} quotes updated, {skipped} skipped with unknown options"
+        )
+    except Exception as e:
+        db.rollback()
+        logger.error(f"Repricing job {job_id} failed: {e}", exc_info=True)
+        _save(db, job_id, token, status="failed", error=str(e), finished_at=utcnow(), locked_until=None,
+              claim_token=None)
+        db.commit()
+    finally:
+        db.close()
+
+
+def _next_job_id() -> Optional[int]:
+    db = SessionLocal()
+    try:
+        return db.execute(
+            select(RepricingJob.id)
+            .where(_claimable(utcnow()))
+            .order_by(RepricingJob.id)
+            .limit(1)
+        ).scalar()
+    finally:
+        db.close()
+
+
+class QuoteRepricer:
+    """Runs queued repricing jobs one at a time for the lifetime of the app."""
+
+    def __init__(self, poll_interval: float):
+        self.poll_interval = poll_interval
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def wake(self) -> None:
+        """Start on a newly queued job now instead of at the next poll; safe to call from any thread."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                job_id = await asyncio.to_thread(_next_job_id)
+            except Exception as e:
+                logger.error(f"Could not poll for repricing jobs: {e}")
+                job_id = None
+            if job_id is not None:
+                # A job left "running" by a crashed worker resumes from its keyset position once its lease runs out
+                await asyncio.to_thread(run_job, job_id)
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+quote_repricer = QuoteRepricer(poll_interval=settings.REPRICING_POLL_INTERVAL)
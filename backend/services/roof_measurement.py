@@ -0,0 +1,308 @@
+"""
+Roof measurements by address.
+
+A measurement is produced by the first configured provider that knows the
+address (``ROOF_MEASUREMENT_PROVIDERS``, in order):
+
+- ``footprints``: the imported building footprint store (see
+  services/building_footprints.py), matched by the building nearest the
+  given coordinates or by address.
+- ``eagleview``: the mock EagleView report, derived from the address.
+- ``heuristic``: the size estimate quotes have always used, derived from
+  the address instead of drawn at random.
+
+Every provider is deterministic for a given address, and results are
+stored in ``roof_measurement_cache`` keyed by the normalized address, so
+repeat quotes for the same house never re-measure until the entry expires.
+
+Heuristic guesses are only a fallback, so they are kept for the short
+``ROOF_MEASUREMENT_FALLBACK_TTL_SECONDS`` instead of the full TTL, and
+importing footprints forgets them at once (``forget_fallbacks``). An entry
+measured without coordinates is also re-measured when a request brings
+coordinates, unless it already came from a footprint.
+
+The cache entry is written in a savepoint of the caller's session; the
+caller commits it along with its own work.
+"""
+import hashlib
+import logging
+import random
+from dataclasses import dataclass, field
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import delete
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import begin_nested
+from models import RoofMeasurementCache, utcnow
+from services import building_footprints
+from services.geo import normalize_address, normalize_pitch
+
+logger = logging.getLogger(__name__)
+
+
+def address_rng(normalized_address: str, salt: str) -> random.Random:
+    """A random generator seeded by the address, so every process draws the same values."""
+    digest = hashlib.sha256(f"{salt}:{normalized_address}".encode()).digest()
+    return random.Random(int.from_bytes(digest[:8], "big"))
+
+
+@dataclass
+class Measurement:
+    provider: str
+    roof_size_sqft: float
+    complexity: str
+    pitch: str
+    home_sqft: Optional[float] = None
+    details: Dict = field(default_factory=dict)
+
+    @property
+    def squares(self) -> float:
+        return round(self.roof_size_sqft / 100, 2)
+
+    def as_roof_data(self) -> dict:
+        """The shape the quote endpoints have always returned as roof details."""
+        return {
+            "roof_size_sqft": round(self.roof_size_sqft, 2),
+            "squares": self.squares,
+            "complexity": self.complexity,
+            "pitch": self.pitch,
+            "home_sqft": self.home_sqft,
+            "measurement_provider": self.provider
+        }
+
+
+class MeasurementProvider:
+    """
+    Measures a roof from a normalized address, or returns None when it cannot.
+
+    ``location`` is the geocoded (lat, lng) of the address when the caller
+    has it.
+    """
+
+    name = ""
+
+    def measure(
+        self, db: Session, normalized_address: str, location: Optional[Tuple[float, float]] = None
+    ) -> Optional[Measurement]:
+        raise NotImplementedError
+
+
+class FootprintProvider(MeasurementProvider):
+    """Building footprints imported into the local footprint store."""
+
+    name = "footprints"
+
+    def __init__(self, search_radius_m: float):
+        self.search_radius_m = search_radius_m
+
+    def measure(
+        self, db: Session, normalized_address: str, location: Optional[Tuple[float, float]] = None
+    ) -> Optional[Measurement]:
+        footprint = None
+        if location is not None:
+            footprint = building_footprints.nearest(db, location[0], location[1], self.search_radius_m)
+        if footprint is None:
+            footprint = building_footprints.find_by_address(db, normalized_address)
+        if footprint is None:
+            return None
+
+        vertices = footprint.vertices
+        return Measurement(
+            provider=self.name,
+            roof_size_sqft=footprint.roof_area_sqft,
+            complexity="simple" if vertices <= 4 else "moderate" if vertices <= 8 else "complex",
+            pitch=footprint.pitch,
+            home_sqft=footprint.area_sqft,
+            details={
+                "footprint_id": footprint.source_id,
+                "footprint_sqft": footprint.area_sqft,
+                "vertices": vertices,
+                "distance_m": round(footprint.distance_m, 2)
+            }
+        )
+
+
+class EagleViewMockProvider(MeasurementProvider):
+    """Stand-in for an EagleView report; the report is derived from the address."""
+
+    name = "eagleview"
+
+    def report(self, normalized_address: str) -> dict:
+        rng = address_rng(normalized_address, self.name)
+        base_sqft = rng.randint(1800, 3200)
+        report_id = rng.randint(100000, 999999)
+        return {
+            "report_id": f"EV_{report_id}",
+            "measurements": {
+                "total_roof_area": base_sqft,
+                "main_roof_area": int(base_sqft * 0.75),
+                "garage_roof_area": int(base_sqft * 0.25),
+                "pitch": rng.choice(["4/12", "6/12", "8/12", "10/12"]),
+                "number_of_facets": rng.randint(4, 12),
+                "edge_length": rng.randint(180, 320),
+                "ridge_length": rng.randint(40, 80),
+                "valley_length": rng.randint(20, 60),
+                "hip_length": rng.randint(30, 70)
+            },
+            "imagery": {
+                view: f"https://mock-eagleview.com/images/{report_id}/{view.split('_')[0]}.jpg"
+                for view in ("top_down_url", "north_url", "south_url", "east_url", "west_url")
+            },
+            "confidence_score": round(rng.uniform(0.85, 0.99), 4)
+        }
+
+    def measure(
+        self, db: Session, normalized_address: str, location: Optional[Tuple[float, float]] = None
+    ) -> Optional[Measurement]:
+        report = self.report(normalized_address)
+        measurements = report["measurements"]
+        facets = measurements["number_of_facets"]
+        return Measurement(
+            provider=self.name,
+            roof_size_sqft=measurements["total_roof_area"],
+            complexity="simple" if facets <= 5 else "moderate" if facets <= 8 else "complex",
+            pitch=measurements["pitch"],
+            details={"report_id": report["report_id"], "confidence_score": report["confidence_score"]}
+        )
+
+
+class HeuristicProvider(MeasurementProvider):
+    """Typical home sizes with a complexity factor; always has an answer."""
+
+    name = "heuristic"
+
+    def measure(
+        self, db: Session, normalized_address: str, location: Optional[Tuple[float, float]] = None
+    ) -> Optional[Measurement]:
+        rng = address_rng(normalized_address, self.name)
+        base_sqft = rng.randint(1500, 3500)
+        complexity_factor = rng.choice([1.0, 1.15, 1.25])
+        complexity = "simple" if complexity_factor == 1.0 else "moderate" if complexity_factor == 1.15 else "complex"
+        return Measurement(
+            provider=self.name,
+            roof_size_sqft=base_sqft * complexity_factor,
+            complexity=complexity,
+            pitch=rng.choice(["4/12", "6/12", "8/12", "10/12"]),
+            home_sqft=base_sqft
+        )
+
+
+FALLBACK_PROVIDERS = (HeuristicProvider.name,)
+
+
+class RoofMeasurementService:
+    """Runs the provider chain and memoizes results in ``roof_measurement_cache``."""
+
+    def __init__(self, providers: List[MeasurementProvider], cache_ttl: timedelta, fallback_ttl: timedelta):
+        self.providers = providers
+        self.cache_ttl = cache_ttl
+        self.fallback_ttl = fallback_ttl
+
+    def measure(self, db: Session, address: str, location: Optional[Tuple[float, float]] = None) -> Measurement:
+        """Measure ``address``, from the cache when possible; the caller commits the new cache entry."""
+        key = normalize_address(address)
+        cached = db.query(RoofMeasurementCache).filter(RoofMeasurementCache.normalized_address == key).first()
+        if cached is not None and self._usable(cached, location):
+            return self._from_row(cached)
+
+        measurement = self._measure(db, key, location)
+        now = utcnow()
+        ttl = self.fallback_ttl if measurement.provider in FALLBACK_PROVIDERS else self.cache_ttl
+        values = {
+            "address": address,
+            "provider": measurement.provider,
+            "roof_size_sqft": round(measurement.roof_size_sqft, 2),
+            "squares": measurement.squares,
+            "complexity": measurement.complexity,
+            "pitch": measurement.pitch,
+            "home_sqft": measurement.home_sqft,
+            "measurement_data": measurement.details,
+            "used_location": location is not None,
+            "measured_at": now,
+            "expires_at": now + ttl
+        }
+        try:
+            # A savepoint keeps a concurrent insert of the same address from failing the caller's transaction
+            with begin_nested(db):
+                if cached is None:
+                    db.add(RoofMeasurementCache(normalized_address=key, **values))
+                else:
+                    for name, value in values.items():
+                        setattr(cached, name, value)
+        except IntegrityError:
+            logger.debug(f"Roof measurement for {key!r} was cached concurrently")
+        return measurement
+
+    def forget_fallbacks(self, db: Session) -> int:
+        """Drop cached heuristic guesses, e.g. after importing footprints; the caller commits."""
+        result = db.execute(
+            delete(RoofMeasurementCache).where(RoofMeasurementCache.provider.in_(FALLBACK_PROVIDERS))
+        )
+        return result.rowcount
+
+    def _usable(self, row: RoofMeasurementCache, location: Optional[Tuple[float, float]]) -> bool:
+        if self._aware(row.expires_at) <= utcnow():
+            return False
+        # Coordinates can find a footprint the address alone did not
+        return location is None or bool(row.used_location) or row.provider == FootprintProvider.name
+
+    def _measure(self, db: Session, normalized_address: str, location: Optional[Tuple[float, float]]) -> Measurement:
+        for provider in self.providers:
+            try:
+                measurement = provider.measure(db, normalized_address, location)
+            except Exception as e:
+                logger.error(f"Roof measurement provider {provider.name} failed: {e}", exc_info=True)
+                continue
+            if measurement is not None:
+                measurement.pitch = normalize_pitch(measurement.pitch)
+                return measurement
+        # The heuristic always answers, so an unconfigured chain still produces a quote
+        return HeuristicProvider().measure(db, normalized_address)
+
+    @staticmethod
+    def _aware(value):
+        # SQLite hands back naive datetimes; they were written in UTC
+        return value if value.tzinfo is not None else value.replace(tzinfo=utcnow().tzinfo)
+
+    @staticmethod
+    def _from_row(row: RoofMeasurementCache) -> Measurement:
+        return Measurement(
+            provider=row.provider,
+            roof_size_sqft=row.roof_size_sqft,
+            complexity=row.complexity,
+            pitch=row.pitch,
+            home_sqft=row.home_sqft,
+            details=row.measurement_data or {}
+        )
+
+
+eagleview_provider = EagleViewMockProvider()
+
+PROVIDERS = {
+    FootprintProvider.name: lambda: FootprintProvider(settings.FOOTPRINT_SEARCH_RADIUS_M),
+    EagleViewMockProvider.name: lambda: eagleview_provider,
+    HeuristicProvider.name: HeuristicProvider
+}
+
+
+def build_providers(names: str) -> List[MeasurementProvider]:
+    providers = []
+    for name in (name.strip() for name in names.split(",")):
+        if not name:
+            continue
+        if name not in PROVIDERS:
+            logger.warning(f"Unknown roof measurement provider {name!r} ignored")
+            continue
+        providers.append(PROVIDERS[name]())
+    return providers
+
+
+roof_measurement = RoofMeasurementService(
+    providers=build_providers(settings.ROOF_MEASUREMENT_PROVIDERS),
+    cache_ttl=timedelta(days=settings.ROOF_MEASUREMENT_CACHE_TTL_DAYS),
+    fallback_ttl=timedelta(seconds=settings.ROOF_MEASUREMENT_FALLBACK_TTL_SECONDS)
+)
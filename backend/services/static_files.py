@@ -0,0 +1,42 @@
+"""
+Static files with explicit browser and CDN caching.
+
+Files whose name carries a content hash never change, so they are served
+with a long immutable Cache-Control and their name as a strong ETag.
+Anything that is overwritten in place gets a short max-age and is
+revalidated.
+"""
+import os
+from re import Pattern
+
+from fastapi.staticfiles import StaticFiles
+from starlette.datastructures import Headers
+from starlette.responses import FileResponse, Response
+from starlette.staticfiles import NotModifiedResponse
+
+
+class CachedStaticFiles(StaticFiles):
+    """Serves ``directory``; names matching ``immutable`` are cached for good, the rest for ``max_age`` seconds."""
+
+    def __init__(self, *, immutable: Pattern, max_age: int, immutable_max_age: int,
+                 allow_any_origin: bool = False, **kwargs):
+        super().__init__(**kwargs)
+        self.immutable = immutable
+        self.max_age = max_age
+        self.immutable_max_age = immutable_max_age
+        self.allow_any_origin = allow_any_origin
+
+    def file_response(self, full_path, stat_result: os.stat_result, scope, status_code: int = 200) -> Response:
+        response = FileResponse(full_path, status_code=status_code, stat_result=stat_result)
+        name = os.path.basename(full_path)
+        if self.immutable.match(name):
+            response.headers["etag"] = f'"{os.path.splitext(name)[0]}"'
+            response.headers["cache-control"] = f"public, max-age={self.immutable_max_age}, immutable"
+        else:
+            response.headers["cache-control"] = f"public, max-age={self.max_age}"
+        if self.allow_any_origin:
+            # Public files read by scripts running on contractors' own sites
+            response.headers["access-control-allow-origin"] = "*"
+        if self.is_not_modified(response.headers, Headers(scope=scope)):
+            return NotModifiedResponse(response.headers)
+        return response
@@ -0,0 +1,134 @@
+"""
+HTML pages (template preview, email bodies) rendered from Jinja2 templates.
+
+Templates live in ``backend/templates`` and are autoescaped. A page is
+rendered in two stages:
+
+1. Everything that belongs to the contractor (company details, the quote
+   template, branding) is rendered once. The parts that differ per
+   recipient are written as ``{{ slot("name") }}`` and left open. The
+   result is a ``CompiledPage``: the static HTML split around its slots.
+2. For each recipient, ``CompiledPage.render`` escapes the slot values
+   and joins them with the static parts. No template code runs here.
+
+Compiled pages are cached in-process under the contractor's shared cache
+version. Any committed change to the contractor's Contractor, Template or
+Branding row retires them in every worker.
+"""
+import logging
+import re
+import threading
+import uuid
+from collections import OrderedDict
+from pathlib import Path
+from typing import Callable, List, Optional, Tuple
+
+from jinja2 import Environment, FileSystemLoader, select_autoescape
+from markupsafe import Markup, escape
+from sqlalchemy.orm import Session
+
+from config import settings
+from models import Branding, Contractor, Template
+from services.cache import shared_cache
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_DIR = Path(__file__).parent.parent / "templates"
+
+environment = Environment(
+    loader=FileSystemLoader(TEMPLATE_DIR),
+    autoescape=select_autoescape(default=True),
+    trim_blocks=True,
+    lstrip_blocks=True,
+    # Templates ship with the code; never stat them again after the first load
+    auto_reload=False
+)
+
+# Random per process, so no contractor text can pose as a slot
+_SLOT_TOKEN = uuid.uuid4().hex
+_SLOT_PATTERN = re.compile(f"\x00{_SLOT_TOKEN}:(\\w+)\x00")
+
+HEX_COLOR = re.compile(r"^#[0-9a-fA-F]{3}([0-9a-fA-F]{3})?$")
+
+
+def _slot(name: str) -> Markup:
+    return Markup(f"\x00{_SLOT_TOKEN}:{name}\x00")
+
+
+class CompiledPage:
+    """A page rendered up to its per-recipient slots."""
+
+    def __init__(self, html: str):
+        pieces = _SLOT_PATTERN.split(html)
+        self.parts: List[str] = pieces[0::2]
+        self.slots: List[str] = pieces[1::2]
+
+    def render(self, **values) -> str:
+        """The page with each slot replaced by its escaped value."""
+        out = [self.parts[0]]
+        for name, part in zip(self.slots, self.parts[1:]):
+            out.append(escape(values[name]))
+            out.append(part)
+        return "".join(out)
+
+
+def compile_page(name: str, **context) -> CompiledPage:
+    return CompiledPage(environment.get_template(name).render(slot=_slot, **context))
+
+
+_pages: "OrderedDict[Tuple, CompiledPage]" = OrderedDict()
+_pages_lock = threading.Lock()
+
+
+def cached_page(key: Tuple, build: Callable[[], Optional[CompiledPage]]) -> Optional[CompiledPage]:
+    with _pages_lock:
+        page = _pages.get(key)
+        if page is not None:
+            _pages.move_to_end(key)
+            return page
+    # Two threads may both build on a miss; compiling is idempotent, so that is only wasted work
+    page = build()
+    if page is not None:
+        with _pages_lock:
+            _pages[key] = page
+            if len(_pages) > settings.TEMPLATE_PAGE_CACHE_SIZE:
+                _pages.popitem(last=False)
+    return page
+
+
+def page(name: str) -> CompiledPage:
+    """A page that does not depend on the contractor."""
+    return cached_page((name,), lambda: compile_page(name))
+
+
+def brand_color(value: Optional[str], default: str = "#22c55e") -> str:
+    # Colors go into inline CSS, where HTML escaping does not help
+    return value if value and HEX_COLOR.match(value) else default
+
+
+def contractor_context(db: Session, contractor_id: int) -> Optional[dict]:
+    contractor = db.query(Contractor).filter(Contractor.id == contractor_id).first()
+    if contractor is None:
+        return None
+    template = db.query(Template).filter(Template.contractor_id == contractor_id).first()
+    branding = db.query(Branding).filter(Branding.contractor_id == contractor_id).first()
+    return {
+        "contractor": contractor,
+        "template": template,
+        "branding": branding,
+        "primary_color": brand_color(branding.primary_color if branding else None)
+    }
+
+
+def contractor_page(db: Session, name: str, contractor_id: int) -> Optional[CompiledPage]:
+    """``name`` compiled for the contractor, or None when the contractor does not exist."""
+    def build() -> Optional[CompiledPage]:
+        context = contractor_context(db, contractor_id)
+        return compile_page(name, **context) if context is not None else None
+
+    try:
+        version = shared_cache.version(contractor_id)
+    except shared_cache.backend.errors as e:
+        logger.warning(f"Cache version read failed for contractor {contractor_id}: {e}")
+        return build()
+    return cached_page((name, contractor_id, version), build)
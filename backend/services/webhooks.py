@@ -0,0 +1,339 @@
+"""
+Durable webhook delivery.
+
+Events are written to the ``webhook_deliveries`` outbox in the same
+transaction as the change that caused them. A lead or quote that commits
+therefore always gets its event, and a rolled back one never does. New
+leads and quotes flushed through an ORM session emit ``lead.created`` and
+``quote.created`` automatically. Bulk Core inserts (lead import) do not.
+
+A background worker claims due deliveries in batches and posts them with
+one shared, pooled HTTP client. Attempts are capped per destination host.
+A failed attempt is retried with exponential backoff and jitter. After
+``WEBHOOK_MAX_ATTEMPTS`` attempts, or on 410 Gone, the delivery is
+dead-lettered with its last error, and can be requeued through the API.
+
+Claims are leases (``locked_until``), so several workers can share the
+outbox, and deliveries claimed by a crashed worker are picked up again
+once the lease runs out.
+"""
+import asyncio
+import logging
+import random
+import uuid
+from datetime import timedelta
+from typing import Dict, List, Optional, Tuple
+from urllib.parse import urlsplit
+
+import httpx
+from sqlalchemy import event, insert, or_, select, update
+from sqlalchemy.orm import Session
+
+from config import settings
+from database import SessionLocal
+from models import Lead, Quote, Webhook, WebhookDelivery, utcnow
+
+logger = logging.getLogger(__name__)
+
+LEAD_FIELDS = (
+    "id", "contractor_id", "name", "email", "phone", "address", "best_time_to_call", "additional_notes",
+    "status", "source"
+)
+QUOTE_FIELDS = (
+    "id", "lead_id", "address", "roof_size_sqft", "roof_pitch", "selected_tier", "good_tier_price",
+    "better_tier_price", "best_tier_price", "base_price", "removal_cost", "permit_cost", "total_price"
+)
+
+
+def delivery_status(delivery: WebhookDelivery) -> dict:
+    return {
+        "id": delivery.id,
+        "webhook_id": delivery.webhook_id,
+        "event_type": delivery.event_type,
+        "url": delivery.url,
+        "status": delivery.status,
+        "attempts": delivery.attempts,
+        "next_attempt_at": delivery.next_attempt_at,
+        "last_status_code": delivery.last_status_code,
+        "last_error": delivery.last_error,
+        "created_at": delivery.created_at,
+        "delivered_at": delivery.delivered_at
+    }
+
+
+def _delivery_rows(connection, events: List[Tuple[int, str, dict]]) -> List[dict]:
+    contractor_ids = {contractor_id for contractor_id, _, _ in events}
+    event_types = {event_type for _, event_type, _ in events}
+    hooks: Dict[Tuple[int, str], tuple] = {
+        (row.contractor_id, row.event_type): row
+        for row in connection.execute(
+            select(Webhook.id, Webhook.contractor_id, Webhook.event_type, Webhook.url).where(
+                Webhook.active.is_(True),
+                Webhook.contractor_id.in_(contractor_ids),
+                Webhook.event_type.in_(event_types)
+            )
+        )
+    }
+    now = utcnow()
+    rows = []
+    for contractor_id, event_type, data in events:
+        hook = hooks.get((contractor_id, event_type))
+        if hook is None:
+            continue
+        rows.append({
+            "webhook_id": hook.id,
+            "contractor_id": contractor_id,
+            "event_type": event_type,
+            "url": hook.url,
+            "payload": {"event": event_type, "timestamp": now.isoformat(), "data": data},
+            "status": "pending",
+            "attempts": 0,
+            "next_attempt_at": now,
+            "created_at": now
+        })
+    return rows
+
+
+def enqueue(db: Session, contractor_id: int, event_type: str, data: dict) -> Optional[int]:
+    """Queue one event for the contractor's webhook, if one is active; the caller commits."""
+    rows = _delivery_rows(db.connection(), [(contractor_id, event_type, data)])
+    if not rows:
+        return None
+    delivery = WebhookDelivery(**rows[0])
+    db.add(delivery)
+    db.flush()
+    db.info["webhooks_enqueued"] = True
+    return delivery.id
+
+
+def _lead_contractor_id(connection, quote: Quote) -> Optional[int]:
+    if quote.lead is not None:
+        return quote.lead.contractor_id
+    if quote.lead_id is None:
+        return None
+    return connection.execute(select(Lead.contractor_id).where(Lead.id == quote.lead_id)).scalar()
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _emit_created_events(db: Session, flush_context) -> None:
+    new = [obj for obj in db.new if isinstance(obj, (Lead, Quote))]
+    if not new:
+        return
+    connection = db.connection()
+    events = []
+    for obj in new:
+        if isinstance(obj, Lead):
+            events.append((obj.contractor_id, "lead.created", {f: getattr(obj, f) for f in LEAD_FIELDS}))
+        else:
+            contractor_id = _lead_contractor_id(connection, obj)
+            if contractor_id is not None:
+                events.append((contractor_id, "quote.created", {f: getattr(obj, f) for f in QUOTE_FIELDS}))
+    rows = _delivery_rows(connection, events) if events else []
+    if rows:
+        # Core insert on the flush's connection: the outbox rows commit or roll back with the lead
+        connection.execute(insert(WebhookDelivery), rows)
+        db.info["webhooks_enqueued"] = True
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _wake_dispatcher(db: Session) -> None:
+    if db.info.pop("webhooks_enqueued", False):
+        webhook_dispatcher.wake()
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_wakeup(db: Session) -> None:
+    db.info.pop("webhooks_enqueued", None)
+
+
+def backoff_seconds(attempts: int) -> float:
+    delay = min(settings.WEBHOOK_BACKOFF_BASE * 2 ** (attempts - 1), settings.WEBHOOK_BACKOFF_MAX)
+    # Full jitter between half and all of the delay spreads retries to a recovering host
+    return delay * random.uniform(0.5, 1.0)
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    value = response.headers.get("retry-after", "")
+    return float(value) if value.isdigit() else None
+
+
+def claim_batch(limit: int) -> List[WebhookDelivery]:
+    """Lease up to ``limit`` due deliveries to this worker."""
+    db = SessionLocal()
+    try:
+        now = utcnow()
+        token = uuid.uuid4().hex
+        due = (
+            select(WebhookDelivery.id)
+            .where(
+                WebhookDelivery.status == "pending",
+                WebhookDelivery.next_attempt_at <= now,
+                or_(WebhookDelivery.locked_until.is_(None), WebhookDelivery.locked_until < now)
+            )
+            .order_by(WebhookDelivery.next_attempt_at)
+            .limit(limit)
+        )
+        ids = list(db.execute(due).scalars())
+        if not ids:
+            return []
+        # Another worker may have leased some of them meanwhile; the lease check decides
+        db.execute(
+            update(WebhookDelivery)
+            .where(
+                WebhookDelivery.id.in_(ids),
+                or_(WebhookDelivery.locked_until.is_(None), WebhookDelivery.locked_until < now)
+            )
+            .values(
+                locked_until=now + timedelta(seconds=settings.WEBHOOK_LEASE_SECONDS),
+                claim_token=token
+            )
+        )
+        db.commit()
+        deliveries = list(db.execute(
+            select(WebhookDelivery).where(WebhookDelivery.claim_token == token)
+        ).scalars())
+        db.expunge_all()
+        return deliveries
+    finally:
+        db.close()
+
+
+def record_results(results: List[dict]) -> None:
+    db = SessionLocal()
+    try:
+        db.execute(update(WebhookDelivery), results)
+        db.commit()
+    finally:
+        db.close()
+
+
+def http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class WebhookDispatcher:
+    """Delivers queued webhooks for the lifetime of the app."""
+
+    def __init__(self, poll_interval: float, batch_size: int, per_host_concurrency: int):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self.per_host_concurrency = per_host_concurrency
+        self.client: Optional[httpx.AsyncClient] = None
+        self._hosts: Dict[str, asyncio.Semaphore] = {}
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        if self._task is not None:
+            return
+        http2 = settings.WEBHOOK_HTTP2 and http2_available()
+        if settings.WEBHOOK_HTTP2 and not http2:
+            logger.warning("WEBHOOK_HTTP2 is set but the h2 package is not installed; using HTTP/1.1")
+        self.client = httpx.AsyncClient(
+            http2=http2,
+            timeout=settings.WEBHOOK_TIMEOUT,
+            limits=httpx.Limits(
+                max_connections=settings.WEBHOOK_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.WEBHOOK_MAX_CONNECTIONS
+            ),
+            headers={"User-Agent": "RoofQuotePro-Webhooks/1.0"}
+        )
+        self._loop = asyncio.get_running_loop()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.client is not None:
+            await self.client.aclose()
+            self.client = None
+
+    def wake(self) -> None:
+        """Deliver newly queued events now instead of at the next poll; safe to call from any thread."""
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _host_limit(self, url: str) -> asyncio.Semaphore:
+        host = urlsplit(url).netloc.lower()
+        if host not in self._hosts:
+            self._hosts[host] = asyncio.Semaphore(self.per_host_concurrency)
+        return self._hosts[host]
+
+    async def deliver(self, delivery: WebhookDelivery) -> dict:
+        attempts = delivery.attempts + 1
+        result = {
+            "id": delivery.id,
+            "attempts": attempts,
+            "locked_until": None,
+            "claim_token": None,
+            "last_status_code": None
+        }
+        retry_after = None
+        async with self._host_limit(delivery.url):
+            try:
+                response = await self.client.post(
+                    delivery.url,
+                    json={"id": delivery.id, **delivery.payload},
+                    headers={"X-Webhook-Event": delivery.event_type, "X-Webhook-Delivery": str(delivery.id)}
+                )
+                result["last_status_code"] = response.status_code
+                if response.is_success:
+                    return {**result, "status": "delivered", "delivered_at": utcnow(), "last_error": None}
+                result["last_error"] = f"HTTP {response.status_code}"
+                retry_after = _retry_after(response)
+                if response.status_code == 410:
+                    # The receiver says the endpoint is gone for good
+                    return {**result, "status": "dead"}
+            except httpx.HTTPError as e:
+                result["last_error"] = f"{type(e).__name__}: {e}"[:1000]
+
+        if attempts >= settings.WEBHOOK_MAX_ATTEMPTS:
+            logger.warning(f"Webhook delivery {delivery.id} to {delivery.url} dead after {attempts} attempts")
+            return {**result, "status": "dead"}
+        delay = max(backoff_seconds(attempts), min(retry_after or 0, settings.WEBHOOK_BACKOFF_MAX))
+        return {**result, "status": "pending", "next_attempt_at": utcnow() + timedelta(seconds=delay)}
+
+    async def run_once(self) -> int:
+        deliveries = await asyncio.to_thread(claim_batch, self.batch_size)
+        if not deliveries:
+            return 0
+        results = await asyncio.gather(*(self.deliver(delivery) for delivery in deliveries))
+        # executemany needs the same keys in every row
+        keys = set().union(*results)
+        await asyncio.to_thread(record_results, [
+            {key: result.get(key, getattr(delivery, key)) for key in keys}
+            for delivery, result in zip(deliveries, results)
+        ])
+        return len(deliveries)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                delivered = await self.run_once()
+            except Exception as e:
+                logger.error(f"Webhook dispatch failed: {e}", exc_info=True)
+                delivered = 0
+            if delivered:
+                continue
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+
+
+webhook_dispatcher = WebhookDispatcher(
+    poll_interval=settings.WEBHOOK_POLL_INTERVAL,
+    batch_size=settings.WEBHOOK_BATCH_SIZE,
+    per_host_concurrency=settings.WEBHOOK_PER_HOST_CONCURRENCY
+)
@@ -0,0 +1,391 @@
+"""
+Static, versioned widget config bundles.
+
+Every widget gets a directory under ``WIDGET_BUNDLE_DIR``, served at
+``/widget-bundles/{widget_id}/``:
+
+- ``config.{version}.json``: the widget payload (the same JSON as
+  ``/api/widget/data``). ``version`` is a hash of its bytes, so a file
+  never changes and is cached by browsers and CDNs for good.
+- ``loader.js``: the script the embed code includes. It names the current
+  config version, starts fetching it at once, then adds the widget element
+  and ``widget.js``. It is the only file that changes in place, so it gets
+  the short ``WIDGET_LOADER_MAX_AGE``.
+- ``embed.json``: the embed snippets shown in the dashboard, built once
+  per publish instead of per request.
+
+Bundles are rebuilt after any commit that changes a contractor, its
+pricing, branding or widget settings, and for every widget when the app
+starts. Publishing runs on the ``widget_bundle_publisher`` task, off the
+request path. Files that did not change are not rewritten. The last
+``WIDGET_BUNDLE_KEEP_VERSIONS`` configs are kept so that loaders still
+cached by browsers can fetch the version they name.
+
+Every API worker publishes the commits it makes. With several hosts,
+``WIDGET_BUNDLE_DIR`` must be storage they share (or a CDN origin they
+all write to).
+"""
+import asyncio
+import hashlib
+import html
+import json
+import logging
+import os
+import re
+import shutil
+import tempfile
+import threading
+from typing import Optional, Set
+
+from sqlalchemy import event, inspect
+from sqlalchemy.orm import Session, joinedload
+
+from config import settings
+from database import SessionLocal
+from models import Branding, Contractor, Pricing, WidgetSettings
+from services import logo_storage
+
+logger = logging.getLogger(__name__)
+
+BUNDLE_PATH = "/widget-bundles"
+BUNDLE_MODELS = (Contractor, Pricing, Branding, WidgetSettings)
+CONFIG_NAME = re.compile(r"^config\.([0-9a-f]{16})\.json$")
+SAFE_WIDGET_ID = re.compile(r"^[A-Za-z0-9_-]+$")
+LOADER_SETTINGS = ("position", "button_text", "auto_open", "delay_seconds")
+
+LOADER_JS = """(function () {
+    var widget = %s;
+    var registry = window.RoofQuoteWidget = window.RoofQuoteWidget || {};
+    // Fetch the config while widget.js downloads; widget.js reads it from here
+    registry[widget.widgetId] = fetch(widget.configUrl).then(function (response) {
+        return response.json();
+    });
+
+    function mount() {
+        var element = document.createElement('div');
+        element.id = 'roof-quote-widget';
+        element.setAttribute('data-widget-id', widget.widgetId);
+        element.setAttribute('data-config-url', widget.configUrl);
+        element.setAttribute('data-position', widget.settings.position);
+        element.setAttribute('data-button-text', widget.settings.button_text);
+        element.setAttribute('data-auto-open', String(widget.settings.auto_open));
+        element.setAttribute('data-delay', String(widget.settings.delay_seconds));
+        document.body.appendChild(element);
+
+        var script = document.createElement('script');
+        script.src = widget.scriptUrl;
+        script.async = true;
+        document.head.appendChild(script);
+    }
+
+    if (document.body) {
+        mount();
+    } else {
+        document.addEventListener('DOMContentLoaded', mount);
+    }
+})();
+"""
+
+
+def build_widget_payload(contractor: Contractor) -> dict:
+    pricing = contractor.pricing or Pricing(contractor_id=contractor.id)
+    branding = contractor.branding or Branding(contractor_id=contractor.id)
+    settings = contractor.widget_settings or WidgetSettings(contractor_id=contractor.id)
+
+    return {
+        "contractor": {
+            "company_name": contractor.company_name,
+            "email": contractor.email,
+            "phone": contractor.phone,
+            "website": contractor.website
+        },
+        "pricing": {
+            "good": {
+                "name": pricing.good_tier_name,
+                "price": pricing.good_tier_price,
+                "warranty": pricing.good_tier_warranty
+            },
+            "better": {
+                "name": pricing.better_tier_name,
+                "price": pricing.better_tier_price,
+                "warranty": pricing.better_tier_warranty
+            },
+            "best": {
+                "name": pricing.best_tier_name,
+                "price": pricing.best_tier_price,
+                "warranty": pricing.best_tier_warranty
+            },
+            "removal_price": pricing.removal_price,
+            "permit_price": pricing.permit_price
+        },
+        "branding": {
+            "logo_url": logo_storage.widget_logo_url(branding.logo_url),
+            "primary_color": branding.primary_color,
+            "secondary_color": branding.secondary_color,
+            "accent_color": branding.accent_color,
+            "font_family": branding.font_family
+        },
+        "settings": {
+            "position": settings.position,
+            "button_text": settings.button_text,
+            "auto_open": settings.auto_open,
+            "delay_seconds": settings.delay_seconds,
+            "show_on_mobile": settings.show_on_mobile,
+            "custom_css": settings.custom_css
+        }
+    }
+
+
+def bundle_url(widget_id: str, name: str) -> str:
+    return f"{settings.WIDGET_BUNDLE_BASE_URL}{BUNDLE_PATH}/{widget_id}/{name}"
+
+
+def _bundle_dir(widget_id: str) -> Optional[str]:
+    # widget_id becomes a directory name; anything that could leave WIDGET_BUNDLE_DIR is not published
+    if not SAFE_WIDGET_ID.match(widget_id or ""):
+        return None
+    return os.path.join(settings.WIDGET_BUNDLE_DIR, widget_id)
+
+
+def _write(directory: str, name: str, content: bytes) -> bool:
+    """Atomically write ``content`` to ``directory/name`` unless it is already there; returns True if written."""
+    path = os.path.join(directory, name)
+    try:
+        with open(path, "rb") as existing:
+            if existing.read() == content:
+                return False
+    except FileNotFoundError:
+        pass
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=f".{name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as tmp:
+            tmp.write(content)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+    return True
+
+
+def _prune(directory: str, keep: int) -> None:
+    configs = []
+    for name in os.listdir(directory):
+        if CONFIG_NAME.match(name):
+            try:
+                configs.append((os.path.getmtime(os.path.join(directory, name)), name))
+            except FileNotFoundError:
+                pass
+    for _, name in sorted(configs, reverse=True)[max(keep, 1):]:
+        try:
+            os.remove(os.path.join(directory, name))
+        except FileNotFoundError:
+            pass
+
+
+def embed_code(widget_id: str, version: str, widget_settings: dict) -> dict:
+    position = html.escape(widget_settings["position"] or "bottom-right")
+    iframe_code = f"""
+<!-- Roof Quote Pro Widget -->
+<iframe
+    src="{settings.WIDGET_EMBED_URL}?id={widget_id}"
+    style="position: fixed; {position.replace('-', ': 20px; ')}: 20px; width: 400px; height: 600px; border: none; z-index: 9999;"
+    allow="geolocation">
+</iframe>
+"""
+
+    script_code = f"""
+<!-- Roof Quote Pro Widget Script -->
+<script async src="{bundle_url(widget_id, 'loader.js')}"></script>
+"""
+
+    return {
+        "widget_id": widget_id,
+        "version": version,
+        "loader_url": bundle_url(widget_id, "loader.js"),
+        "config_url": bundle_url(widget_id, f"config.{version}.json"),
+        "iframe_code": iframe_code,
+        "script_code": script_code
+    }
+
+
+def publish(contractor: Contractor) -> Optional[dict]:
+    """Write the contractor's bundle; returns its embed code, or None if the widget id cannot be published."""
+    directory = _bundle_dir(contractor.widget_id)
+    if directory is None:
+        logger.warning(f"Not publishing a widget bundle for contractor {contractor.id}: unsafe widget id")
+        return None
+    os.makedirs(directory, exist_ok=True)
+
+    payload = build_widget_payload(contractor)
+    config = json.dumps(payload, separators=(",", ":")).encode()
+    version = hashlib.sha256(config).hexdigest()[:16]
+    config_name = f"config.{version}.json"
+    embed = embed_code(contractor.widget_id, version, payload["settings"])
+    loader = LOADER_JS % json.dumps({
+        "widgetId": contractor.widget_id,
+        "version": version,
+        "configUrl": embed["config_url"],
+        "scriptUrl": settings.WIDGET_SCRIPT_URL,
+        "settings": {key: payload["settings"][key] for key in LOADER_SETTINGS}
+    }, indent=4).replace("\n", "\n    ")
+
+    # Config first: a loader must never name a config that is not there yet
+    if _write(directory, config_name, config):
+        logger.info(f"Published widget bundle {contractor.widget_id} version {version}")
+    else:
+        # Unchanged, but now the newest; keep it out of the next prune
+        os.utime(os.path.join(directory, config_name))
+    _write(directory, "loader.js", loader.encode())
+    _write(directory, "embed.json", json.dumps(embed, indent=2).encode())
+    _prune(directory, settings.WIDGET_BUNDLE_KEEP_VERSIONS)
+    return embed
+
+
+def publish_contractor(db: Session, contractor_id: int) -> Optional[dict]:
+    contractor = db.query(Contractor).options(
+        joinedload(Contractor.pricing),
+        joinedload(Contractor.branding),
+        joinedload(Contractor.widget_settings)
+    ).filter(Contractor.id == contractor_id).first()
+    return publish(contractor) if contractor else None
+
+
+def retire(widget_id: str) -> None:
+    """Remove the bundle of a deleted widget id."""
+    directory = _bundle_dir(widget_id)
+    if directory is not None and os.path.isdir(directory):
+        shutil.rmtree(directory, ignore_errors=True)
+        logger.info(f"Removed widget bundle {widget_id}")
+
+
+def published_embed_code(widget_id: str) -> Optional[dict]:
+    directory = _bundle_dir(widget_id)
+    if directory is None:
+        return None
+    try:
+        with open(os.path.join(directory, "embed.json"), "rb") as f:
+            return json.loads(f.read())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _all_contractor_ids() -> Set[int]:
+    db = SessionLocal()
+    try:
+        return {contractor_id for (contractor_id,) in db.query(Contractor.id)}
+    finally:
+        db.close()
+
+
+class WidgetBundlePublisher:
+    """Rebuilds the bundles of changed widgets for the lifetime of the app."""
+
+    def __init__(self, debounce: float):
+        self.debounce = debounce
+        self._pending: Set[int] = set()
+        self._retired: Set[str] = set()
+        self._lock = threading.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._wakeup = asyncio.Event()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._loop = asyncio.get_running_loop()
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    def request(self, contractor_ids=(), retired_widget_ids=()) -> None:
+        """Queue bundles to rebuild or remove; safe to call from any thread."""
+        with self._lock:
+            self._pending.update(contractor_ids)
+            self._retired.update(retired_widget_ids)
+        if self._loop is not None and not self._loop.is_closed():
+            self._loop.call_soon_threadsafe(self._wakeup.set)
+
+    def _take(self):
+        with self._lock:
+            pending, self._pending = self._pending, set()
+            retired, self._retired = self._retired, set()
+        return pending, retired
+
+    def _publish_all(self, contractor_ids: Set[int], retired: Set[str]) -> Set[int]:
+        for widget_id in retired:
+            retire(widget_id)
+        failed = set()
+        db = SessionLocal()
+        try:
+            for contractor_id in sorted(contractor_ids):
+                try:
+                    publish_contractor(db, contractor_id)
+                except Exception as e:
+                    logger.error(f"Could not publish the widget bundle of contractor {contractor_id}: {e}")
+                    db.rollback()
+                    failed.add(contractor_id)
+        finally:
+            db.close()
+        return failed
+
+    async def _run(self) -> None:
+        try:
+            self.request(await asyncio.to_thread(_all_contractor_ids))
+        except Exception as e:
+            logger.error(f"Could not list widgets to publish: {e}")
+        while True:
+            await self._wakeup.wait()
+            # Let a burst of saves (pricing, then branding, then settings) settle into one publish
+            await asyncio.sleep(self.debounce)
+            self._wakeup.clear()
+            pending, retired = self._take()
+            if not pending and not retired:
+                continue
+            failed = await asyncio.to_thread(self._publish_all, pending, retired)
+            if failed:
+                # Retried after the next change, or at the latest on the next start
+                with self._lock:
+                    self._pending.update(failed)
+
+
+widget_bundle_publisher = WidgetBundlePublisher(debounce=settings.WIDGET_BUNDLE_DEBOUNCE)
+
+
+@event.listens_for(SessionLocal, "after_flush")
+def _collect_changed_bundles(db: Session, flush_context) -> None:
+    pending: Set[int] = db.info.setdefault("widget_bundles_changed", set())
+    retired: Set[str] = db.info.setdefault("widget_bundles_retired", set())
+    for obj in list(db.new) + list(db.dirty) + list(db.deleted):
+        if not isinstance(obj, BUNDLE_MODELS):
+            continue
+        if obj in db.dirty and not db.is_modified(obj):
+            continue
+        if isinstance(obj, Contractor):
+            if obj in db.deleted:
+                retired.add(obj.widget_id)
+                continue
+            retired.update(inspect(obj).attrs.widget_id.history.deleted or ())
+            pending.add(obj.id)
+        elif obj.contractor_id is not None:
+            pending.add(obj.contractor_id)
+
+
+@event.listens_for(SessionLocal, "after_commit")
+def _publish_changed_bundles(db: Session) -> None:
+    pending = db.info.pop("widget_bundles_changed", set())
+    retired = db.info.pop("widget_bundles_retired", set())
+    if pending or retired:
+        widget_bundle_publisher.request(pending, retired)
+
+
+@event.listens_for(SessionLocal, "after_rollback")
+def _discard_changed_bundles(db: Session) -> None:
+    db.info.pop("widget_bundles_changed", None)
+    db.info.pop("widget_bundles_retired", None)
@@ -0,0 +1,75 @@
+import hashlib
+import json
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+from config import settings
+from services.cache import SharedCache, shared_cache
+
+
+@dataclass
+class CachedWidgetData:
+    contractor_id: int
+    body: bytes
+    etag: str
+
+    def to_bytes(self) -> bytes:
+        return self.etag.encode() + b"\n" + self.body
+
+    @classmethod
+    def from_bytes(cls, contractor_id: int, value: bytes) -> "CachedWidgetData":
+        etag, body = value.split(b"\n", 1)
+        return cls(contractor_id=contractor_id, body=body, etag=etag.decode())
+
+
+def encode_payload(contractor_id: int, payload: dict) -> CachedWidgetData:
+    body = json.dumps(payload, separators=(",", ":")).encode()
+    return CachedWidgetData(contractor_id=contractor_id, body=body, etag=f'"{hashlib.sha1(body).hexdigest()}"')
+
+
+class WidgetDataCache:
+    """
+    Cache for the widget bootstrap payload, keyed by widget_id.
+
+    Entries are serialized once so cache hits return the stored bytes as-is.
+    They live in the contractor's namespace of the shared cache, so any
+    settings change retires them in every worker. The widget_id to
+    contractor mapping never changes and is cached on its own.
+    """
+
+    def __init__(self, cache: SharedCache, ttl_seconds: int):
+        self.cache = cache
+        self.ttl_seconds = ttl_seconds
+
+    def owner(self, widget_id: str) -> Optional[int]:
+        value = self.cache.get("widget_owner", widget_id)
+        return int(value) if value is not None else None
+
+    def set_owner(self, widget_id: str, contractor_id: int) -> None:
+        self.cache.set("widget_owner", widget_id, str(contractor_id).encode(), ttl=self.ttl_seconds)
+
+    def get(self, widget_id: str) -> Optional[CachedWidgetData]:
+        contractor_id = self.owner(widget_id)
+        if contractor_id is None:
+            return None
+        value = self.cache.get("widget_data", widget_id, contractor_id=contractor_id)
+        return CachedWidgetData.from_bytes(contractor_id, value) if value is not None else None
+
+    def get_or_load(
+        self,
+        widget_id: str,
+        contractor_id: int,
+        loader: Callable[[], Optional[dict]]
+    ) -> Optional[CachedWidgetData]:
+        """The cached entry, built from ``loader``'s payload by one caller on a miss."""
+        def load() -> Optional[bytes]:
+            payload = loader()
+            return encode_payload(contractor_id, payload).to_bytes() if payload is not None else None
+
+        value = self.cache.get_or_load(
+            "widget_data", widget_id, load, contractor_id=contractor_id, ttl=self.ttl_seconds
+        )
+        return CachedWidgetData.from_bytes(contractor_id, value) if value is not None else None
+
+
+widget_data_cache = WidgetDataCache(shared_cache, ttl_seconds=settings.WIDGET_DATA_CACHE_TTL)
@@ -0,0 +1,66 @@
+"""
+Process pools for CPU-bound work (PDF rendering, image resizing).
+
+Work submitted here runs in spawned worker processes, so it neither holds
+the API workers' GIL nor blocks their threads for long. Functions and
+arguments must be picklable, and the functions should live in modules
+that import nothing from the app. The pool starts on first use; with 0
+workers, jobs run in the calling thread.
+"""
+import asyncio
+import logging
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, Optional, TypeVar
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class WorkerPoolError(Exception):
+    pass
+
+
+class WorkerPool:
+    def __init__(self, name: str, workers: int, timeout: float):
+        self.name = name
+        self.workers = workers
+        self.timeout = timeout
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._lock = threading.Lock()
+
+    def executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Spawned, not forked: workers do not inherit the app's pooled connections or threads
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.workers,
+                    mp_context=multiprocessing.get_context("spawn")
+                )
+            return self._executor
+
+    def run(self, fn: Callable[..., T], *args) -> T:
+        """``fn(*args)`` in a worker process; blocks the calling thread until it returns."""
+        if self.workers <= 0:
+            return fn(*args)
+        executor = self.executor()
+        try:
+            return executor.submit(fn, *args).result(timeout=self.timeout)
+        except BrokenProcessPool as e:
+            # A worker died (e.g. out of memory); start a fresh pool for the next job
+            with self._lock:
+                if self._executor is executor:
+                    self._executor = None
+            executor.shutdown(wait=False)
+            raise WorkerPoolError(f"{self.name} pool broke: {e}")
+        except FutureTimeoutError:
+            raise WorkerPoolError(f"{self.name} took longer than {self.timeout}s")
+
+    async def stop(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            await asyncio.to_thread(executor.shutdown, wait=True, cancel_futures=True)
@@ -0,0 +1,135 @@
+"""
+Shared fixtures. Every test run gets its own SQLite database, configured
+before any application module reads the settings.
+"""
+import asyncio
+import json
+import os
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Callable, Dict, List, Tuple
+
+DATA_DIR = tempfile.mkdtemp(prefix="roofquote-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(DATA_DIR, 'test.db')}"
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pytest  # noqa: E402
+
+from database import Base, SessionLocal, engine, ensure_schema  # noqa: E402
+from models import Contractor  # noqa: E402
+from services import building_footprints, lead_search  # noqa: E402
+
+
+@pytest.fixture(scope="session", autouse=True)
+def schema():
+    Base.metadata.create_all(bind=engine)
+    ensure_schema()
+    lead_search.install(engine)
+    building_footprints.install(engine)
+
+
+@pytest.fixture
+def db():
+    session = SessionLocal()
+    try:
+        yield session
+    finally:
+        session.close()
+
+
+@pytest.fixture
+def client():
+    """The API without its lifespan, so no background workers run unless a test starts them."""
+    from fastapi.testclient import TestClient
+    from main import app
+    return TestClient(app)
+
+
+@pytest.fixture
+def contractor_id(db) -> int:
+    widget_id = str(uuid.uuid4())
+    contractor = Contractor(company_name="Test Roofing", email=f"{widget_id}@example.com", widget_id=widget_id)
+    db.add(contractor)
+    db.commit()
+    return contractor.id
+
+
+@dataclass
+class StubRequest:
+    path: str
+    headers: Dict[str, str]
+    body: Any
+
+
+class StubServer:
+    """
+    Local HTTP server standing in for SendGrid, webhook receivers and CRMs.
+
+    Every POST is recorded in ``requests``; ``respond`` maps a request to
+    (status, JSON body, headers) and may be swapped by a test at any time.
+    """
+
+    def __init__(self):
+        self.requests: List[StubRequest] = []
+        self.respond: Callable[[StubRequest], Tuple[int, Any, Dict[str, str]]] = lambda request: (200, {}, {})
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                raw = self.rfile.read(int(self.headers.get("Content-Length") or 0))
+                request = StubRequest(self.path, {k.lower(): v for k, v in self.headers.items()},
+                                      json.loads(raw) if raw else None)
+                stub.requests.append(request)
+                status, body, headers = stub.respond(request)
+                payload = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(payload)))
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_port}"
+        self._thread = threading.Thread(target=self.server.serve_forever, kwargs={"poll_interval": 0.05}, daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def stub_server():
+    server = StubServer()
+    try:
+        yield server
+    finally:
+        server.close()
+
+
+def run_worker_until(worker, done: Callable[[], bool], timeout: float = 10.0) -> None:
+    """Run a background worker (``start``/``stop``) until ``done()`` holds, failing after ``timeout`` seconds."""
+
+    async def run():
+        await worker.start()
+        try:
+            deadline = time.monotonic() + timeout
+            while not await asyncio.to_thread(done):
+                if time.monotonic() > deadline:
+                    raise AssertionError(f"{type(worker).__name__} did not finish within {timeout}s")
+                await asyncio.sleep(0.02)
+        finally:
+            await worker.stop()
+
+    asyncio.run(run())
@@ -0,0 +1,71 @@
+from models import BuildingFootprint, RoofMeasurementCache
+from services import building_footprints
+from services.geo import normalize_address
+from services.roof_measurement import roof_measurement
+
+
+def square(lng, lat, size=0.0002):
+    return [[lng, lat], [lng + size, lat], [lng + size, lat + size], [lng, lat + size], [lng, lat]]
+
+
+def feature(lng, lat, size=0.0002, **properties):
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Polygon", "coordinates": [square(lng, lat, size)]},
+        "properties": properties
+    }
+
+
+def collection(*features):
+    return {"type": "FeatureCollection", "features": list(features)}
+
+
+def test_features_without_ids_from_different_files_do_not_collide(db):
+    first = list(building_footprints.parse(collection(feature(-96.80, 32.78))))
+    second = list(building_footprints.parse(collection(feature(-96.81, 32.79))))
+    assert first[0]["source_id"] != second[0]["source_id"]
+
+    building_footprints.bulk_load(db, first)
+    building_footprints.bulk_load(db, second)
+    source_ids = {first[0]["source_id"], second[0]["source_id"]}
+    assert db.query(BuildingFootprint).filter(BuildingFootprint.source_id.in_(source_ids)).count() == 2
+
+
+def test_reimporting_a_feature_without_an_id_replaces_it(db):
+    rows = list(building_footprints.parse(collection(feature(-96.82, 32.80))))
+    building_footprints.bulk_load(db, rows)
+    building_footprints.bulk_load(db, list(building_footprints.parse(collection(feature(-96.82, 32.80)))))
+    assert db.query(BuildingFootprint).filter(BuildingFootprint.source_id == rows[0]["source_id"]).count() == 1
+
+
+def test_osm_street_address_matches_a_full_quote_address(db):
+    building_footprints.bulk_load(db, building_footprints.parse(collection(
+        feature(-96.797, 32.781, **{"addr:housenumber": "123", "addr:street": "Main Street"}),
+        feature(-96.7969, 32.7811, size=0.00005, **{"addr:housenumber": "123", "addr:street": "Main Street"}),
+        feature(-96.798, 32.782, **{"addr:housenumber": "12", "addr:street": "Main Street"})
+    )))
+
+    match = building_footprints.find_by_address(db, normalize_address("123 Main St, Dallas, TX 75201"))
+
+    assert match is not None
+    assert match.address == "123 Main Street"
+    # The house, not the shed at the same address
+    assert match.area_sqft > 1000
+
+
+def test_address_without_house_number_does_not_match(db):
+    assert building_footprints.address_prefixes(normalize_address("Main St, Dallas, TX")) == []
+
+
+def test_seeded_footprint_address_resolves_to_a_footprint_measurement(db):
+    address = "77 Elm Avenue, Dallas, TX 75201"
+    building_footprints.bulk_load(db, building_footprints.parse(collection(
+        feature(-96.790, 32.790, address="77 Elm Ave", pitch="8/12")
+    )))
+    db.query(RoofMeasurementCache).delete()
+    db.commit()
+
+    measurement = roof_measurement.measure(db, address)
+
+    assert measurement.provider == "footprints"
+    assert measurement.pitch == "8/12"
@@ -0,0 +1,182 @@
+import asyncio
+from datetime import timedelta
+
+import pytest
+
+from database import SessionLocal
+from models import CRMSyncState, Lead, utcnow
+from services import crm
+
+from conftest import run_worker_until
+
+
+@pytest.fixture
+def leads(db, contractor_id):
+    changed = utcnow() - timedelta(hours=1)
+    rows = [
+        Lead(
+            contractor_id=contractor_id,
+            name=f"CRM Lead {index}",
+            email=f"crm{index}@example.com",
+            address=f"{index} Sync St",
+            status="new",
+            source="widget",
+            updated_at=changed + timedelta(minutes=index)
+        )
+        for index in range(5)
+    ]
+    db.add_all(rows)
+    db.commit()
+    return [lead.id for lead in rows]
+
+
+@pytest.fixture
+def crm_stub(monkeypatch, stub_server):
+    """The HTTP CRM adapter pointed at the stub; it accepts every lead not in ``stub_server.rejected``."""
+    stub_server.rejected = set()
+
+    def respond(request):
+        return 200, {"results": [
+            {"external_id": lead["external_id"], "error": "duplicate email"}
+            if lead["external_id"] in stub_server.rejected
+            else {"external_id": lead["external_id"], "id": f"CRM-{lead['external_id']}"}
+            for lead in request.body["leads"]
+        ]}, {}
+
+    stub_server.respond = respond
+    monkeypatch.setattr(crm, "crm_adapter", crm.HttpCRMAdapter(stub_server.url, "crm-key"))
+    return stub_server
+
+
+def sync(contractor_id: int) -> dict:
+    async def run():
+        try:
+            return await crm.sync_contractor(contractor_id, chunk_size=2)
+        finally:
+            await crm.crm_adapter.close()
+
+    return asyncio.run(run())
+
+
+def pushed_ids(requests):
+    return [lead["external_id"] for request in requests for lead in request.body["leads"]]
+
+
+def stored_state(contractor_id: int) -> CRMSyncState:
+    db = SessionLocal()
+    try:
+        return db.query(CRMSyncState).filter(CRMSyncState.contractor_id == contractor_id).one()
+    finally:
+        db.close()
+
+
+def test_watermark_stops_before_a_partly_rejected_chunk(contractor_id, leads, crm_stub):
+    crm_stub.rejected = {leads[2]}
+
+    status = sync(contractor_id)
+
+    assert status["watermark_lead_id"] == leads[1]
+    assert status["last_synced"] == 2
+    assert status["last_error"].startswith("1 of 2 leads rejected")
+    assert stored_state(contractor_id).watermark_lead_id == leads[1]
+    assert all(request.headers["authorization"] == "Bearer crm-key" for request in crm_stub.requests)
+    assert pushed_ids(crm_stub.requests) == leads[:4]
+
+
+def test_next_run_resends_the_rejected_chunk_and_finishes(contractor_id, leads, crm_stub):
+    crm_stub.rejected = {leads[2]}
+    sync(contractor_id)
+    crm_stub.requests.clear()
+    crm_stub.rejected = set()
+
+    status = sync(contractor_id)
+
+    assert pushed_ids(crm_stub.requests) == leads[2:]
+    assert status["watermark_lead_id"] == leads[4]
+    assert status["total_synced"] == 5
+    assert status["last_error"] is None
+
+
+def test_failed_request_leaves_the_watermark_alone(contractor_id, leads, crm_stub):
+    crm_stub.respond = lambda request: (502, {"error": "bad gateway"}, {})
+
+    status = sync(contractor_id)
+
+    assert status["watermark_at"] is None
+    assert status["watermark_lead_id"] == 0
+    assert status["total_synced"] == 0
+    assert "2 of 2 leads rejected" in status["last_error"]
+
+
+def test_nothing_is_resent_once_synced(contractor_id, leads, crm_stub):
+    sync(contractor_id)
+    crm_stub.requests.clear()
+
+    status = sync(contractor_id)
+
+    assert crm_stub.requests == []
+    assert status["last_synced"] == 0
+    assert status["total_synced"] == 5
+
+
+def test_sync_releases_its_lease(contractor_id, leads, crm_stub):
+    sync(contractor_id)
+
+    state = stored_state(contractor_id)
+    assert state.locked_until is None and state.claim_token is None
+
+
+def test_concurrent_first_syncs_push_each_lead_once(contractor_id, leads, crm_stub):
+    async def run():
+        try:
+            return await asyncio.gather(*(crm.sync_contractor(contractor_id, chunk_size=2) for _ in range(3)),
+                                        return_exceptions=True)
+        finally:
+            await crm.crm_adapter.close()
+
+    outcomes = asyncio.run(run())
+
+    assert sorted(pushed_ids(crm_stub.requests)) == leads
+    assert sum(isinstance(outcome, dict) for outcome in outcomes) >= 1
+    assert all(isinstance(outcome, (dict, crm.CRMSyncBusy)) for outcome in outcomes)
+    assert stored_state(contractor_id).total_synced == 5
+
+
+def test_manual_sync_is_refused_while_another_holds_the_lease(client, db, contractor_id, leads, crm_stub):
+    db.add(CRMSyncState(contractor_id=contractor_id, watermark_lead_id=0, last_synced=0, total_synced=0,
+                        locked_until=utcnow() + timedelta(minutes=5), claim_token="other-worker"))
+    db.commit()
+
+    response = client.post(f"/api/integrations/crm/sync/{contractor_id}")
+
+    assert response.status_code == 409
+    assert crm_stub.requests == []
+    assert stored_state(contractor_id).claim_token == "other-worker"
+
+
+def test_expired_lease_is_taken_over(db, contractor_id, leads, crm_stub):
+    db.add(CRMSyncState(contractor_id=contractor_id, watermark_lead_id=0, last_synced=0, total_synced=0,
+                        locked_until=utcnow() - timedelta(seconds=1), claim_token="crashed-worker"))
+    db.commit()
+
+    status = sync(contractor_id)
+
+    assert status["total_synced"] == 5
+
+
+def test_scheduler_keeps_going_after_a_contractor_fails(monkeypatch):
+    seen = []
+
+    async def fake_sync(contractor_id):
+        seen.append(contractor_id)
+        if contractor_id == 1:
+            raise crm.CRMError("CRM unreachable")
+        if contractor_id == 2:
+            raise crm.CRMSyncBusy("leased")
+
+    monkeypatch.setattr(crm, "_contractor_ids", lambda: [1, 2, 3])
+    monkeypatch.setattr(crm, "sync_contractor", fake_sync)
+
+    run_worker_until(crm.CRMSyncScheduler(interval_seconds=60), lambda: 3 in seen)
+
+    assert seen[:3] == [1, 2, 3]
@@ -0,0 +1,114 @@
+import pytest
+
+from config import settings
+from database import SessionLocal
+from models import EmailMessage
+from services.email_service import EmailDispatcher
+
+from conftest import run_worker_until
+
+
+@pytest.fixture
+def sendgrid(monkeypatch, stub_server):
+    """SendGrid replaced by the stub, which accepts mail with 202 like the real API."""
+    monkeypatch.setenv("SENDGRID_API_KEY", "test-key")
+    monkeypatch.setattr(settings, "EMAIL_API_URL", stub_server.url)
+    monkeypatch.setattr(settings, "EMAIL_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "EMAIL_BACKOFF_BASE", 0.01)
+    stub_server.respond = lambda request: (202, "", {"X-Message-Id": f"sg-{len(stub_server.requests)}"})
+    return stub_server
+
+
+@pytest.fixture
+def dispatcher():
+    return EmailDispatcher(poll_interval=0.02, batch_size=10, concurrency=2)
+
+
+def message_status(message_id: str) -> str:
+    db = SessionLocal()
+    try:
+        return db.query(EmailMessage.status).filter(EmailMessage.message_id == message_id).scalar()
+    finally:
+        db.close()
+
+
+def settled(*message_ids):
+    return lambda: all(message_status(message_id) != "queued" for message_id in message_ids)
+
+
+def queue_test_email(client, to="customer@example.com") -> str:
+    response = client.post("/api/test-email", params={"email": to})
+    assert response.status_code == 202
+    assert response.json()["status"] == "queued"
+    return response.json()["message_id"]
+
+
+def test_queued_email_is_sent_to_sendgrid(client, sendgrid, dispatcher):
+    message_id = queue_test_email(client)
+    assert sendgrid.requests == []
+
+    run_worker_until(dispatcher, settled(message_id))
+
+    status = client.get(f"/api/email-messages/{message_id}").json()
+    assert status["status"] == "sent"
+    assert status["attempts"] == 1
+    assert status["last_status_code"] == 202
+    assert status["provider_message_id"] == "sg-1"
+    [request] = sendgrid.requests
+    assert request.path == "/v3/mail/send"
+    assert request.headers["authorization"] == "Bearer test-key"
+    assert request.body["personalizations"] == [{"to": [{"email": "customer@example.com"}]}]
+
+
+def test_rate_limited_email_is_retried(client, sendgrid, dispatcher):
+    sendgrid.respond = lambda request: (429, {}, {}) if len(sendgrid.requests) == 1 else (202, "", {})
+    message_id = queue_test_email(client)
+
+    run_worker_until(dispatcher, settled(message_id))
+
+    status = client.get(f"/api/email-messages/{message_id}").json()
+    assert status["status"] == "sent"
+    assert status["attempts"] == 2
+
+
+def test_email_fails_after_max_attempts(client, sendgrid, dispatcher):
+    sendgrid.respond = lambda request: (503, {"errors": [{"message": "unavailable"}]}, {})
+    message_id = queue_test_email(client)
+
+    run_worker_until(dispatcher, settled(message_id))
+
+    status = client.get(f"/api/email-messages/{message_id}").json()
+    assert status["status"] == "failed"
+    assert status["attempts"] == 3
+    assert status["last_error"].startswith("HTTP 503")
+    assert len(sendgrid.requests) == 3
+
+
+def test_rejected_email_is_not_retried(client, sendgrid, dispatcher):
+    sendgrid.respond = lambda request: (401, {"errors": [{"message": "bad key"}]}, {})
+    message_id = queue_test_email(client)
+
+    run_worker_until(dispatcher, settled(message_id))
+
+    assert message_status(message_id) == "failed"
+    assert len(sendgrid.requests) == 1
+
+
+def test_bulk_email_is_batched_by_personalizations(client, sendgrid, dispatcher, monkeypatch):
+    monkeypatch.setattr(settings, "EMAIL_MAX_PERSONALIZATIONS", 2)
+    response = client.post("/api/send-bulk-email", json={
+        "recipients": [
+            {"email": f"owner{index}@example.com", "substitutions": {"-name-": f"Owner {index}"}}
+            for index in range(3)
+        ],
+        "subject": "Storm season",
+        "email_content": "Hi -name-"
+    })
+    assert response.status_code == 202
+    message_ids = response.json()["message_ids"]
+    assert len(message_ids) == 2
+
+    run_worker_until(dispatcher, settled(*message_ids))
+
+    assert [message_status(message_id) for message_id in message_ids] == ["sent", "sent"]
+    assert sorted(len(request.body["personalizations"]) for request in sendgrid.requests) == [1, 2]
@@ -0,0 +1,76 @@
+import uuid
+from datetime import timedelta
+
+import pytest
+from sqlalchemy import event
+
+from database import engine
+from models import Contractor, Lead, Quote, utcnow
+
+
+@pytest.fixture
+def contractor_with_leads(db):
+    widget_id = str(uuid.uuid4())
+    contractor = Contractor(company_name="Paging Roofing", email=f"{widget_id}@example.com", widget_id=widget_id)
+    db.add(contractor)
+    db.flush()
+    now = utcnow()
+    for index in range(60):
+        lead = Lead(
+            contractor_id=contractor.id,
+            name=f"Lead {index}",
+            email=f"lead{index}@example.com",
+            address=f"{index} Main St",
+            status="new",
+            created_at=now - timedelta(minutes=index)
+        )
+        db.add(lead)
+        db.flush()
+        for age in range(3):
+            db.add(Quote(
+                lead_id=lead.id,
+                address=lead.address,
+                roof_size_sqft=2000,
+                selected_tier="good",
+                base_price=10000 + age,
+                total_price=10000 + age,
+                created_at=now - timedelta(minutes=index, seconds=age)
+            ))
+    db.commit()
+    return contractor.id
+
+
+@pytest.fixture
+def statements():
+    executed = []
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        executed.append(statement)
+
+    event.listen(engine, "before_cursor_execute", record)
+    yield executed
+    event.remove(engine, "before_cursor_execute", record)
+
+
+def count_statements(client, statements, path, **params):
+    statements.clear()
+    response = client.get(path, params=params)
+    assert response.status_code == 200
+    return len(statements), response.json()
+
+
+def test_lead_list_statement_count_does_not_grow_with_page_size(client, contractor_with_leads, statements):
+    path = f"/api/leads/contractor/{contractor_with_leads}"
+
+    one, one_page = count_statements(client, statements, path, limit=1)
+    fifty, fifty_page = count_statements(client, statements, path, limit=50)
+
+    assert len(one_page) == 1
+    assert len(fifty_page) == 50
+    assert one == fifty
+
+
+def test_lead_list_returns_each_leads_latest_quote(client, contractor_with_leads):
+    leads = client.get(f"/api/leads/contractor/{contractor_with_leads}", params={"limit": 50}).json()
+
+    assert all(lead["latest_quote"]["total_price"] == 10000 for lead in leads)
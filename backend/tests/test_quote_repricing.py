@@ -0,0 +1,106 @@
+import threading
+from datetime import timedelta
+
+import pytest
+
+from database import SessionLocal
+from models import Lead, Pricing, Quote, RepricingJob, utcnow
+from services import quote_repricing
+
+
+@pytest.fixture
+def quotes(db, contractor_id):
+    db.add(Pricing(contractor_id=contractor_id, good_tier_price=5.0, better_tier_price=7.0, best_tier_price=9.0,
+                   removal_price=1.0, permit_price=300.0))
+    lead = Lead(contractor_id=contractor_id, name="Open Lead", email="open@example.com", address="1 Reprice Rd",
+                status="new")
+    db.add(lead)
+    db.flush()
+    for index in range(30):
+        db.add(Quote(
+            lead_id=lead.id, address=lead.address, roof_size_sqft=2000 + index, selected_tier="good",
+            base_price=1, removal_cost=1, permit_cost=1, total_price=3,
+            quote_data={"include_removal": True, "include_permit": True}
+        ))
+    # Captured by the widget: no options, nothing itemized
+    db.add(Quote(lead_id=lead.id, address=lead.address, roof_size_sqft=2000, selected_tier="good",
+                 base_price=9000, total_price=9000, quote_data={"selected_tier": "good"}))
+    db.commit()
+    return lead.id
+
+
+def queue_job(contractor_id: int) -> int:
+    db = SessionLocal()
+    try:
+        job = quote_repricing.enqueue(db, contractor_id)
+        db.commit()
+        return job.id
+    finally:
+        db.close()
+
+
+def load(model, **criteria):
+    db = SessionLocal()
+    try:
+        return db.query(model).filter_by(**criteria).all()
+    finally:
+        db.close()
+
+
+def test_job_reprices_known_quotes_and_skips_widget_captures(contractor_id, quotes):
+    job_id = queue_job(contractor_id)
+
+    quote_repricing.run_job(job_id, chunk_size=7)
+
+    [job] = load(RepricingJob, id=job_id)
+    assert (job.status, job.processed_quotes, job.updated_quotes, job.skipped_quotes) == ("completed", 31, 30, 1)
+    assert job.locked_until is None and job.claim_token is None
+    widget_quote = next(quote for quote in load(Quote, lead_id=quotes) if quote.removal_cost in (None, 0))
+    assert widget_quote.total_price == 9000
+
+
+def test_concurrent_workers_run_a_job_once(contractor_id, quotes):
+    job_id = queue_job(contractor_id)
+
+    workers = [threading.Thread(target=quote_repricing.run_job, args=(job_id, 5)) for _ in range(4)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+    [job] = load(RepricingJob, id=job_id)
+    assert (job.status, job.processed_quotes, job.updated_quotes) == ("completed", 31, 30)
+    assert all(len(quote.quote_data.get("price_history", [])) <= 1 for quote in load(Quote, lead_id=quotes))
+
+
+def test_running_job_is_left_alone_while_leased(contractor_id, quotes):
+    job_id = queue_job(contractor_id)
+    db = SessionLocal()
+    job = db.get(RepricingJob, job_id)
+    job.status, job.claim_token, job.locked_until = "running", "other-worker", utcnow() + timedelta(minutes=5)
+    db.commit()
+    db.close()
+
+    assert quote_repricing._next_job_id() != job_id
+    quote_repricing.run_job(job_id)
+
+    [job] = load(RepricingJob, id=job_id)
+    assert (job.status, job.processed_quotes, job.claim_token) == ("running", 0, "other-worker")
+
+
+def test_job_with_an_expired_lease_resumes_from_its_keyset_position(contractor_id, quotes):
+    job_id = queue_job(contractor_id)
+    first_ten = sorted(quote.id for quote in load(Quote, lead_id=quotes))[:10]
+    db = SessionLocal()
+    job = db.get(RepricingJob, job_id)
+    job.status, job.claim_token, job.locked_until = "running", "crashed-worker", utcnow() - timedelta(seconds=1)
+    job.started_at, job.total_quotes, job.last_quote_id, job.processed_quotes = utcnow(), 31, first_ten[-1], 10
+    db.commit()
+    db.close()
+
+    assert quote_repricing._next_job_id() == job_id
+    quote_repricing.run_job(job_id)
+
+    [job] = load(RepricingJob, id=job_id)
+    assert (job.status, job.processed_quotes, job.updated_quotes) == ("completed", 31, 20)
+    assert all("price_history" not in quote.quote_data for quote in load(Quote, lead_id=quotes) if quote.id in first_ten)
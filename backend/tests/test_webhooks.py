@@ -0,0 +1,122 @@
+import pytest
+
+from config import settings
+from database import SessionLocal
+from models import Webhook, WebhookDelivery
+from services.webhooks import WebhookDispatcher
+
+from conftest import run_worker_until
+
+
+@pytest.fixture
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(settings, "WEBHOOK_MAX_ATTEMPTS", 3)
+    monkeypatch.setattr(settings, "WEBHOOK_BACKOFF_BASE", 0.01)
+    monkeypatch.setattr(settings, "WEBHOOK_HTTP2", False)
+
+
+def new_dispatcher() -> WebhookDispatcher:
+    # One per run: its wakeup event belongs to the event loop it first ran on
+    return WebhookDispatcher(poll_interval=0.02, batch_size=10, per_host_concurrency=2)
+
+
+@pytest.fixture
+def dispatcher(fast_retries):
+    return new_dispatcher()
+
+
+@pytest.fixture
+def lead_webhook(db, contractor_id, stub_server):
+    db.add(Webhook(contractor_id=contractor_id, event_type="lead.created", url=f"{stub_server.url}/hooks/leads"))
+    db.commit()
+    return contractor_id
+
+
+def create_lead(client, contractor_id) -> int:
+    response = client.post("/api/leads/", json={
+        "contractor_id": contractor_id,
+        "name": "Webhook Lead",
+        "email": "webhook@example.com",
+        "address": "5 Hook Ln"
+    })
+    assert response.status_code == 200
+    return response.json()["id"]
+
+
+def delivery_for(lead_id: int) -> WebhookDelivery:
+    db = SessionLocal()
+    try:
+        return next(
+            delivery for delivery in db.query(WebhookDelivery).filter(WebhookDelivery.event_type == "lead.created")
+            if delivery.payload["data"]["id"] == lead_id
+        )
+    finally:
+        db.close()
+
+
+def settled(lead_id: int):
+    return lambda: delivery_for(lead_id).status != "pending"
+
+
+def test_created_lead_is_queued_and_delivered(client, lead_webhook, stub_server, dispatcher):
+    lead_id = create_lead(client, lead_webhook)
+    assert delivery_for(lead_id).status == "pending"
+
+    run_worker_until(dispatcher, settled(lead_id))
+
+    delivery = delivery_for(lead_id)
+    assert delivery.status == "delivered"
+    assert delivery.attempts == 1
+    assert delivery.last_status_code == 200
+    [request] = stub_server.requests
+    assert request.path == "/hooks/leads"
+    assert request.headers["x-webhook-event"] == "lead.created"
+    assert request.headers["x-webhook-delivery"] == str(delivery.id)
+    assert request.body["data"]["email"] == "webhook@example.com"
+
+
+def test_failing_receiver_is_retried_then_dead_lettered(client, lead_webhook, stub_server, dispatcher):
+    stub_server.respond = lambda request: (503, {"error": "unavailable"}, {})
+    lead_id = create_lead(client, lead_webhook)
+
+    run_worker_until(dispatcher, settled(lead_id))
+
+    delivery = delivery_for(lead_id)
+    assert delivery.status == "dead"
+    assert delivery.attempts == 3
+    assert delivery.last_error == "HTTP 503"
+    assert len(stub_server.requests) == 3
+
+
+def test_receiver_recovering_before_the_last_attempt_gets_the_event(client, lead_webhook, stub_server, dispatcher):
+    stub_server.respond = lambda request: (500, {}, {}) if len(stub_server.requests) < 2 else (200, {}, {})
+    lead_id = create_lead(client, lead_webhook)
+
+    run_worker_until(dispatcher, settled(lead_id))
+
+    delivery = delivery_for(lead_id)
+    assert delivery.status == "delivered"
+    assert delivery.attempts == 2
+
+
+def test_gone_receiver_is_dead_lettered_at_once(client, lead_webhook, stub_server, dispatcher):
+    stub_server.respond = lambda request: (410, {}, {})
+    lead_id = create_lead(client, lead_webhook)
+
+    run_worker_until(dispatcher, settled(lead_id))
+
+    assert delivery_for(lead_id).status == "dead"
+    assert len(stub_server.requests) == 1
+
+
+def test_dead_delivery_can_be_requeued(client, lead_webhook, stub_server, dispatcher):
+    stub_server.respond = lambda request: (410, {}, {})
+    lead_id = create_lead(client, lead_webhook)
+    run_worker_until(dispatcher, settled(lead_id))
+
+    stub_server.respond = lambda request: (200, {}, {})
+    response = client.post(f"/api/integrations/webhooks/deliveries/{delivery_for(lead_id).id}/retry")
+    assert response.status_code == 202
+    run_worker_until(new_dispatcher(), settled(lead_id))
+
+    assert delivery_for(lead_id).status == "delivered"
@@ -300,6 +300,11 @@ const Leads = () => {
   };
 
   const handleQuotePDF = (lead: Lead) => {
+    if (lead.latest_quote) {
+      // Rendered and stored by the backend, so repeat downloads reuse the same file
+      window.open(`http://localhost:8000/api/quotes/${lead.latest_quote.id}/pdf`, '_blank');
+      return;
+    }
     const pdf = generateLeadQuotePDF(lead);
     const fileName = `quote-${lead.name.replace(/\s+/g, '-').toLowerCase()}-${new Date().toISOString().split('T')[0]}.pdf`;
     pdf.save(fileName);
@@ -310,7 +315,9 @@ const Leads = () => {
 
     try {
       let pdfBase64 = null;
-      if (includePdf) {
+      // Leads with a quote get the server-rendered PDF attached by the backend
+      const quoteId = includePdf && emailModalLead.latest_quote ? emailModalLead.latest_quote.id : null;
+      if (includePdf && !quoteId) {
         // Use the same PDF generation that respects template settings
         const pdf = generateLeadQuotePDF(emailModalLead);
         const pdfBlob = pdf.output('blob');
@@ -334,6 +341,7 @@ const Leads = () => {
           subject: `Your Roofing Quote - ${emailModalLead.address}`,
           email_content: emailContent,
           pdf_base64: pdfBase64,
+          quote_id: quoteId,
           lead_name: emailModalLead.name,
         }),
       });
@@ -10,6 +10,26 @@ const api = axios.create({
   },
 });
 
+// Dashboard reads may be served by a lagging read replica. After a write, the
+// API answers with X-Read-Primary: <seconds>; until then, ask for the primary
+// so the dashboard shows its own changes.
+let readPrimaryUntil = 0;
+
+api.interceptors.request.use((config) => {
+  if (Date.now() < readPrimaryUntil) {
+    config.headers.set('X-Read-Primary', '1');
+  }
+  return config;
+});
+
+api.interceptors.response.use((response) => {
+  const seconds = Number(response.headers['x-read-primary']);
+  if (seconds > 0) {
+    readPrimaryUntil = Math.max(readPrimaryUntil, Date.now() + seconds * 1000);
+  }
+  return response;
+});
+
 export interface PricingData {
   good_tier_price: number;
   good_tier_name: string;